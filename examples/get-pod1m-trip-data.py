@@ -35,11 +35,14 @@ You must have access to that device (i.e. be a member of the Organization this d
 """
 import logging
 import sys
+from datetime import timedelta
 from pprint import pprint
 
 from iotile_cloud.api.connection import Api
 from iotile_cloud.utils.main import BaseMain
 from iotile_cloud.stream.data import StreamData
+from iotile_cloud.stream.join import asof_join
+from iotile_cloud.stream.topk import TopKEvents
 from iotile_cloud.utils.gid import IOTileDeviceSlug, IOTileStreamSlug, IOTileProjectSlug, IOTileVariableSlug
 from iotile_cloud.api.exceptions import HttpNotFoundError, HttpClientError
 from iotile_cloud.utils.basic import datetime_to_str
@@ -246,6 +249,15 @@ class TripData(BaseMain):
                 # pprint(humidity_data[0])
                 # pprint(temp_data[0])
 
+                # Align the environmental data onto a single timeline. Each row has the latest reading
+                # of each stream, or NaN if there was none within the last 15 minutes
+                environment = asof_join([
+                    ('pressure', pressure_data),
+                    ('humidity', humidity_data),
+                    ('temperature', temp_data),
+                ], tolerance=timedelta(minutes=15))
+                logger.info('Got {} aligned environmental data rows'.format(len(environment['timestamp'])))
+
                 # Get Shock Events
                 shock_events = self._get_range('event', self._get_stream_slug(TRIP_VARS['SHOCK_EVENTS']),
                                                start_ts, end_ts)
@@ -253,15 +265,10 @@ class TripData(BaseMain):
                 # pprint(shock_events[0])
 
                 # Find the worst case accelerometer G event, and download the detailed waveforms for it
-                max_peak_event = None
-                for event in shock_events:
-                    if max_peak_event == None:
-                        max_peak_event = event
-                        continue
-                    if event['extra_data']['peak'] > max_peak_event['extra_data']['peak']:
-                        max_peak_event = event
-                # Download event details (waveform) for max peak event
-                max_peak_detailed_data = self.api.event(max_peak_event['id']).data.get()
+                selector = TopKEvents(1, key='peak')
+                selector.add_page(shock_events)
+                # Download event details (waveform) for max peak event only
+                max_peak_event, max_peak_detailed_data = selector.fetch_details(self.api)[None][0]
                 # pprint(max_peak_detailed_data)
                 logger.info('Got max peak waveform with {} x, {} y and {} z points'.format(
                     len(max_peak_detailed_data['acceleration_data']['x']),
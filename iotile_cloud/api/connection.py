@@ -44,6 +44,9 @@ class RestResource(object):
         if 'use_token' not in self._store:
             self._store['use_token'] = False
 
+        # Size (in bytes) of the last response body received by get()
+        self.last_response_size = None
+
     def __call__(self, id=None):
         """
         Returns a new instance of self modified by one or more of the available
@@ -157,6 +160,7 @@ class RestResource(object):
         except requests.exceptions.SSLError as err:
             raise HttpCouldNotVerifyServerError("Could not verify the server's SSL certificate", err)
 
+        self.last_response_size = len(resp.content)
         return self._process_response(resp)
 
     def post(self, data=None, **kwargs):
@@ -309,6 +313,9 @@ class Api(object):
         self.session = requests.Session()
         self.session.verify = verify
 
+        # Kept to build equivalent sessions (e.g. in report worker processes)
+        self._timeout = timeout
+        self._retries = retries
         if retries is not None or timeout is not None:
             adapter = _TimeoutHTTPAdapter(max_retries=retries, timeout=timeout)
             self.session.mount('https://', adapter)
@@ -0,0 +1,287 @@
+"""Streaming time bucket aggregation of stream data.
+
+BucketAggregator consumes pages of records as they are downloaded and keeps,
+for every time bucket, the count, sum, min, max, first and last values in numpy
+arrays. Memory use depends only on the number of buckets, not on the number of
+readings.
+
+Buckets can be calendar aligned ('hour', 'day', 'week' or 'month') in any
+timezone, or fixed intervals (in seconds, or a timedelta) aligned to the UTC
+epoch. Aggregators with the same configuration can be merged, so partial
+results computed by different workers (threads, processes or machines) can be
+combined.
+
+Example:
+
+    aggregator = BucketAggregator('day', tz='America/Los_Angeles')
+    aggregator.add_data(StreamData(slug, api), start=t0, end=t1)
+    result = aggregator.result()
+    # result['bucket'], result['count'], result['mean'], ...
+
+Requires numpy.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from dateutil import tz as dateutil_tz
+from dateutil.relativedelta import relativedelta
+
+from ..utils.timestamp import UTC, parse_timestamps
+
+HAS_NUMPY = True
+try:
+    import numpy as np
+except ImportError:
+    HAS_NUMPY = False
+
+CALENDAR_INTERVALS = ('hour', 'day', 'week', 'month')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+_US_PER_SECOND = 1000000
+_US_PER_HOUR = 3600 * _US_PER_SECOND
+_MIN_INT64 = -(2 ** 63)
+_MAX_INT64 = 2 ** 63 - 1
+
+
+def _to_us(dt):
+    delta = dt - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * _US_PER_SECOND + delta.microseconds
+
+
+def _from_us(value):
+    return _EPOCH + timedelta(microseconds=int(value))
+
+
+class BucketAggregator(object):
+    """
+    Per time bucket count/sum/min/max/mean/first/last of stream values
+
+    Args:
+        interval: 'hour', 'day', 'week', 'month', or a fixed interval in seconds (or a timedelta)
+        tz: Timezone name (e.g. 'America/Los_Angeles') or tzinfo for calendar buckets. Defaults to UTC
+    """
+
+    def __init__(self, interval='hour', tz=None):
+        if not HAS_NUMPY:
+            raise RuntimeError('You must have numpy installed to use BucketAggregator')
+
+        if isinstance(interval, timedelta):
+            interval = interval.total_seconds()
+        if interval not in CALENDAR_INTERVALS:
+            if not isinstance(interval, (int, float)) or interval <= 0:
+                raise ValueError('Illegal bucket interval: {0}'.format(interval))
+        self.interval = interval
+
+        self.tz_name = tz if isinstance(tz, str) else None
+        if isinstance(tz, str):
+            tz = dateutil_tz.gettz(tz)
+            if tz is None:
+                raise ValueError('Unknown timezone: {0}'.format(self.tz_name))
+        self._tz = tz or UTC
+
+        self._keys = np.array([], dtype='int64')
+        self._stats = self._empty(0)
+
+    @staticmethod
+    def _empty(size):
+        return {
+            'count': np.zeros(size, dtype='int64'),
+            'sum': np.zeros(size, dtype='float64'),
+            'min': np.full(size, np.inf),
+            'max': np.full(size, -np.inf),
+            'first_ts': np.full(size, _MAX_INT64, dtype='int64'),
+            'first': np.full(size, np.nan),
+            'last_ts': np.full(size, _MIN_INT64, dtype='int64'),
+            'last': np.full(size, np.nan),
+        }
+
+    def _floor_local(self, dt):
+        local = dt.astimezone(self._tz)
+        if self.interval == 'hour':
+            return local.replace(minute=0, second=0, microsecond=0)
+        local = local.replace(hour=0, minute=0, second=0, microsecond=0)
+        if self.interval == 'week':
+            local -= timedelta(days=local.weekday())
+        elif self.interval == 'month':
+            local = local.replace(day=1)
+        return local
+
+    def _calendar_edges(self, first_us, last_us):
+        current = self._floor_local(_from_us(first_us))
+        edges = []
+        if self.interval == 'hour':
+            # Step in absolute time, so DST changes never merge or split hours
+            edge = _to_us(current)
+            while edge <= last_us:
+                edges.append(edge)
+                edge += _US_PER_HOUR
+            return np.array(edges, dtype='int64')
+
+        step = {'day': relativedelta(days=1), 'week': relativedelta(weeks=1), 'month': relativedelta(months=1)}
+        naive = current.replace(tzinfo=None)
+        while True:
+            edge = _to_us(naive.replace(tzinfo=self._tz))
+            if edge > last_us:
+                break
+            edges.append(edge)
+            naive += step[self.interval]
+        return np.unique(np.array(edges, dtype='int64'))
+
+    def bucket_keys(self, timestamps_us):
+        """
+        Args:
+            timestamps_us: int64 array of timestamps (microseconds since the epoch)
+
+        Returns:
+            int64 array with the start of the bucket of each timestamp (microseconds since the epoch)
+        """
+        timestamps_us = np.asarray(timestamps_us, dtype='int64')
+        if not len(timestamps_us):
+            return timestamps_us
+
+        if self.interval not in CALENDAR_INTERVALS:
+            width = int(self.interval * _US_PER_SECOND)
+            return (timestamps_us // width) * width
+
+        edges = self._calendar_edges(timestamps_us.min(), timestamps_us.max())
+        return edges[np.searchsorted(edges, timestamps_us, side='right') - 1]
+
+    def _combine(self, keys, stats):
+        union = np.union1d(self._keys, keys)
+        if len(union) != len(self._keys):
+            combined = self._empty(len(union))
+            index = np.searchsorted(union, self._keys)
+            for name, values in self._stats.items():
+                combined[name][index] = values
+            self._keys = union
+            self._stats = combined
+
+        index = np.searchsorted(self._keys, keys)
+        current = self._stats
+        current['count'][index] += stats['count']
+        current['sum'][index] += stats['sum']
+        current['min'][index] = np.minimum(current['min'][index], stats['min'])
+        current['max'][index] = np.maximum(current['max'][index], stats['max'])
+
+        earlier = stats['first_ts'] < current['first_ts'][index]
+        current['first_ts'][index[earlier]] = stats['first_ts'][earlier]
+        current['first'][index[earlier]] = stats['first'][earlier]
+
+        later = stats['last_ts'] >= current['last_ts'][index]
+        current['last_ts'][index[later]] = stats['last_ts'][later]
+        current['last'][index[later]] = stats['last'][later]
+
+    def add(self, timestamps, values):
+        """
+        Add a batch of readings
+
+        Args:
+            timestamps: datetime64 array (or int64 microseconds since the epoch)
+            values: float array. NaN values are ignored
+        """
+        timestamps = np.asarray(timestamps)
+        if np.issubdtype(timestamps.dtype, np.datetime64):
+            timestamps = timestamps.astype('datetime64[us]').astype('int64')
+        timestamps = timestamps.astype('int64')
+        values = np.asarray(values, dtype='float64')
+
+        valid = ~np.isnan(values)
+        timestamps = timestamps[valid]
+        values = values[valid]
+        if not len(values):
+            return
+
+        keys = self.bucket_keys(timestamps)
+        order = np.lexsort((timestamps, keys))
+        keys = keys[order]
+        timestamps = timestamps[order]
+        values = values[order]
+
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        ends = np.r_[starts[1:], len(keys)] - 1
+        self._combine(keys[starts], {
+            'count': ends - starts + 1,
+            'sum': np.add.reduceat(values, starts),
+            'min': np.minimum.reduceat(values, starts),
+            'max': np.maximum.reduceat(values, starts),
+            'first_ts': timestamps[starts],
+            'first': values[starts],
+            'last_ts': timestamps[ends],
+            'last': values[ends],
+        })
+
+    def add_page(self, records, value_field='value'):
+        """
+        Add a page of records (dicts or DataRecords with 'timestamp' and value_field)
+        """
+        if not records:
+            return
+        timestamps = parse_timestamps([item['timestamp'] for item in records], unit='us')
+        values = np.array([item[value_field] for item in records], dtype='float64')
+        self.add(timestamps, values)
+
+    def add_data(self, data, value_field='value', **kwargs):
+        """
+        Download and aggregate all pages of a StreamData or RawData object
+
+        Args:
+            data: BaseData object (e.g. StreamData)
+            value_field: Record field to aggregate (e.g. 'value' or 'output_value')
+            kwargs: Query arguments (e.g. start, end)
+        """
+        for page in data.iter_pages(fields=['timestamp', value_field], **kwargs):
+            self.add_page(page, value_field=value_field)
+
+    def merge(self, other):
+        """
+        Merge the partial results of another aggregator (with the same interval and timezone) into this one
+        """
+        if self.interval != other.interval or self._tz != other._tz:
+            raise ValueError('Cannot merge aggregators with different intervals or timezones')
+        if len(other._keys):
+            self._combine(other._keys, other._stats)
+        return self
+
+    def __len__(self):
+        return len(self._keys)
+
+    def result(self):
+        """
+        Returns:
+            OrderedDict of numpy arrays, one entry per bucket in time order: 'bucket' (UTC start of
+            the bucket, as datetime64[us]), 'count', 'sum', 'min', 'max', 'mean', 'first' and 'last'
+        """
+        stats = self._stats
+        result = OrderedDict()
+        result['bucket'] = self._keys.astype('datetime64[us]')
+        result['count'] = stats['count'].copy()
+        result['sum'] = stats['sum'].copy()
+        result['min'] = stats['min'].copy()
+        result['max'] = stats['max'].copy()
+        result['mean'] = stats['sum'] / np.maximum(stats['count'], 1)
+        result['first'] = stats['first'].copy()
+        result['last'] = stats['last'].copy()
+        return result
+
+    def to_dict(self):
+        """
+        Returns:
+            JSON serializable dict with the partial results. See from_dict()
+        """
+        return {
+            'interval': self.interval,
+            'tz': self.tz_name,
+            'keys': self._keys.tolist(),
+            'stats': {name: values.tolist() for name, values in self._stats.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuild an aggregator from to_dict() output (for a named or UTC timezone)
+        """
+        aggregator = cls(data['interval'], tz=data['tz'])
+        aggregator._keys = np.array(data['keys'], dtype='int64')
+        empty = cls._empty(0)
+        aggregator._stats = {name: np.array(data['stats'][name], dtype=empty[name].dtype) for name in empty}
+        return aggregator
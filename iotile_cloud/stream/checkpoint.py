@@ -0,0 +1,162 @@
+"""Checkpoints and file sinks for long running data downloads.
+
+A download with a checkpoint writes every page to a sink, and then records in
+the checkpoint file how far it got (next page, page size, number of records and
+the sink position). If the download fails, running it again with the same
+checkpoint and sink truncates the sink back to the last committed page and
+continues from there.
+
+Example:
+
+    stream_data = StreamData(stream_slug, api)
+    with JsonLinesSink('data.jsonl') as sink:
+        stream_data.initialize_from_server(start=t0, end=t1, sink=sink,
+                                           checkpoint=DownloadCheckpoint('data.checkpoint'))
+
+    with JsonLinesSink('data.jsonl') as sink:
+        for item in sink.read():
+            print(item['value'])
+"""
+import io
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def write_json_atomic(path, data):
+    """
+    Write data as JSON, replacing path atomically (so a crash never leaves a partial file)
+
+    Args:
+        path: Destination file path
+        data: JSON serializable object
+    """
+    tmp_path = '{0}.tmp'.format(path)
+    with open(tmp_path, 'w') as fp:
+        json.dump(data, fp, sort_keys=True)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+
+class DownloadCheckpoint(object):
+    """
+    Persisted progress of a paged download
+
+    Args:
+        path: Checkpoint file path
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """
+        Returns:
+            The last saved state (dict), or None if there is no checkpoint yet
+        """
+        if not os.path.isfile(self.path):
+            return None
+
+        with open(self.path, 'r') as fp:
+            return json.load(fp)
+
+    def save(self, state):
+        """
+        Args:
+            state: dict with the download state
+        """
+        write_json_atomic(self.path, state)
+
+    def clear(self):
+        """Delete the checkpoint, so the next download starts from scratch"""
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+class JsonLinesSink(object):
+    """
+    Append-only file of records, one JSON object per line
+
+    Records are written as they are downloaded so memory use stays bounded.
+    DataRecord tuples (see BaseData fields) are written as dicts.
+
+    Args:
+        path: Output file path. New records are appended to any existing content
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _open(self):
+        if self._fp is None:
+            self._fp = io.open(self.path, 'ab')
+        return self._fp
+
+    def write(self, records):
+        """
+        Args:
+            records: list of dicts or DataRecord tuples
+        """
+        fp = self._open()
+        for item in records:
+            if hasattr(item, '_asdict'):
+                item = item._asdict()
+            fp.write(json.dumps(item).encode('utf-8'))
+            fp.write(b'\n')
+
+    def flush(self):
+        """Flush written records to disk"""
+        fp = self._open()
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    def position(self):
+        """
+        Returns:
+            Current size of the file (in bytes)
+        """
+        fp = self._open()
+        fp.flush()
+        return fp.seek(0, io.SEEK_END)
+
+    def truncate(self, position):
+        """
+        Discard everything written after position
+
+        Args:
+            position: File position previously returned by position()
+        """
+        fp = self._open()
+        fp.flush()
+        fp.truncate(position)
+        fp.seek(0, io.SEEK_END)
+
+    def read(self):
+        """
+        Returns:
+            Generator of records (as dicts) stored in the file
+        """
+        if self._fp is not None:
+            self._fp.flush()
+        if not os.path.isfile(self.path):
+            return
+
+        with io.open(self.path, 'rb') as fp:
+            for line in fp:
+                if line.strip():
+                    yield json.loads(line.decode('utf-8'))
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
@@ -0,0 +1,235 @@
+"""Compact binary encoding of stream data segments.
+
+A segment is a sorted run of (timestamp, value) readings. Readings are usually
+taken at a regular interval and values change slowly, so:
+
+ - timestamps (microseconds since the epoch) are stored as the first timestamp,
+   then the first delta and the delta-of-deltas, as zigzag varints. A regular
+   stream takes one byte per reading.
+ - values (float64) are XORed with the previous value, and only the non zero
+   bytes of the XOR are stored, after a one byte header with the number of
+   trailing zero bytes and significant bytes. Repeated values take one byte.
+
+This is the Gorilla (Facebook TSDB) scheme, byte aligned instead of bit aligned
+so both the encoder and the decoder are vectorized with numpy.
+
+Example:
+
+    data = encode_records(stream_data.data)
+    timestamps, values = decode(data)
+
+Requires numpy.
+"""
+import os
+import struct
+
+from ..utils.timestamp import parse_timestamps
+
+HAS_NUMPY = True
+try:
+    import numpy as np
+except ImportError:
+    HAS_NUMPY = False
+
+MAGIC = b'IOTS'
+VERSION = 1
+# Magic, version, number of readings, size of the timestamp varints, first timestamp
+_HEADER = struct.Struct('<4sBIIq')
+_MAX_VARINT_BYTES = 10
+
+
+class SegmentFormatError(ValueError):
+    pass
+
+
+def _zigzag(values):
+    values = values.astype('int64')
+    return ((values << 1) ^ (values >> 63)).view('uint64')
+
+
+def _unzigzag(values):
+    return ((values >> np.uint64(1)).view('int64') ^ -(values & np.uint64(1)).view('int64'))
+
+
+def encode_varints(values):
+    """
+    Args:
+        values: uint64 array
+
+    Returns:
+        uint8 array with the LEB128 varint encoding of every value
+    """
+    values = np.asarray(values, dtype='uint64')
+    if not len(values):
+        return np.array([], dtype='uint8')
+
+    shifts = np.arange(_MAX_VARINT_BYTES, dtype='uint64') * np.uint64(7)
+    groups = (values[:, None] >> shifts[None, :]) & np.uint64(0x7f)
+    # Number of 7 bit groups needed for every value (at least one)
+    lengths = np.maximum(np.sum((values[:, None] >> shifts[None, :]) != 0, axis=1), 1)
+
+    position = np.arange(_MAX_VARINT_BYTES)[None, :]
+    groups |= np.where(position < (lengths - 1)[:, None], np.uint64(0x80), np.uint64(0))
+    return groups[position < lengths[:, None]].astype('uint8')
+
+
+def decode_varints(data):
+    """
+    Args:
+        data: uint8 array of LEB128 varints
+
+    Returns:
+        uint64 array of the decoded values
+    """
+    data = np.asarray(data, dtype='uint8')
+    if not len(data):
+        return np.array([], dtype='uint64')
+    last = (data & 0x80) == 0
+    if not last[-1]:
+        raise SegmentFormatError('Truncated varint')
+
+    ends = np.flatnonzero(last)
+    starts = np.r_[0, ends[:-1] + 1]
+    group = np.cumsum(np.r_[0, last[:-1]])
+    position = np.arange(len(data)) - starts[group]
+    shifted = (data & 0x7f).astype('uint64') << (position.astype('uint64') * np.uint64(7))
+    return np.bitwise_or.reduceat(shifted, starts)
+
+
+def _encode_values(values):
+    bits = values.view('uint64')
+    xor = bits ^ np.r_[np.uint64(0), bits[:-1]]
+    xor_bytes = xor.astype('<u8').view('uint8').reshape(-1, 8)
+
+    nonzero = xor_bytes != 0
+    has_bits = nonzero.any(axis=1)
+    trailing = np.where(has_bits, np.argmax(nonzero, axis=1), 0)
+    leading = np.where(has_bits, np.argmax(nonzero[:, ::-1], axis=1), 8)
+    significant = 8 - leading - trailing
+
+    position = np.arange(8)[None, :]
+    mask = (position >= trailing[:, None]) & (position < (trailing + significant)[:, None])
+    headers = ((trailing << 4) | significant).astype('uint8')
+    return headers, xor_bytes[mask]
+
+
+def _decode_values(headers, payload):
+    trailing = (headers >> 4).astype('int64')
+    significant = (headers & 0x0f).astype('int64')
+    if np.any(trailing + significant > 8) or significant.sum() != len(payload):
+        raise SegmentFormatError('Corrupted value data')
+
+    position = np.arange(8)[None, :]
+    mask = (position >= trailing[:, None]) & (position < (trailing + significant)[:, None])
+    xor_bytes = np.zeros((len(headers), 8), dtype='uint8')
+    xor_bytes[mask] = payload
+    xor = xor_bytes.reshape(-1).view('<u8').astype('uint64')
+    return np.bitwise_xor.accumulate(xor).view('float64')
+
+
+def encode(timestamps, values):
+    """
+    Encode a segment of readings
+
+    Args:
+        timestamps: datetime64 array (or int64 microseconds since the epoch), in increasing order
+        values: float64 values
+
+    Returns:
+        Encoded segment (bytes)
+    """
+    if not HAS_NUMPY:
+        raise RuntimeError('You must have numpy installed to use encode()')
+
+    timestamps = np.asarray(timestamps)
+    if np.issubdtype(timestamps.dtype, np.datetime64):
+        timestamps = timestamps.astype('datetime64[us]')
+    timestamps = timestamps.astype('int64')
+    values = np.ascontiguousarray(values, dtype='float64')
+    if len(timestamps) != len(values):
+        raise ValueError('timestamps and values must have the same length')
+
+    count = len(timestamps)
+    first = int(timestamps[0]) if count else 0
+    deltas = np.diff(timestamps)
+    # First delta, then delta of deltas
+    ts_data = encode_varints(_zigzag(np.r_[deltas[:1], np.diff(deltas)]))
+    headers, payload = _encode_values(values)
+
+    return b''.join([
+        _HEADER.pack(MAGIC, VERSION, count, len(ts_data), first),
+        ts_data.tobytes(),
+        headers.tobytes(),
+        payload.tobytes(),
+    ])
+
+
+def decode(data):
+    """
+    Decode a segment encoded with encode()
+
+    Args:
+        data: Encoded segment (bytes)
+
+    Returns:
+        (timestamps, values) where timestamps is a datetime64[us] array and values a float64 array
+
+    Raises:
+        SegmentFormatError: if data is not a valid segment
+    """
+    if not HAS_NUMPY:
+        raise RuntimeError('You must have numpy installed to use decode()')
+
+    if len(data) < _HEADER.size:
+        raise SegmentFormatError('Segment is too short')
+    magic, version, count, ts_size, first = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise SegmentFormatError('Not a version {0} stream segment'.format(VERSION))
+
+    buffer = np.frombuffer(data, dtype='uint8', offset=_HEADER.size)
+    if len(buffer) < ts_size + count:
+        raise SegmentFormatError('Segment is too short')
+
+    dods = _unzigzag(decode_varints(buffer[:ts_size]))
+    if len(dods) != max(count - 1, 0):
+        raise SegmentFormatError('Corrupted timestamp data')
+    timestamps = np.full(count, first, dtype='int64')
+    timestamps[1:] += np.cumsum(np.cumsum(dods))
+
+    headers = buffer[ts_size:ts_size + count]
+    values = _decode_values(headers, buffer[ts_size + count:])
+    return timestamps.astype('datetime64[us]'), values
+
+
+def encode_records(records, value_field='value'):
+    """
+    Encode a list of records (dicts or DataRecords with 'timestamp' and value_field), e.g. StreamData.data
+
+    Returns:
+        Encoded segment (bytes)
+    """
+    timestamps = parse_timestamps([item['timestamp'] for item in records], unit='us')
+    values = np.array([item[value_field] for item in records], dtype='float64')
+    order = np.argsort(timestamps, kind='mergesort')
+    return encode(timestamps[order], values[order])
+
+
+def write_segment(path, timestamps, values):
+    """
+    Encode a segment and write it to a file, replacing it atomically
+    """
+    tmp_path = '{0}.tmp'.format(path)
+    with open(tmp_path, 'wb') as fp:
+        fp.write(encode(timestamps, values))
+    os.replace(tmp_path, path)
+
+
+def read_segment(path):
+    """
+    Read a segment file written with write_segment()
+
+    Returns:
+        (timestamps, values). See decode()
+    """
+    with open(path, 'rb') as fp:
+        return decode(fp.read())
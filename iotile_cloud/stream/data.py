@@ -1,20 +1,82 @@
-import sys
 import json
 import logging
-import dateutil.parser
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from timeit import default_timer
 
 from ..api.connection import Api
+from ..api.exceptions import HttpNotFoundError
+from ..utils.timestamp import parse_timestamp
+from .paging import PageSizeController
 
 logger = logging.getLogger(__name__)
 
+_record_classes = {}
+
+
+def _record_getitem(self, key):
+    if isinstance(key, str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+    return tuple.__getitem__(self, key)
+
+
+def _record_get(self, key, default=None):
+    return getattr(self, key, default)
+
+
+def _record_reduce(self):
+    return _make_record, (self._fields, tuple(self))
+
+
+def get_record_class(fields):
+    """
+    Get the compact record type used to store records projected to the given fields
+
+    Records are tuple backed (no per instance __dict__) but still support
+    dict style access (record['value'], record.get('value')) so code written
+    against the raw dict records keeps working.
+
+    Args:
+        fields: list of field names (e.g. ['timestamp', 'value'])
+
+    Returns:
+        namedtuple based class
+    """
+    fields = tuple(fields)
+    record_class = _record_classes.get(fields)
+    if record_class is None:
+        base = namedtuple('DataRecord', fields)
+        record_class = type('DataRecord', (base,), {
+            '__slots__': (),
+            '__getitem__': _record_getitem,
+            '__reduce__': _record_reduce,
+            'get': _record_get,
+            'keys': lambda self: self._fields,
+        })
+        _record_classes[fields] = record_class
+    return record_class
+
+
+def _make_record(fields, values):
+    return get_record_class(fields)(*values)
+
 
 class BaseData(object):
     data = []
     _api = None
+    # Send 'fields' as a server side projection hint
+    _server_projection = True
 
     def __init__(self, api):
         self._api = api
         self.data = []
+        # Used to pick page_size when one is not given. Set to None to use the server default
+        self.page_size_controller = PageSizeController()
+        self._last_response_size = None
 
     def _get_args_dict(self, page, *args, **kwargs):
         parts = {}
@@ -25,36 +87,299 @@ class BaseData(object):
         return parts
 
     def _date_format(self, timestamp):
-        try:
-            dt = dateutil.parser.parse(timestamp)
-            return dt
-        except Exception as e:
-            logger.error('Unable to parse timestamp (with parser): ' + str(e))
-            sys.exit(1)
+        # Raises TimestampParseError on bad values
+        return parse_timestamp(timestamp)
 
     def _fetch_data(self, *args, **kwargs):
         logger.error('Fetch Data not implemented')
         return {}
 
-    def initialize_from_server(self, *args, **kwargs):
-        logger.debug('Downloading data')
-        page = 1
-        self.data = []
+    def _get_from_resource(self, resource, **kwargs):
+        data = resource.get(**kwargs)
+        self._last_response_size = resource.last_response_size
+        return data
+
+    def _project(self, results, fields):
+        if not fields:
+            return results
+
+        record_class = get_record_class(fields)
+        return [record_class(*[item.get(field) for field in fields]) for item in results]
+
+    def _iter_pages(self, fields=None, page=1, resume_page_size=None, keyset=False, **kwargs):
+        """
+        Generator of (records, next_page, page_size) for every page, where next_page
+        and page_size are the cursor for the rest of the download (next_page is 0 when done).
+        With keyset=True, next_page is a keyset cursor (see _iter_keyset_pages())
+        """
+        if keyset:
+            cursor = page if isinstance(page, dict) else None
+            for item in self._iter_keyset_pages(fields=fields, cursor=cursor, **kwargs):
+                yield item
+            return
+
+        if fields:
+            fields = list(fields)
+            if self._server_projection:
+                kwargs['fields'] = ','.join(fields)
+
+        controller = None
+        page_size = kwargs.get('page_size')
+        offset = 0
+        if page_size is None and self.page_size_controller:
+            controller = self.page_size_controller
+            page_size = resume_page_size
+            if page_size:
+                offset = (page - 1) * page_size
+
         while page:
-            extra = self._get_args_dict(page=page, *args, **kwargs)
+            if controller:
+                # Only switch page size when the records already downloaded are a whole
+                # number of new size pages, so page=N still points to the next record
+                if page_size is None or offset % controller.page_size == 0:
+                    page_size = controller.page_size
+                elif page_size > controller.page_size:
+                    # Capped below the current page size (see below): get the page holding the next
+                    # record, and drop the records already downloaded
+                    page_size = controller.page_size
+                page = offset // page_size + 1
+                skip = offset - (page - 1) * page_size
+                kwargs['page_size'] = page_size
+
+            extra = self._get_args_dict(page=page, **kwargs)
             logger.debug('{0} ===> Downloading data: {1}'.format(page, extra))
+            self._last_response_size = None
+            start_time = default_timer()
+            raw_data = self._fetch_data(**extra)
+            elapsed = default_timer() - start_time
+            if 'results' not in raw_data:
+                break
+
+            if controller:
+                received = len(raw_data['results'])
+                controller.record(page_size, elapsed, received, self._last_response_size)
+                if raw_data['next'] and received < page_size:
+                    # The server caps the page size (e.g. DRF max_page_size), and numbers its pages
+                    # with the capped size
+                    logger.info('Server returned {0} records for a page size of {1}'.format(received, page_size))
+                    controller.cap(received)
+                    if page > 1:
+                        # This page started at record (page - 1) * received, not at offset: get it again
+                        continue
+                    page_size = received
+                raw_data['results'] = raw_data['results'][skip:]
+                offset += len(raw_data['results'])
+
+            if raw_data['next']:
+                logger.debug('Getting more: {0}'.format(raw_data['next']))
+                page = offset // page_size + 1 if controller else page + 1
+            else:
+                page = 0
+
+            yield self._project(raw_data['results'], fields), page, page_size
+
+    def _iter_keyset_pages(self, fields=None, cursor=None, **kwargs):
+        """
+        Generator of (records, cursor, page_size) for every page, using the timestamp of the last record
+        as the start of the next page instead of page numbers. The cursor is a dict with the timestamp
+        and the ids of the last records downloaded (0 when done)
+        """
+        if fields:
+            fields = list(fields)
+            if self._server_projection:
+                # The cursor needs the id and timestamp of every record
+                kwargs['fields'] = ','.join(fields + [field for field in ('id', 'timestamp') if field not in fields])
+        kwargs.setdefault('ordering', 'timestamp,id')
+
+        controller = None
+        page_size = kwargs.pop('page_size', None)
+        if page_size is None and self.page_size_controller:
+            controller = self.page_size_controller
+        boost = 1
+
+        while True:
+            if cursor:
+                kwargs['start'] = cursor['timestamp']
+                last_ts = parse_timestamp(cursor['timestamp'])
+                seen = set(cursor['ids'])
+            if controller:
+                page_size = controller.page_size * boost
+            if page_size:
+                kwargs['page_size'] = page_size
+
+            extra = self._get_args_dict(page=1, **kwargs)
+            logger.debug('{0} ===> Downloading data: {1}'.format(cursor, extra))
+            self._last_response_size = None
+            start_time = default_timer()
             raw_data = self._fetch_data(**extra)
-            if 'results' in raw_data:
-                for item in raw_data['results']:
-                    self.data.append(item)
-                if raw_data['next']:
-                    logger.debug('Getting more: {0}'.format(raw_data['next']))
-                    page += 1
+            elapsed = default_timer() - start_time
+            if 'results' not in raw_data:
+                break
+
+            results = raw_data['results']
+            if controller and boost == 1:
+                controller.record(page_size, elapsed, len(results), self._last_response_size)
+
+            records = results
+            if cursor:
+                # Records at the cursor timestamp may already have been downloaded
+                records = []
+                for item in results:
+                    ts = parse_timestamp(item['timestamp'])
+                    if ts > last_ts or (ts == last_ts and item['id'] not in seen):
+                        records.append(item)
+
+            more = bool(raw_data['next']) and bool(results)
+            if records:
+                boost = 1
+                new_ts = parse_timestamp(records[-1]['timestamp'])
+                ids = [item['id'] for item in records if parse_timestamp(item['timestamp']) == new_ts]
+                if cursor and new_ts == last_ts:
+                    ids = cursor['ids'] + ids
+                cursor = {'timestamp': records[-1]['timestamp'], 'ids': ids}
+            elif more:
+                if page_size and len(results) < page_size:
+                    # The server caps the page size (e.g. DRF max_page_size), and more records than the cap
+                    # share the cursor timestamp: page through them with offsets, then continue after it
+                    for records, cursor in self._iter_timestamp_pages(cursor, len(results), kwargs):
+                        yield self._project(records, fields), cursor, page_size
+                    boost = 1
+                    continue
+                # A whole page of records at the cursor timestamp: ask for more at once
+                if controller:
+                    boost *= 2
                 else:
-                    page = 0
+                    page_size = (page_size or len(results)) * 2
+                logger.debug('No progress at {0}, doubling the page size'.format(cursor['timestamp']))
+                continue
+
+            yield self._project(records, fields), cursor if more else 0, page_size
+
+            if not more:
+                break
+
+    def _iter_timestamp_pages(self, cursor, page_size, kwargs):
+        """
+        Generator of (records, cursor) for all the records at the cursor timestamp that are not in the
+        cursor ids, using page=N offsets. The last cursor points just after the timestamp
+        """
+        last_ts = parse_timestamp(cursor['timestamp'])
+        seen = set(cursor['ids'])
+        ids = list(cursor['ids'])
+        # start is inclusive and end is exclusive
+        after = (last_ts + timedelta(microseconds=1)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        kwargs = dict(kwargs, start=cursor['timestamp'], end=after, page_size=page_size)
+
+        page = 1
+        while page:
+            extra = self._get_args_dict(page=page, **kwargs)
+            logger.debug('{0} ===> Downloading data at {1}: {2}'.format(page, cursor['timestamp'], extra))
+            raw_data = self._fetch_data(**extra)
+            if 'results' not in raw_data:
+                return
+            records = [item for item in raw_data['results'] if item['id'] not in seen]
+            ids += [item['id'] for item in records]
+            page = page + 1 if raw_data['next'] and raw_data['results'] else 0
+            if page:
+                yield records, {'timestamp': cursor['timestamp'], 'ids': ids}
+            else:
+                yield records, {'timestamp': after, 'ids': []}
+
+    def iter_pages(self, fields=None, **kwargs):
+        """
+        Download data one page at a time
+
+        Args:
+            fields: Optional list of fields to keep (e.g. ['timestamp', 'value']).
+                    Records are then returned as compact DataRecord tuples instead of dicts
+            kwargs: Query arguments (e.g. start, end, lastn). Use keyset=True to page on
+                    timestamps instead of page numbers: deep pages are not slower, and
+                    data added during the download does not shift pages
+
+        Returns:
+            Generator of lists of records, one per page
+        """
+        for records, _page, _page_size in self._iter_pages(fields=fields, **kwargs):
+            yield records
+
+    def iter_records(self, fields=None, **kwargs):
+        """
+        Download data, yielding one record at a time. See iter_pages()
+        """
+        for page in self.iter_pages(fields=fields, **kwargs):
+            for item in page:
+                yield item
+
+    def _checkpoint_query(self, fields, kwargs):
+        query = dict(kwargs)
+        query['fields'] = list(fields) if fields else None
+        return query
+
+    def _download_to_sink(self, sink, checkpoint, fields, **kwargs):
+        query = self._checkpoint_query(fields, kwargs)
+        state = checkpoint.load() if checkpoint else None
+
+        if state:
+            if state['query'] != query:
+                raise ValueError('Checkpoint {0} is for a different query: {1}'.format(checkpoint.path, state['query']))
+            if not state['next_page']:
+                logger.info('Download already completed ({0} records)'.format(state['records']))
+                return state['records']
+
+            logger.info('Resuming download at page {0} ({1} records already downloaded)'.format(
+                state['next_page'], state['records']))
+            sink.truncate(state['sink_position'])
+        else:
+            if checkpoint:
+                sink.truncate(0)
+            state = {
+                'query': query,
+                'next_page': 1,
+                'page_size': None,
+                'pages': 0,
+                'records': 0,
+                'sink_position': sink.position(),
+            }
+
+        pages = self._iter_pages(fields=fields, page=state['next_page'], resume_page_size=state['page_size'], **kwargs)
+        for records, next_page, page_size in pages:
+            sink.write(records)
+            sink.flush()
+
+            state['next_page'] = next_page
+            state['page_size'] = page_size
+            state['pages'] += 1
+            state['records'] += len(records)
+            state['sink_position'] = sink.position()
+            if checkpoint:
+                checkpoint.save(state)
+
+        return state['records']
+
+    def initialize_from_server(self, fields=None, sink=None, checkpoint=None, **kwargs):
+        """
+        Download all data into self.data, or into a sink
+
+        Args:
+            fields: Optional list of fields to keep. See iter_pages()
+            sink: Optional sink (e.g. JsonLinesSink) to write records to, instead of keeping them in self.data
+            checkpoint: Optional DownloadCheckpoint used to resume a failed download. Requires a sink
+            kwargs: Query arguments (e.g. start, end, lastn)
+        """
+        logger.debug('Downloading data')
+        self.data = []
+        if checkpoint and sink is None:
+            raise ValueError('A sink is required to use a checkpoint')
+
+        if sink is not None:
+            count = self._download_to_sink(sink, checkpoint, fields, **kwargs)
+        else:
+            for page in self.iter_pages(fields=fields, **kwargs):
+                self.data.extend(page)
+            count = len(self.data)
 
         logger.debug('==================================')
-        logger.debug('Downloaded a total of {0} records'.format(len(self.data)))
+        logger.debug('Downloaded a total of {0} records'.format(count))
         logger.debug('==================================')
 
 
@@ -66,7 +391,12 @@ class StreamData(BaseData):
         self._stream_id = stream_id
 
     def _fetch_data(self, *args, **kwargs):
-        return self._api.stream(self._stream_id).data.get(**kwargs)
+        return self._get_from_resource(self._api.stream(self._stream_id).data, **kwargs)
+
+    def _checkpoint_query(self, fields, kwargs):
+        query = super(StreamData, self)._checkpoint_query(fields, kwargs)
+        query['stream'] = self._stream_id
+        return query
 
 
 class RawData(BaseData):
@@ -75,4 +405,92 @@ class RawData(BaseData):
         super(RawData, self).__init__(api)
 
     def _fetch_data(self, *args, **kwargs):
-        return self._api.data.get(**kwargs)
+        return self._get_from_resource(self._api.data, **kwargs)
+
+
+def fetch_event_details(api, event_ids, workers=8, cache=None):
+    """
+    Download the detailed data (e.g. waveforms) of several events concurrently
+
+    Args:
+        api: Api object
+        event_ids: list of event IDs
+        workers: Number of concurrent requests
+        cache: Optional BlobCache. Event data is immutable, so cached events are never downloaded again
+
+    Returns:
+        OrderedDict of event ID -> event data (None for events with no data)
+    """
+    details = OrderedDict((event_id, None) for event_id in event_ids)
+
+    missing = []
+    for event_id in details:
+        cached = cache.get(event_id) if cache is not None else None
+        if cached is not None:
+            details[event_id] = cached
+        else:
+            missing.append(event_id)
+
+    def _fetch(event_id):
+        try:
+            return api.event(event_id).data.get()
+        except HttpNotFoundError:
+            logger.warning('No data found for event {0}'.format(event_id))
+            return None
+
+    if missing:
+        logger.debug('Downloading data for {0} events ({1} cached)'.format(len(missing), len(details) - len(missing)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for event_id, detail in zip(missing, executor.map(_fetch, missing)):
+                details[event_id] = detail
+                if detail is not None and cache is not None:
+                    cache.put(event_id, detail)
+
+    return details
+
+
+class EventData(BaseData):
+    """
+    Events for a stream or device (e.g. POD-1M shock events), with their detailed data
+
+    Args:
+        slug: Stream or device slug to filter events with
+        api: Api object
+        cache: Optional BlobCache for event data
+    """
+    _slug = None
+
+    def __init__(self, slug, api, cache=None):
+        super(EventData, self).__init__(api)
+        self._slug = str(slug)
+        self._cache = cache
+        self.details = OrderedDict()
+
+    def _fetch_data(self, *args, **kwargs):
+        return self._get_from_resource(self._api.event, filter=self._slug, **kwargs)
+
+    def _checkpoint_query(self, fields, kwargs):
+        query = super(EventData, self)._checkpoint_query(fields, kwargs)
+        query['filter'] = self._slug
+        return query
+
+    def fetch_details(self, events=None, workers=8):
+        """
+        Download the data of the given events (or all events in self.data) concurrently.
+        Events known to have no data (has_raw_data is False) are skipped.
+
+        Args:
+            events: Optional list of events (dicts or DataRecords with an 'id')
+            workers: Number of concurrent requests
+
+        Returns:
+            OrderedDict of event ID -> event data. Also stored in self.details
+        """
+        if events is None:
+            events = self.data
+
+        event_ids = [item['id'] for item in events if item.get('has_raw_data', True) is not False]
+        details = fetch_event_details(self._api, event_ids, workers=workers, cache=self._cache)
+        self.details.update(details)
+        return details
+
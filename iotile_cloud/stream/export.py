@@ -0,0 +1,204 @@
+"""Streaming export of stream data to Parquet or Arrow IPC files.
+
+Pages are converted to Arrow record batches as they are downloaded and written
+out straight away, so exporting a dataset larger than memory is a single pass
+that holds at most a few pages at a time.
+
+All exporters use the same typed schema (see EXPORT_SCHEMA). The stream, device
+and variable slugs are dictionary encoded.
+
+Example:
+
+    with ParquetExporter('data.parquet', pages_per_row_group=10) as exporter:
+        for slug in stream_slugs:
+            exporter.write_data(StreamData(slug, api), start=t0, end=t1)
+
+Requires pyarrow (and numpy).
+"""
+import logging
+
+from ..utils.gid import IOTileStreamSlug
+from ..utils.timestamp import parse_timestamps
+
+HAS_DEPENDENCIES = True
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    HAS_DEPENDENCIES = False
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FIELDS = ['timestamp', 'value', 'int_value', 'stream', 'device', 'variable']
+SLUG_FIELDS = ['stream', 'device', 'variable']
+
+if HAS_DEPENDENCIES:
+    EXPORT_SCHEMA = pa.schema([
+        ('timestamp', pa.timestamp('us', tz='UTC')),
+        ('value', pa.float64()),
+        ('int_value', pa.int64()),
+        ('stream', pa.dictionary(pa.int32(), pa.string())),
+        ('device', pa.dictionary(pa.int32(), pa.string())),
+        ('variable', pa.dictionary(pa.int32(), pa.string())),
+    ])
+else:
+    EXPORT_SCHEMA = None
+
+
+def _slugs_for_stream(stream_slug):
+    parts = IOTileStreamSlug(stream_slug).get_parts()
+    return {
+        'stream': str(stream_slug),
+        'device': str(parts['device']),
+        'variable': str(parts['variable']),
+    }
+
+
+class BaseArrowExporter(object):
+    """
+    Converts pages of data records to Arrow record batches using EXPORT_SCHEMA
+
+    Dictionaries for the slug columns grow as new slugs are seen, and are shared by
+    all batches written to the same file.
+
+    Args:
+        path: Output file path
+    """
+
+    def __init__(self, path):
+        if not HAS_DEPENDENCIES:
+            raise RuntimeError('You must have pyarrow installed to export data')
+
+        self.path = path
+        self.records = 0
+        self._dictionaries = {field: {} for field in SLUG_FIELDS}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _encode_slugs(self, field, values):
+        dictionary = self._dictionaries[field]
+        indices = []
+        for value in values:
+            if value is None:
+                indices.append(None)
+                continue
+            index = dictionary.get(value)
+            if index is None:
+                index = len(dictionary)
+                dictionary[value] = index
+            indices.append(index)
+
+        return pa.DictionaryArray.from_arrays(pa.array(indices, type=pa.int32()),
+                                              pa.array(list(dictionary), type=pa.string()))
+
+    def _to_batch(self, records, defaults=None):
+        defaults = defaults or {}
+        timestamps = parse_timestamps([item.get('timestamp') for item in records], unit='us')
+
+        columns = [
+            pa.array(timestamps.astype('int64'), type=pa.int64()).cast(EXPORT_SCHEMA.field('timestamp').type),
+            pa.array([item.get('value') for item in records], type=pa.float64()),
+            pa.array([item.get('int_value') for item in records], type=pa.int64()),
+        ]
+        for field in SLUG_FIELDS:
+            default = defaults.get(field)
+            columns.append(self._encode_slugs(field, [item.get(field) or default for item in records]))
+
+        return pa.RecordBatch.from_arrays(columns, schema=EXPORT_SCHEMA)
+
+    def _write_batch(self, batch):
+        raise NotImplementedError()
+
+    def write_page(self, records, stream=None):
+        """
+        Write one page of records
+
+        Args:
+            records: list of dicts or DataRecord tuples
+            stream: Optional stream slug, used for records that do not include their stream/device/variable
+        """
+        if not records:
+            return
+
+        defaults = _slugs_for_stream(stream) if stream else None
+        self._write_batch(self._to_batch(records, defaults))
+        self.records += len(records)
+
+    def write_data(self, data, **kwargs):
+        """
+        Download and write all pages for a StreamData or RawData object
+
+        Args:
+            data: BaseData object (e.g. StreamData)
+            kwargs: Query arguments (e.g. start, end)
+        """
+        stream = getattr(data, '_stream_id', None)
+        for page in data.iter_pages(fields=EXPORT_FIELDS, **kwargs):
+            self.write_page(page, stream=stream)
+
+    def close(self):
+        raise NotImplementedError()
+
+
+class ParquetExporter(BaseArrowExporter):
+    """
+    Export data to a Parquet file, with one row group every pages_per_row_group pages
+
+    Args:
+        path: Output file path
+        pages_per_row_group: Number of pages to buffer for each row group
+        compression: Parquet compression codec
+    """
+
+    def __init__(self, path, pages_per_row_group=10, compression='snappy'):
+        super(ParquetExporter, self).__init__(path)
+        self._pages_per_row_group = pages_per_row_group
+        self._pending = []
+        self._writer = pq.ParquetWriter(path, EXPORT_SCHEMA, compression=compression)
+
+    def _write_batch(self, batch):
+        self._pending.append(batch)
+        if len(self._pending) >= self._pages_per_row_group:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            table = pa.Table.from_batches(self._pending, schema=EXPORT_SCHEMA)
+            self._writer.write_table(table, row_group_size=table.num_rows)
+            self._pending = []
+
+    def close(self):
+        if self._writer is not None:
+            self._flush()
+            self._writer.close()
+            self._writer = None
+            logger.debug('Exported {0} records to {1}'.format(self.records, self.path))
+
+
+class ArrowIPCExporter(BaseArrowExporter):
+    """
+    Export data to an Arrow IPC file (one record batch per page)
+
+    Args:
+        path: Output file path
+    """
+
+    def __init__(self, path):
+        super(ArrowIPCExporter, self).__init__(path)
+        self._sink = pa.OSFile(path, 'wb')
+        options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+        self._writer = pa.ipc.new_file(self._sink, EXPORT_SCHEMA, options=options)
+
+    def _write_batch(self, batch):
+        self._writer.write_batch(batch)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+            self._writer = None
+            logger.debug('Exported {0} records to {1}'.format(self.records, self.path))
@@ -0,0 +1,180 @@
+"""Follow (tail) many streams, yielding new data points as they arrive.
+
+StreamFollower polls every stream on its own schedule: a stream that returned
+new data is polled again sooner, and a quiet stream is polled less and less
+often (up to max_interval). Polls are kept in a heap ordered by due time, so
+following thousands of streams costs nothing for streams that are not due.
+
+Every stream has a watermark: the timestamp of the last data point seen, and
+the IDs of the data points at that timestamp. Polls ask for data starting at
+the watermark timestamp, and data points already seen are dropped, so nothing
+is emitted twice. Watermarks can be saved to a file after every poll, so a
+restarted follower continues where it stopped.
+
+Example:
+
+    follower = StreamFollower(api, stream_slugs, state_path='follow.json')
+    for slug, point in follower.follow():
+        print(slug, point['timestamp'], point['value'])
+"""
+import heapq
+import json
+import logging
+import os
+import time
+
+import requests
+
+from ..api.exceptions import HttpServerError
+from ..utils.timestamp import parse_timestamp
+from .checkpoint import write_json_atomic
+from .data import StreamData
+
+logger = logging.getLogger(__name__)
+
+
+class StreamFollower(object):
+    """
+    Polling change feed over a set of streams
+
+    Args:
+        api: Api object
+        stream_slugs: list of stream slugs to follow
+        state_path: Optional file to load and save the watermarks from
+        min_interval: Shortest time between two polls of a stream, in seconds
+        max_interval: Longest time between two polls of a stream, in seconds
+        backoff: Factor to increase the interval by after an empty poll (and decrease it by after new data)
+        from_start: If True, streams with no watermark yield all their data. Otherwise, they only
+                    yield data newer than their last data point when first polled
+        sleep: Function used to wait (for testing)
+        clock: Function returning the current time in seconds (for testing)
+    """
+
+    def __init__(self, api, stream_slugs, state_path=None, min_interval=5, max_interval=300, backoff=2.0,
+                 from_start=False, sleep=time.sleep, clock=time.monotonic):
+        self._api = api
+        self.stream_slugs = [str(slug) for slug in stream_slugs]
+        self.state_path = state_path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.from_start = from_start
+        self._sleep = sleep
+        self._clock = clock
+
+        self.watermarks = {}
+        if state_path and os.path.isfile(state_path):
+            with open(state_path, 'r') as fp:
+                self.watermarks = json.load(fp)
+        self.intervals = {slug: min_interval for slug in self.stream_slugs}
+
+    def save(self):
+        """
+        Save the watermarks to state_path (if any)
+        """
+        if self.state_path:
+            write_json_atomic(self.state_path, self.watermarks)
+
+    def _initial_watermark(self, slug):
+        last = list(StreamData(slug, self._api).iter_records(fields=['id', 'timestamp'], lastn=1))
+        if last:
+            return {'timestamp': last[-1]['timestamp'], 'ids': [last[-1]['id']]}
+        # Empty stream: all its future data is new
+        return {'timestamp': None, 'ids': []}
+
+    def poll(self, slug):
+        """
+        Get the new data points of a stream, and move its watermark
+
+        Args:
+            slug: Stream slug
+
+        Returns:
+            List of new data points (dicts), in timestamp order
+        """
+        watermark = self.watermarks.get(slug)
+        if watermark is None:
+            if not self.from_start:
+                self.watermarks[slug] = self._initial_watermark(slug)
+                return []
+            watermark = {'timestamp': None, 'ids': []}
+
+        kwargs = {}
+        last_ts = None
+        if watermark['timestamp'] is not None:
+            kwargs['start'] = watermark['timestamp']
+            last_ts = parse_timestamp(watermark['timestamp'])
+        seen = set(watermark['ids'])
+
+        new = []
+        for item in StreamData(slug, self._api).iter_records(**kwargs):
+            if last_ts is not None:
+                ts = parse_timestamp(item['timestamp'])
+                if ts < last_ts or (ts == last_ts and item['id'] in seen):
+                    continue
+            new.append(item)
+
+        if new:
+            new.sort(key=lambda item: parse_timestamp(item['timestamp']))
+            last = new[-1]['timestamp']
+            new_ts = parse_timestamp(last)
+            ids = [item['id'] for item in new if parse_timestamp(item['timestamp']) == new_ts]
+            if new_ts == last_ts:
+                ids = watermark['ids'] + ids
+            self.watermarks[slug] = {'timestamp': last, 'ids': ids}
+
+        return new
+
+    def _next_interval(self, slug, active):
+        if active:
+            interval = max(self.min_interval, self.intervals[slug] / self.backoff)
+        else:
+            interval = min(self.max_interval, self.intervals[slug] * self.backoff)
+        self.intervals[slug] = interval
+        return interval
+
+    def follow(self, max_polls=None):
+        """
+        Poll the streams forever (or max_polls times), yielding new data points
+
+        Watermarks are saved after all the data points of a poll have been yielded, so a
+        follower stopped in the middle of a poll yields that poll's data points again on restart.
+
+        Args:
+            max_polls: Optional number of polls to do before stopping
+
+        Returns:
+            Generator of (stream slug, data point) tuples
+        """
+        now = self._clock()
+        schedule = [(now, index, slug) for index, slug in enumerate(self.stream_slugs)]
+        heapq.heapify(schedule)
+
+        polls = 0
+        while schedule and (max_polls is None or polls < max_polls):
+            due, index, slug = heapq.heappop(schedule)
+            wait = due - self._clock()
+            if wait > 0:
+                self._sleep(wait)
+
+            try:
+                new = self.poll(slug)
+            except (HttpServerError, requests.exceptions.ConnectionError) as e:
+                # Transient errors are treated as an empty poll, so the stream backs off
+                logger.warning('Polling {0} failed: {1}'.format(slug, e))
+                new = []
+            polls += 1
+            for item in new:
+                yield slug, item
+            self.save()
+
+            interval = self._next_interval(slug, bool(new))
+            logger.debug('{0}: {1} new data points, next poll in {2}s'.format(slug, len(new), interval))
+            heapq.heappush(schedule, (self._clock() + interval, index, slug))
+
+
+def follow(api, stream_slugs, state_path=None, **kwargs):
+    """
+    Follow many streams, yielding (stream slug, data point) tuples as new data arrives. See StreamFollower
+    """
+    return StreamFollower(api, stream_slugs, state_path=state_path, **kwargs).follow()
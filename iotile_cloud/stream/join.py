@@ -0,0 +1,147 @@
+"""Align several streams onto one timeline.
+
+asof_join() works on whole streams: for every timestamp on the timeline (by
+default, the union of all stream timestamps) it picks the latest value of each
+stream at or before that time, as long as it is not older than the tolerance.
+It is vectorized over sorted numpy arrays (one binary search per stream).
+
+iter_asof_join() does the same for iterators of records (e.g. from
+StreamData.iter_records()), merging them with a k-way merge and yielding one
+row per timestamp, so streams never need to be fully downloaded.
+
+Example:
+
+    columns = asof_join({
+        'pressure': StreamData(pressure_slug, api).iter_records(fields=['timestamp', 'value']),
+        'humidity': humidity_data.data,
+    }, tolerance=timedelta(minutes=15))
+    # columns['timestamp'], columns['pressure'], columns['humidity']
+
+Requires numpy (except for iter_asof_join).
+"""
+import heapq
+import itertools
+from collections import OrderedDict
+from datetime import timedelta
+
+from ..utils.timestamp import parse_timestamp, parse_timestamps
+
+HAS_NUMPY = True
+try:
+    import numpy as np
+except ImportError:
+    HAS_NUMPY = False
+
+
+def _to_arrays(data, value_field):
+    if isinstance(data, tuple) and len(data) == 2:
+        timestamps, values = data
+        timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+        values = np.asarray(values, dtype='float64')
+    else:
+        records = list(data)
+        timestamps = parse_timestamps([item['timestamp'] for item in records], unit='us')
+        values = np.array([item[value_field] for item in records], dtype='float64')
+
+    if len(timestamps) > 1 and np.any(timestamps[1:] < timestamps[:-1]):
+        order = np.argsort(timestamps, kind='mergesort')
+        timestamps = timestamps[order]
+        values = values[order]
+
+    return timestamps, values
+
+
+def _tolerance_to_timedelta64(tolerance):
+    if tolerance is None:
+        return None
+    if isinstance(tolerance, timedelta):
+        return np.timedelta64(tolerance).astype('timedelta64[us]')
+    return np.timedelta64(int(tolerance * 1e6), 'us')
+
+
+def asof_join(streams, tolerance=None, on=None, value_field='value'):
+    """
+    Join several streams onto one timeline
+
+    Args:
+        streams: dict (or list of pairs) of name -> data, where data is either a list/iterator of
+                 records (dicts or DataRecords with 'timestamp' and value_field) or a
+                 (timestamps, values) tuple of arrays
+        tolerance: Maximum age of a joined value, as a timedelta or seconds. None for no limit
+        on: Optional timeline: the name of one of the streams, or an array of timestamps.
+            Defaults to the union of all stream timestamps
+        value_field: Record field to use as value
+
+    Returns:
+        OrderedDict of columns: 'timestamp' (datetime64[us] array) followed by one float64 array per stream,
+        with NaN where a stream had no value within tolerance
+    """
+    if not HAS_NUMPY:
+        raise RuntimeError('You must have numpy installed to use asof_join()')
+
+    items = list(streams.items()) if hasattr(streams, 'items') else list(streams)
+    arrays = OrderedDict((name, _to_arrays(data, value_field)) for name, data in items)
+
+    if on is None:
+        if arrays:
+            timeline = np.unique(np.concatenate([timestamps for timestamps, _ in arrays.values()]))
+        else:
+            timeline = np.array([], dtype='datetime64[us]')
+    elif isinstance(on, str) and on in arrays:
+        timeline = arrays[on][0]
+    else:
+        timeline = np.sort(np.asarray(on, dtype='datetime64[us]'))
+
+    tolerance = _tolerance_to_timedelta64(tolerance)
+
+    columns = OrderedDict()
+    columns['timestamp'] = timeline
+    for name, (timestamps, values) in arrays.items():
+        column = np.full(len(timeline), np.nan)
+        if len(timestamps):
+            index = np.searchsorted(timestamps, timeline, side='right') - 1
+            valid = index >= 0
+            if tolerance is not None:
+                valid &= (timeline - timestamps[np.maximum(index, 0)]) <= tolerance
+            column[valid] = values[index[valid]]
+        columns[name] = column
+
+    return columns
+
+
+def iter_asof_join(streams, tolerance=None, value_field='value'):
+    """
+    Streaming version of asof_join(), over iterators of records sorted by timestamp
+
+    Args:
+        streams: dict (or list of pairs) of name -> iterator of records
+        tolerance: Maximum age of a joined value, as a timedelta or seconds. None for no limit
+        value_field: Record field to use as value
+
+    Returns:
+        Generator of (timestamp, values) tuples, one per distinct timestamp, where timestamp is a
+        datetime and values is a list with the value of each stream (or None)
+    """
+    items = list(streams.items()) if hasattr(streams, 'items') else list(streams)
+    if tolerance is not None and not isinstance(tolerance, timedelta):
+        tolerance = timedelta(seconds=tolerance)
+
+    def _keyed(index, records):
+        # The stream index and record counter break timestamp ties, so values are never compared
+        for count, item in enumerate(records):
+            yield parse_timestamp(item['timestamp']), index, count, item[value_field]
+
+    merged = heapq.merge(*[_keyed(index, records) for index, (_name, records) in enumerate(items)])
+
+    latest = [None] * len(items)
+    for timestamp, group in itertools.groupby(merged, key=lambda entry: entry[0]):
+        for _timestamp, index, _count, value in group:
+            latest[index] = (timestamp, value)
+
+        row = []
+        for entry in latest:
+            if entry is None or (tolerance is not None and timestamp - entry[0] > tolerance):
+                row.append(None)
+            else:
+                row.append(entry[1])
+        yield timestamp, row
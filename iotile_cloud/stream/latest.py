@@ -0,0 +1,173 @@
+"""Latest value of many streams at once.
+
+LatestValues gets the last data point of many streams concurrently, using
+/data/?filter=<slug>&lastn=1 for every stream on a thread pool. Results are
+kept in a short lived cache, so dashboards refreshing often do not hit the
+cloud every time.
+
+The /device/<slug>/extra/ API returns the number of data points of every
+stream of a device. Streams missing from it have no data, and are skipped
+without querying their data. Stream counts are cached too.
+
+Streams that fail (e.g. a server error) are None in the result, are listed with
+their error in latest.errors, and are not cached.
+
+Example:
+
+    latest = LatestValues(api, ttl=30, workers=16)
+    values = latest.get(stream_slugs)
+    # values[slug] is the last data point (dict), or None if the stream has no data
+    # latest.errors[slug] is the error message of streams that failed
+"""
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from ..api.exceptions import RestBaseException
+from ..utils.cache import TTLCache
+from ..utils.gid import IOTileStreamSlug
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LatestValues(object):
+    """
+    Concurrent, cached "latest value" queries for many streams
+
+    Args:
+        api: Api object
+        ttl: Time to live (in seconds) of cached latest values
+        counts_ttl: Time to live (in seconds) of cached device stream counts
+        workers: Number of concurrent requests
+        skip_empty: If True, use device stream counts to skip streams with no data
+
+    Attributes:
+        errors: OrderedDict of stream slug -> error message, for the streams that failed in the last get()
+    """
+
+    def __init__(self, api, ttl=30, counts_ttl=300, workers=16, skip_empty=True):
+        self._api = api
+        self.workers = workers
+        self.skip_empty = skip_empty
+        self._values = TTLCache(ttl)
+        self._counts = TTLCache(counts_ttl)
+        self.errors = OrderedDict()
+
+    def _device_slug(self, stream_slug):
+        try:
+            device = str(IOTileStreamSlug(stream_slug).get_parts()['device'])
+        except (ValueError, KeyError):
+            return None
+        # Data blocks have no stream counts
+        return device if device.startswith('d--') else None
+
+    def _fetch_counts(self, device_slug):
+        try:
+            extra = self._api.device(device_slug).extra.get()
+        except (RestBaseException, requests.exceptions.RequestException) as e:
+            # Unknown counts: every stream of the device is queried
+            logger.warning('No stream counts for {0}: {1}'.format(device_slug, e))
+            return None
+        return extra.get('stream_counts')
+
+    def _fetch_latest(self, stream_slug):
+        # (last data point, error message)
+        try:
+            data = self._api.data.get(filter=stream_slug, lastn=1)
+        except (RestBaseException, requests.exceptions.RequestException) as e:
+            logger.error('{0}: {1}'.format(stream_slug, e))
+            return None, str(e)
+        results = data.get('results', [])
+        return (results[-1] if results else None), None
+
+    def _non_empty(self, stream_slugs, executor):
+        devices = OrderedDict()
+        for slug in stream_slugs:
+            device = self._device_slug(slug)
+            if device is not None:
+                devices.setdefault(device, []).append(slug)
+
+        counts = {}
+        for device in devices:
+            cached = self._counts.get(device, _MISSING)
+            if cached is not _MISSING:
+                counts[device] = cached
+
+        missing = [device for device in devices if device not in counts]
+        for device, device_counts in zip(missing, executor.map(self._fetch_counts, missing)):
+            self._counts.put(device, device_counts)
+            counts[device] = device_counts
+
+        empty = set()
+        for device, slugs in devices.items():
+            if counts[device] is None:
+                continue
+            for slug in slugs:
+                if not counts[device].get(slug, {}).get('data_cnt'):
+                    empty.add(slug)
+        return [slug for slug in stream_slugs if slug not in empty]
+
+    def get(self, stream_slugs, use_cache=True):
+        """
+        Get the last data point of every stream
+
+        Args:
+            stream_slugs: list of stream slugs
+            use_cache: If False, always query the cloud (and refresh the cache)
+
+        Returns:
+            OrderedDict of stream slug -> last data point (dict), or None if the stream has no data
+            or failed (see errors)
+        """
+        stream_slugs = [str(slug) for slug in stream_slugs]
+        result = OrderedDict((slug, None) for slug in stream_slugs)
+        self.errors = OrderedDict()
+
+        missing = []
+        for slug in result:
+            value = self._values.get(slug, _MISSING) if use_cache else _MISSING
+            if value is _MISSING:
+                missing.append(slug)
+            else:
+                result[slug] = value
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                to_fetch = self._non_empty(missing, executor) if self.skip_empty else missing
+                logger.debug('Getting latest value of {0} streams ({1} cached, {2} empty)'.format(
+                    len(to_fetch), len(result) - len(missing), len(missing) - len(to_fetch)))
+                fetched = dict(zip(to_fetch, executor.map(self._fetch_latest, to_fetch)))
+
+            for slug in missing:
+                value, error = fetched.get(slug, (None, None))
+                result[slug] = value
+                if error is not None:
+                    # Not cached, so it is tried again next time
+                    self.errors[slug] = error
+                else:
+                    self._values.put(slug, value)
+
+        return result
+
+    def invalidate(self, stream_slug=None):
+        """
+        Drop a stream (or all streams, if None) from the cache
+        """
+        self._values.invalidate(stream_slug)
+        if stream_slug is None:
+            self._counts.invalidate()
+
+
+def get_latest_values(api, stream_slugs, workers=16, skip_empty=True):
+    """
+    Get the last data point of many streams concurrently, without caching. See LatestValues
+
+    Returns:
+        OrderedDict of stream slug -> last data point (dict), or None if the stream has no data
+    """
+    latest = LatestValues(api, ttl=0, counts_ttl=0, workers=workers, skip_empty=skip_empty)
+    return latest.get(stream_slugs)
@@ -0,0 +1,129 @@
+"""Adaptive page size selection for paged data downloads.
+
+The cloud returns data in pages. Small pages waste time on round trips, while
+large pages can take long enough to hit timeouts on slow links or for large
+records. PageSizeController measures how long each page takes (and how many
+bytes it returns) and moves the page size toward a target page latency.
+
+Page sizes are always chosen from a ladder of power of two multiples of the
+initial size, so that a download using page=N offsets can switch sizes without
+skipping or repeating records (see BaseData.iter_pages). Servers may return
+less than the page size asked for (e.g. a DRF max_page_size): the ladder is
+then capped at the size the server returns (see cap()).
+"""
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_MIN_PAGE_SIZE = 125
+DEFAULT_MAX_PAGE_SIZE = 8000
+DEFAULT_TARGET_LATENCY = 2.0
+
+
+class PageSizeController(object):
+    """
+    Grow or shrink the page size toward a target page latency
+
+    Args:
+        initial: Page size to start from
+        minimum: Smallest page size to use
+        maximum: Largest page size to use
+        target_latency: Desired time (in seconds) to download a page
+        max_bytes: Optional upper bound for the expected size of a page (in bytes)
+        smoothing: Weight given to the latest page when averaging per record costs (0 to 1)
+    """
+
+    def __init__(self, initial=DEFAULT_PAGE_SIZE, minimum=DEFAULT_MIN_PAGE_SIZE, maximum=DEFAULT_MAX_PAGE_SIZE,
+                 target_latency=DEFAULT_TARGET_LATENCY, max_bytes=None, smoothing=0.5):
+        if initial <= 0 or minimum > maximum:
+            raise ValueError('Illegal page size bounds: initial={0}, min={1}, max={2}'.format(initial, minimum, maximum))
+        if target_latency <= 0:
+            raise ValueError('target_latency must be positive')
+
+        self._sizes = self._build_ladder(initial, minimum, maximum)
+        self._index = self._sizes.index(min(self._sizes, key=lambda size: abs(size - initial)))
+        self._target_latency = float(target_latency)
+        self._max_bytes = max_bytes
+        self._smoothing = smoothing
+        self._seconds_per_record = None
+        self._bytes_per_record = None
+        self.history = deque(maxlen=100)
+
+    @staticmethod
+    def _build_ladder(initial, minimum, maximum):
+        sizes = [initial]
+        size = initial
+        while size % 2 == 0 and size // 2 >= minimum:
+            size //= 2
+            sizes.insert(0, size)
+        size = initial
+        while size * 2 <= maximum:
+            size *= 2
+            sizes.append(size)
+        return sizes
+
+    @property
+    def page_size(self):
+        """Page size to use for the next page"""
+        return self._sizes[self._index]
+
+    def _average(self, current, sample):
+        if current is None:
+            return sample
+        return self._smoothing * sample + (1.0 - self._smoothing) * current
+
+    def _fits(self, size):
+        if self._seconds_per_record is not None and self._seconds_per_record * size > self._target_latency:
+            return False
+        if self._max_bytes and self._bytes_per_record is not None and self._bytes_per_record * size > self._max_bytes:
+            return False
+        return True
+
+    def cap(self, maximum):
+        """
+        Never use page sizes above maximum (e.g. the largest page the server returns)
+        """
+        if maximum >= self._sizes[-1]:
+            return
+        previous = self.page_size
+        self._sizes = [size for size in self._sizes if size < maximum] + [maximum]
+        self._index = min(self._index, len(self._sizes) - 1)
+        logger.debug('Page size capped at {0} (was {1})'.format(maximum, previous))
+
+    def record(self, page_size, elapsed, num_records, num_bytes=None):
+        """
+        Record the cost of a downloaded page and update the page size
+
+        Args:
+            page_size: Page size that was requested
+            elapsed: Time (in seconds) taken to download the page
+            num_records: Number of records returned
+            num_bytes: Size of the response (in bytes), if known
+        """
+        self.history.append((page_size, elapsed, num_records, num_bytes))
+        if num_records <= 0:
+            return
+
+        self._seconds_per_record = self._average(self._seconds_per_record, float(elapsed) / num_records)
+        if num_bytes is not None:
+            self._bytes_per_record = self._average(self._bytes_per_record, float(num_bytes) / num_records)
+
+        previous = self.page_size
+        too_slow = self._seconds_per_record * previous > 1.5 * self._target_latency
+        too_big = self._max_bytes and self._bytes_per_record is not None and \
+            self._bytes_per_record * previous > self._max_bytes
+
+        if too_slow or too_big:
+            # Move down one step at a time
+            self._index = max(self._index - 1, 0)
+        elif page_size >= previous and num_records >= page_size and self._index < len(self._sizes) - 1 and \
+                self._fits(self._sizes[self._index + 1]):
+            # Only grow after a full page of the current size, as short (last) pages
+            # say little about larger ones
+            self._index += 1
+
+        if self.page_size != previous:
+            logger.debug('Page size {0} -> {1} ({2:.3f}s/page, {3} bytes/page)'.format(
+                previous, self.page_size, elapsed, num_bytes))
@@ -0,0 +1,128 @@
+"""Persisted partial aggregates of stream data, per time bucket.
+
+Reports over overlapping windows (e.g. month to date, every hour) keep
+downloading the same data. PartialAggregateStore keeps, for every stream and
+fixed size time bucket, the count, sum, min and max of the values in that
+bucket, in a SQLite database. A report then only downloads the buckets it has
+never seen, plus the still open buckets at the end of the window.
+
+Buckets are aligned to the UTC epoch and identified by their start time, in
+seconds since the epoch. A partial aggregate is a (count, sum, min, max) tuple;
+min and max are None for empty buckets.
+
+Example:
+
+    partials = PartialAggregateStore('partials.sqlite')
+    report = AccumulationReportGenerator(api, partials=partials, bucket_seconds=3600)
+    stats = report.compute_sum(sources, start=month_start, end=now)
+"""
+import sqlite3
+import threading
+
+EMPTY_PARTIAL = (0, 0.0, None, None)
+
+
+def merge_partials(first, second):
+    """
+    Args:
+        first: (count, sum, min, max) tuple
+        second: (count, sum, min, max) tuple
+
+    Returns:
+        (count, sum, min, max) tuple for the values of both
+    """
+    if not first[0]:
+        return second
+    if not second[0]:
+        return first
+    return (first[0] + second[0], first[1] + second[1], min(first[2], second[2]), max(first[3], second[3]))
+
+
+def partial_from_values(values):
+    """
+    Args:
+        values: list of numbers (None values are ignored)
+
+    Returns:
+        (count, sum, min, max) tuple
+    """
+    values = [value for value in values if value is not None]
+    if not values:
+        return EMPTY_PARTIAL
+    return (len(values), float(sum(values)), min(values), max(values))
+
+
+class PartialAggregateStore(object):
+    """
+    SQLite store of per stream, per time bucket partial aggregates
+
+    The store can be shared by several threads.
+
+    Args:
+        path: Database file path. Defaults to an in-memory database
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS partials ('
+                'stream TEXT NOT NULL, field TEXT NOT NULL, bucket_seconds INTEGER NOT NULL, '
+                'bucket_start INTEGER NOT NULL, count INTEGER NOT NULL, sum REAL NOT NULL, min REAL, max REAL, '
+                'PRIMARY KEY (stream, field, bucket_seconds, bucket_start))'
+            )
+
+    def get(self, stream, field, bucket_seconds, start, end):
+        """
+        Get the stored buckets of a stream in a time range
+
+        Args:
+            stream: Stream slug
+            field: Aggregated field (e.g. 'output_value')
+            bucket_seconds: Bucket size
+            start: First bucket start (seconds since the epoch)
+            end: End of the range (seconds since the epoch, exclusive)
+
+        Returns:
+            dict of bucket start -> (count, sum, min, max)
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT bucket_start, count, sum, min, max FROM partials '
+                'WHERE stream = ? AND field = ? AND bucket_seconds = ? AND bucket_start >= ? AND bucket_start < ?',
+                (str(stream), field, bucket_seconds, start, end)
+            ).fetchall()
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def put(self, stream, field, bucket_seconds, partials):
+        """
+        Store the partial aggregates of closed buckets (buckets that will not get new data)
+
+        Args:
+            stream: Stream slug
+            field: Aggregated field (e.g. 'output_value')
+            bucket_seconds: Bucket size
+            partials: dict of bucket start -> (count, sum, min, max)
+        """
+        rows = [(str(stream), field, bucket_seconds, bucket_start) + tuple(partial)
+                for bucket_start, partial in partials.items()]
+        with self._lock:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO partials VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def invalidate(self, stream=None):
+        """
+        Delete the stored buckets of a stream (e.g. after its data was modified), or of all streams
+        """
+        with self._lock:
+            with self._db:
+                if stream is None:
+                    self._db.execute('DELETE FROM partials')
+                else:
+                    self._db.execute('DELETE FROM partials WHERE stream = ?', (str(stream),))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,543 @@
+"""Composable, streaming report pipeline.
+
+A Pipeline runs these stages, connected by bounded queues:
+
+ 1. resolve: source slugs (projects, devices, streams, fleets or orgs) are resolved
+    to a list of unique streams (see SourceResolver)
+ 2. fetch: the data of every stream is downloaded, one page at a time, by a pool
+    of worker threads
+ 3. transform: every record goes through the transforms (e.g. MdoTransform), in
+    order. A transform can drop a record by returning None
+ 4. aggregate: every page is added to the aggregators (e.g. SumAggregator)
+ 5. sink: every page is written to the sinks (e.g. CsvSink, ExporterSink)
+
+Stages 3 to 5 run in the calling thread, so aggregators and sinks do not need
+to be thread safe. The fetch workers stop when queue_size pages are waiting to
+be processed, so memory use does not depend on the size of the data.
+
+Example:
+
+    pipeline = Pipeline(api, fields=['timestamp', 'value'],
+                        transforms=[MdoTransform('value')],
+                        aggregators={'stats': StatsAggregator('value')},
+                        sinks=[CsvSink('data.csv', ['timestamp', 'value'])])
+    result = pipeline.run(['p--0001'], start=t0, end=t1)
+    result['aggregates']['stats']
+"""
+import csv
+import io
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from ..api.exceptions import HttpClientError, RestBaseException
+from ..utils.basic import datetime_to_str
+from ..utils.cache import TTLCache
+from ..utils.gid import IOTileDeviceSlug, IOTileFleetSlug, IOTileProjectSlug, IOTileStreamSlug
+from ..utils.mdo import MdoHelper
+from .data import StreamData
+from .stats import RunningStats
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+# End of the pages of a stream, in the page queue
+_DONE = object()
+# Seconds between checks of the stop flag, when a queue is full
+_POLL_INTERVAL = 0.1
+
+# Prefix of org sources, followed by the org slug
+ORG_PREFIX = 'org--'
+# Seconds fleet and org membership is cached for, by default
+DEFAULT_MEMBERSHIP_TTL = 300
+
+
+def stream_units(stream):
+    """
+    Returns:
+        Short name of the output unit of a stream (dict), or None if it has none
+    """
+    output_unit = stream.get('output_unit') or {}
+    return output_unit.get('unit_short')
+
+
+class SourceResolver(object):
+    """
+    Resolve source slugs to the list of their streams
+
+    Sources can be projects (p--), devices (d--), streams (s--), fleets (g--) or orgs ('org--' followed
+    by the org slug, e.g. 'org--arch-internal'). Sources are resolved concurrently, following all pages
+    of results, and the devices of a fleet (or projects of an org) are expanded concurrently too.
+    Streams found through more than one source are only returned once, in the order of the sources.
+
+    Fleet devices and org projects can be cached in a TTLCache, shared by several resolvers.
+
+    Args:
+        api: Api object
+        workers: Number of concurrent requests
+        membership: Optional TTLCache for fleet and org membership
+    """
+
+    def __init__(self, api, workers=8, membership=None):
+        self._api = api
+        self.workers = workers
+        self.membership = membership
+        # Slug prefix -> method returning the list of streams of a source
+        self.factories = OrderedDict([
+            ('p--', self.project_streams),
+            ('d--', self.device_streams),
+            ('s--', self.stream),
+            ('g--', self.fleet_streams),
+            (ORG_PREFIX, self.org_streams),
+        ])
+
+    def _factory(self, source):
+        for prefix, factory in self.factories.items():
+            if source.startswith(prefix):
+                return factory
+        return None
+
+    def _all_pages(self, resource, **filters):
+        results = []
+        page = 1
+        while page:
+            data = resource.get(page=page, **filters)
+            results += data['results']
+            page = page + 1 if data.get('next') else 0
+        return results
+
+    def _cached(self, key, fetch):
+        if self.membership is None:
+            return fetch()
+        value = self.membership.get(key)
+        if value is None:
+            value = fetch()
+            self.membership.put(key, value)
+        return list(value)
+
+    def _expand(self, factory, slugs):
+        # Concurrently, keeping the order of slugs
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            found = executor.map(lambda slug: self._resolve_with(factory, slug), slugs)
+            return [stream for streams in found for stream in streams]
+
+    def all_streams(self, **filters):
+        """
+        Returns:
+            list of the streams matching the filters (e.g. project=slug), following all pages
+        """
+        return self._all_pages(self._api.stream(), **filters)
+
+    def fleet_devices(self, slug):
+        """
+        Returns:
+            list of the slugs of the devices of a fleet (cached)
+        """
+        fleet_slug = str(IOTileFleetSlug(slug))
+        return self._cached(('fleet', fleet_slug), lambda: [
+            item['device'] for item in self._all_pages(self._api.fleet(fleet_slug).devices)
+        ])
+
+    def org_projects(self, slug):
+        """
+        Returns:
+            list of the slugs of the projects of an org (cached)
+        """
+        return self._cached(('org', slug), lambda: [
+            item['slug'] for item in self._all_pages(self._api.project(), org=slug)
+        ])
+
+    def project_streams(self, slug):
+        return self.all_streams(project=str(IOTileProjectSlug(slug)))
+
+    def device_streams(self, slug):
+        return self.all_streams(device=str(IOTileDeviceSlug(slug)))
+
+    def stream(self, slug):
+        return [self._api.stream(str(IOTileStreamSlug(slug))).get()]
+
+    def fleet_streams(self, slug):
+        return self._expand(self.device_streams, self.fleet_devices(slug))
+
+    def org_streams(self, slug):
+        return self._expand(self.project_streams, self.org_projects(slug[len(ORG_PREFIX):]))
+
+    def _resolve_with(self, factory, slug):
+        try:
+            return factory(slug)
+        except HttpClientError as e:
+            logger.warning(e)
+            return []
+
+    def _resolve(self, source):
+        return self._resolve_with(self._factory(source), source)
+
+    def resolve(self, sources):
+        """
+        Args:
+            sources: list of source slugs. Illegal slugs, and sources that are not found, are skipped
+
+        Returns:
+            list of unique streams (dicts), in source order
+        """
+        valid = []
+        for source in sources:
+            if self._factory(source) is not None:
+                valid.append(source)
+            else:
+                logger.error('Illegal source slug: {}'.format(source))
+
+        streams = OrderedDict()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # In source order, so the stream order does not depend on which request finished first
+            for found in executor.map(self._resolve, valid):
+                for stream in found:
+                    streams.setdefault(stream['slug'], stream)
+        return list(streams.values())
+
+
+class MdoTransform(object):
+    """
+    Scale a field of every record with an MDO (value * m / d + o)
+
+    Args:
+        field: Field to scale (e.g. 'value')
+        mdo: MdoHelper to use for all streams. By default, the output unit MDO of each stream is used
+        unit: Stream unit to use when mdo is None ('output_unit' or 'input_unit')
+    """
+
+    def __init__(self, field='value', mdo=None, unit='output_unit'):
+        self.field = field
+        self.mdo = mdo
+        self.unit = unit
+        self._mdos = {}
+
+    def _stream_mdo(self, stream):
+        slug = stream['slug']
+        if slug not in self._mdos:
+            unit = stream.get(self.unit) or {}
+            if unit.get('m') and unit.get('d'):
+                self._mdos[slug] = MdoHelper(unit['m'], unit['d'], unit.get('o'))
+            else:
+                self._mdos[slug] = None
+        return self._mdos[slug]
+
+    def __call__(self, stream, record):
+        mdo = self.mdo or self._stream_mdo(stream)
+        value = record[self.field]
+        if mdo is None or value is None:
+            return record
+        value = mdo.compute(value)
+        if hasattr(record, '_replace'):
+            return record._replace(**{self.field: value})
+        record = dict(record)
+        record[self.field] = value
+        return record
+
+
+class BaseAggregator(object):
+    """
+    Aggregators are given every page of records of every stream, and return their result at the end.
+    The pages of a stream arrive in order, but pages of different streams are interleaved.
+    """
+
+    def add(self, stream, records):
+        raise NotImplementedError()
+
+    def discard(self, stream):
+        """
+        Drop the partial results of a stream that could not be downloaded
+        """
+        raise NotImplementedError()
+
+    def result(self, streams):
+        """
+        Args:
+            streams: list of all the streams, in order
+
+        Returns:
+            Aggregated result
+        """
+        raise NotImplementedError()
+
+
+class SumAggregator(BaseAggregator):
+    """
+    Sum of a field for every stream, and across all streams
+
+    Result: {'streams': {slug: {'sum': ..., 'units': ...}}, 'total': ...}, for streams with a non zero sum
+    """
+
+    def __init__(self, field='output_value'):
+        self.field = field
+        self._sums = {}
+
+    def add(self, stream, records):
+        values = [item[self.field] for item in records if item[self.field] is not None]
+        self._sums[stream['slug']] = self._sums.get(stream['slug'], 0) + sum(values)
+
+    def discard(self, stream):
+        self._sums.pop(stream['slug'], None)
+
+    def result(self, streams):
+        result = {
+            'streams': {},
+            'total': 0,
+        }
+        for stream in streams:
+            total = self._sums.get(stream['slug'])
+            if total:
+                result['streams'][stream['slug']] = {
+                    'sum': total,
+                    'units': stream_units(stream)
+                }
+                result['total'] += total
+        return result
+
+
+class StatsAggregator(BaseAggregator):
+    """
+    Count, sum, min, max, mean and standard deviation of a field for every stream, and across all streams
+
+    Result: {'streams': {slug: stats dict with units}, 'aggregate': stats dict}. See RunningStats.to_dict()
+    """
+
+    def __init__(self, field='output_value'):
+        self.field = field
+        self._stats = {}
+
+    def add(self, stream, records):
+        stats = self._stats.setdefault(stream['slug'], RunningStats())
+        stats.add([item[self.field] for item in records])
+
+    def discard(self, stream):
+        self._stats.pop(stream['slug'], None)
+
+    def result(self, streams):
+        result = {
+            'streams': {},
+            'aggregate': None,
+        }
+        aggregate = RunningStats()
+        for stream in streams:
+            stats = self._stats.get(stream['slug'])
+            if stats is not None and stats.count:
+                result['streams'][stream['slug']] = dict(stats.to_dict(), units=stream_units(stream))
+                aggregate.merge(stats)
+        result['aggregate'] = aggregate.to_dict()
+        return result
+
+
+class DictSink(object):
+    """
+    Keep all records in memory, by stream slug (in records)
+    """
+
+    def __init__(self):
+        self.records = OrderedDict()
+
+    def write(self, stream, records):
+        self.records.setdefault(stream['slug'], []).extend(records)
+
+    def close(self):
+        pass
+
+
+class CsvSink(object):
+    """
+    Write all records to a CSV file, with the stream slug as first column
+
+    Args:
+        path: Output file path
+        fields: Record fields to write (columns)
+    """
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = list(fields)
+        self._fp = io.open(path, 'w', newline='')
+        self._writer = csv.writer(self._fp)
+        self._writer.writerow(['stream'] + self.fields)
+
+    def write(self, stream, records):
+        for item in records:
+            self._writer.writerow([stream['slug']] + [item.get(field) for field in self.fields])
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+class ExporterSink(object):
+    """
+    Write all records with an exporter of iotile_cloud.stream.export (e.g. ParquetExporter)
+
+    Args:
+        exporter: BaseArrowExporter. It is closed with the sink
+    """
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+
+    def write(self, stream, records):
+        self.exporter.write_page(records, stream=stream['slug'])
+
+    def close(self):
+        self.exporter.close()
+
+
+class Pipeline(object):
+    """
+    Streaming pipeline: resolve sources, fetch pages concurrently, then transform, aggregate and write records
+
+    Args:
+        api: Api object
+        fields: Optional list of record fields to download (see BaseData.iter_pages())
+        transforms: list of functions (stream, record) -> record, or None to drop the record
+        aggregators: dict of name -> aggregator (see BaseAggregator)
+        sinks: list of sinks, with write(stream, records) and close() methods. They are closed at the end of run()
+        workers: Number of streams to download concurrently
+        queue_size: Maximum number of downloaded pages waiting to be processed
+        page_kwargs: Extra query arguments for every stream (e.g. {'keyset': True})
+        membership: Optional TTLCache of fleet and org membership (see SourceResolver). Defaults to a
+                    cache of this pipeline, with a time to live of DEFAULT_MEMBERSHIP_TTL seconds
+    """
+
+    def __init__(self, api, fields=None, transforms=None, aggregators=None, sinks=None, workers=8, queue_size=16,
+                 page_kwargs=None, membership=None):
+        self._api = api
+        self.fields = fields
+        self.transforms = list(transforms or [])
+        self.aggregators = OrderedDict(aggregators or {})
+        self.sinks = list(sinks or [])
+        self.workers = workers
+        self.queue_size = queue_size
+        self.page_kwargs = dict(page_kwargs or {})
+        if membership is None:
+            membership = TTLCache(DEFAULT_MEMBERSHIP_TTL)
+        self.resolver = SourceResolver(api, workers=workers, membership=membership)
+
+    @staticmethod
+    def _put(pages, item, stop):
+        # Block while the queue is full (backpressure), unless the pipeline is stopping
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fetch(self, stream, start, end, pages, stop):
+        error = None
+        try:
+            data = StreamData(stream['slug'], self._api)
+            for page in data.iter_pages(fields=self.fields, start=start, end=end, **self.page_kwargs):
+                if not self._put(pages, (stream, page, None), stop):
+                    return
+        except (RestBaseException, requests.exceptions.RequestException) as e:
+            logger.error('{0}: {1}'.format(stream['slug'], e))
+            error = str(e)
+        except Exception as e:
+            # Raised again in the calling thread
+            error = e
+        self._put(pages, (stream, _DONE, error), stop)
+
+    def _transform(self, stream, records):
+        for transform in self.transforms:
+            records = [record for record in (transform(stream, item) for item in records) if record is not None]
+        return records
+
+    def run_streams(self, streams, start, end=None, schedule=None):
+        """
+        Run the fetch, transform, aggregate and sink stages for already resolved streams
+
+        Args:
+            streams: list of streams (dicts with at least a slug)
+            start: Start datetime
+            end: End datetime. Defaults to now
+            schedule: Optional list of the same streams, in the order to download them
+                      (e.g. largest first, see ReportPlanner). Results are still in stream order
+
+        Returns:
+            dict with 'aggregates' (name -> aggregator result) and 'errors' (stream slug -> error message)
+        """
+        if not end:
+            end = datetime.utcnow()
+        start = datetime_to_str(start)
+        end = datetime_to_str(end)
+
+        errors = {}
+        pages = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for stream in schedule or streams:
+                executor.submit(self._fetch, stream, start, end, pages, stop)
+
+            remaining = len(streams)
+            while remaining:
+                stream, records, error = pages.get()
+                if records is _DONE:
+                    remaining -= 1
+                    if isinstance(error, Exception):
+                        raise error
+                    if error is not None:
+                        errors[stream['slug']] = error
+                        for aggregator in self.aggregators.values():
+                            aggregator.discard(stream)
+                    continue
+
+                records = self._transform(stream, records)
+                for aggregator in self.aggregators.values():
+                    aggregator.add(stream, records)
+                for sink in self.sinks:
+                    sink.write(stream, records)
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+            for sink in self.sinks:
+                sink.close()
+
+        return {
+            'aggregates': OrderedDict((name, aggregator.result(streams))
+                                      for name, aggregator in self.aggregators.items()),
+            'errors': errors,
+        }
+
+    def run(self, sources, start, end=None):
+        """
+        Run the whole pipeline
+
+        Args:
+            sources: list of project, device or stream slugs
+            start: Start datetime
+            end: End datetime. Defaults to now
+
+        Returns:
+            dict with 'streams' (list of stream slugs), 'aggregates' and 'errors'. See run_streams()
+        """
+        streams = self.resolver.resolve(sources)
+        logger.info('Processing {} streams'.format(len(streams)))
+        result = self.run_streams(streams, start, end)
+        result['streams'] = [stream['slug'] for stream in streams]
+        return result
+
+
+def accumulation_pipeline(api, field='output_value', workers=8, **kwargs):
+    """
+    Pipeline summing a field for every stream, and across all streams (see AccumulationReportGenerator)
+
+    Returns:
+        Pipeline with a 'sum' SumAggregator
+    """
+    return Pipeline(api, fields=[field], aggregators={'sum': SumAggregator(field)}, workers=workers, **kwargs)
@@ -0,0 +1,195 @@
+"""Cost estimation and largest-first scheduling of report runs.
+
+A parallel report only finishes when its slowest worker does. ReportPlanner
+estimates the number of records of every stream cheaply, before any data is
+downloaded:
+
+ - 'probe' (default): one request per stream for a single record (page_size=1)
+   over the report window, reading the total count of the response
+ - 'device': one request per device (/device/<slug>/extra/), reading the
+   stream_counts of all its streams. These counts are not limited to the
+   window, so they over-estimate reports over part of the data
+
+Streams are then scheduled largest first (longest processing time first), and
+the plan reports the estimated records, pages and time of the run, assigning
+streams to the least loaded worker in schedule order. With a budget, runs
+estimated over the limits raise PlanBudgetExceeded before downloading data.
+
+Example:
+
+    planner = ReportPlanner(api, max_records=10 ** 7)
+    gen = StatsReportGenerator(api, planner=planner)
+    plan = gen.plan(sources, start=t0, end=t1)
+    print(plan['records'], plan['pages'], plan['seconds'], plan['over_budget'])
+    stats = gen.compute_stats(sources, start=t0, end=t1)  # Raises PlanBudgetExceeded if over budget
+"""
+import heapq
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from ..api.exceptions import RestBaseException
+from ..utils.basic import datetime_to_str
+from ..utils.gid import IOTileStreamSlug
+from .paging import DEFAULT_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+PLAN_METHODS = ('probe', 'device')
+
+# Rough time to download and process one page of DEFAULT_PAGE_SIZE records
+DEFAULT_SECONDS_PER_PAGE = 0.5
+
+
+class PlanBudgetExceeded(Exception):
+    """
+    Raised when a report run is estimated over the budget of its ReportPlanner
+
+    Attributes:
+        plan: The plan (see ReportPlanner.plan())
+    """
+
+    def __init__(self, message, plan):
+        super(PlanBudgetExceeded, self).__init__(message)
+        self.plan = plan
+
+
+def _stream_device(stream):
+    if stream.get('device'):
+        return str(stream['device'])
+    return str(IOTileStreamSlug(stream['slug']).get_parts()['device'])
+
+
+class ReportPlanner(object):
+    """
+    Estimate the cost of a report run, and schedule its streams largest first
+
+    Args:
+        api: Api object
+        method: 'probe' or 'device'. See module documentation
+        workers: Number of concurrent estimate requests
+        page_size: Records per page, to estimate the number of pages
+        seconds_per_page: Estimated time to download and process a page
+        max_records: Optional budget for the estimated number of records
+        max_pages: Optional budget for the estimated number of pages
+        max_seconds: Optional budget for the estimated run time (in seconds)
+    """
+
+    def __init__(self, api, method='probe', workers=8, page_size=DEFAULT_PAGE_SIZE,
+                 seconds_per_page=DEFAULT_SECONDS_PER_PAGE, max_records=None, max_pages=None, max_seconds=None):
+        if method not in PLAN_METHODS:
+            raise ValueError('Illegal method: {0}. Must be one of {1}'.format(method, PLAN_METHODS))
+        self._api = api
+        self.method = method
+        self.workers = workers
+        self.page_size = page_size
+        self.seconds_per_page = seconds_per_page
+        self.budget = OrderedDict([
+            ('records', max_records),
+            ('pages', max_pages),
+            ('seconds', max_seconds),
+        ])
+
+    def _probe(self, stream, start, end):
+        try:
+            data = self._api.stream(stream['slug']).data.get(start=start, end=end, page_size=1, page=1)
+        except (RestBaseException, requests.exceptions.RequestException) as e:
+            logger.warning('{0}: {1}'.format(stream['slug'], e))
+            return None
+        return data.get('count')
+
+    def _device_counts(self, device):
+        try:
+            extra = self._api.device(device).extra.get()
+        except (RestBaseException, requests.exceptions.RequestException) as e:
+            logger.warning('{0}: {1}'.format(device, e))
+            return {}
+        # The cloud only lists streams with data
+        return {slug: counts['data_cnt'] for slug, counts in (extra.get('stream_counts') or {}).items()}
+
+    def estimate(self, streams, start, end=None):
+        """
+        Args:
+            streams: list of streams (dicts with at least a slug)
+            start: Start datetime
+            end: End datetime. Defaults to now
+
+        Returns:
+            OrderedDict of stream slug -> estimated number of records (None if unknown), in stream order
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            if self.method == 'probe':
+                start = datetime_to_str(start)
+                end = datetime_to_str(end or datetime.utcnow())
+                counts = list(executor.map(lambda stream: self._probe(stream, start, end), streams))
+            else:
+                devices = list(OrderedDict.fromkeys(_stream_device(stream) for stream in streams))
+                stream_counts = {}
+                for device_counts in executor.map(self._device_counts, devices):
+                    stream_counts.update(device_counts)
+                counts = [stream_counts.get(stream['slug'], 0) for stream in streams]
+
+        return OrderedDict((stream['slug'], count) for stream, count in zip(streams, counts))
+
+    def plan(self, streams, start, end=None, workers=1):
+        """
+        Estimate a report run over the streams, processed by a number of workers
+
+        Args:
+            streams: list of streams (dicts with at least a slug)
+            start: Start datetime
+            end: End datetime. Defaults to now
+            workers: Number of streams processed concurrently by the report
+
+        Returns:
+            dict with the estimated total 'records' and 'pages', and 'seconds' until the last worker
+            finishes, 'workers', 'over_budget' (names of the budget limits exceeded) and 'streams': one dict
+            per stream (slug, records, pages, seconds), largest first. Streams whose count could not
+            be estimated are counted as empty
+        """
+        estimates = self.estimate(streams, start, end)
+
+        # Largest first. Sorting is stable, so streams of the same size keep the stream order
+        scheduled = sorted(estimates.items(), key=lambda item: -(item[1] or 0))
+        rows = []
+        loads = [0.0] * max(1, workers)
+        for slug, records in scheduled:
+            # Even empty streams take one request
+            pages = max(1, -(-(records or 0) // self.page_size))
+            seconds = pages * self.seconds_per_page
+            heapq.heapreplace(loads, loads[0] + seconds)
+            rows.append({'slug': slug, 'records': records, 'pages': pages, 'seconds': seconds})
+
+        plan = {
+            'streams': rows,
+            'records': sum(row['records'] or 0 for row in rows),
+            'pages': sum(row['pages'] for row in rows),
+            'seconds': max(loads),
+            'workers': workers,
+        }
+        plan['over_budget'] = [name for name, limit in self.budget.items()
+                               if limit is not None and plan[name] > limit]
+        logger.info('Estimated {0} records, {1} pages, {2:.1f}s for {3} streams'.format(
+            plan['records'], plan['pages'], plan['seconds'], len(rows)))
+        return plan
+
+    def check(self, plan):
+        """
+        Raises:
+            PlanBudgetExceeded: if the plan is over budget
+        """
+        if plan['over_budget']:
+            raise PlanBudgetExceeded('Report over budget: ' + ', '.join(
+                'estimated {0} {1} > {2}'.format(plan[name], name, self.budget[name])
+                for name in plan['over_budget']), plan)
+
+    def schedule(self, streams, plan):
+        """
+        Returns:
+            list of the streams, in the order of the plan (largest first)
+        """
+        by_slug = {stream['slug']: stream for stream in streams}
+        return [by_slug[row['slug']] for row in plan['streams']]
@@ -1,83 +1,406 @@
 import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pprint import pprint
-from datetime import datetime
+from datetime import datetime, timedelta
+
+import requests
 
 from ..api.connection import Api
-from ..api.exceptions import HttpNotFoundError, HttpClientError
+from ..api.exceptions import HttpClientError, RestBaseException
+from ..stream.aggregate import BucketAggregator
 from ..stream.data import StreamData
+from ..stream.partials import EMPTY_PARTIAL, PartialAggregateStore, merge_partials, partial_from_values
+from ..stream.pipeline import DEFAULT_MEMBERSHIP_TTL, SourceResolver, accumulation_pipeline, stream_units
+from ..stream.planner import ReportPlanner
+from ..stream.sketch import TDigest
+from ..stream.stats import RunningStats
 from ..utils.gid import *
 from ..utils.basic import datetime_to_str
+from ..utils.cache import TTLCache
+from ..utils.timestamp import UTC, parse_timestamp
 
 logger = logging.getLogger(__name__)
 
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+
+def _to_epoch(dt):
+    # Naive datetimes are in UTC
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+    delta = dt - _EPOCH
+    return delta.days * 86400 + delta.seconds
+
+
+def _epoch_to_str(seconds):
+    return datetime_to_str(_EPOCH + timedelta(seconds=seconds))
+
+
+BACKENDS = ('thread', 'process')
+
+# Generator attributes that do not change the report
+_UNCACHED_PARAMS = ('workers', 'backend', 'partials', 'cache', 'planner')
+
+# Api of the current process pool worker (see _init_worker())
+_worker_api = None
+
+
+def _api_config(api):
+    return {
+        'domain': api.domain,
+        'token': api.token,
+        'token_type': api.token_type,
+        'verify': api.session.verify,
+        'timeout': getattr(api, '_timeout', None),
+        'retries': getattr(api, '_retries', None),
+    }
+
+
+def _init_worker(api_config):
+    # Every worker process has its own session, authenticated with the parent's token
+    global _worker_api
+    _worker_api = Api(domain=api_config['domain'], token_type=api_config['token_type'], verify=api_config['verify'],
+                      timeout=api_config['timeout'], retries=api_config['retries'])
+    _worker_api.set_token(api_config['token'])
+
+
+def _run_shard(generator, method_name, streams, args):
+    generator._attach(_worker_api)
+    method = getattr(generator, method_name)
+    return [generator._call_stream(method, stream, args) for stream in streams]
+
+
 class BaseReportGenerator(object):
+    """
+    Base class for reports computed over the streams of a list of sources (projects, devices, streams,
+    fleets or orgs). See SourceResolver
+
+    Sources are resolved concurrently, following all pages of results, and streams found through
+    more than one source (e.g. a project and one of its devices) are only processed once. Fleet and
+    org membership is cached, so repeated reports over the same fleets do not list their devices again.
+
+    With a PartialAggregateStore, subclasses using _aggregate_stream() only download the time buckets
+    they have not seen before, plus the still open buckets at the end of the window.
+
+    Streams are processed on a thread pool, or with backend='process', sharded across a process pool
+    for CPU heavy reports. Every worker process then has its own Api, authenticated with the token of
+    api, and the per stream partial results (which must be picklable) are merged in the parent.
+
+    With a ReportPlanner, the records of every stream are estimated before downloading any data, streams
+    are processed largest first, and runs over the budget of the planner raise PlanBudgetExceeded.
+    The plan of the last run is kept in last_plan. See plan()
+
+    Args:
+        api: Api object
+        workers: Number of concurrent requests (threads, or processes with backend='process')
+        partials: Optional PartialAggregateStore to keep per bucket partial aggregates in
+        bucket_seconds: Size of the buckets stored in partials
+        open_buckets: Number of buckets, up to and including the current one, that are still open
+                      (may still get data) and are always downloaded
+        backend: 'thread' or 'process'
+        cache: Optional ReportCache. Reports already computed with the same sources, window and
+               parameters are then returned from the cache
+        membership: Optional TTLCache of fleet and org membership, to share between generators.
+                    Defaults to a cache of this generator, with a time to live of 5 minutes
+        planner: Optional ReportPlanner, to estimate and schedule every run
+    """
     _api = None
     _stream_slugs = []
     _streams = []
 
-    def __init__(self, api):
+    def __init__(self, api, workers=8, partials=None, bucket_seconds=3600, open_buckets=1, backend='thread',
+                 cache=None, membership=None, planner=None):
+        if backend not in BACKENDS:
+            raise ValueError('Illegal backend: {0}. Must be one of {1}'.format(backend, BACKENDS))
+        if backend == 'process' and partials is not None and partials.path == ':memory:':
+            raise ValueError('The process backend needs a PartialAggregateStore with a file path')
         self._api = api
+        self.workers = workers
+        self.backend = backend
+        self.cache = cache
+        self.planner = planner
+        self.partials = partials
+        self.bucket_seconds = bucket_seconds
+        self.open_buckets = open_buckets
+        self._clock = time.time
+        if membership is None:
+            membership = TTLCache(DEFAULT_MEMBERSHIP_TTL)
+        self._source_resolver = SourceResolver(api, workers=workers, membership=membership)
         self._clean()
 
     def _clean(self):
+        # Stream metadata by slug, in the order the streams were found
+        self._stream_index = OrderedDict()
         self._stream_slugs = []
         self._streams = []
+        # Streams in processing order, and the plan they come from (see plan())
+        self._schedule = None
+        self._plan = None
+
+    @property
+    def last_plan(self):
+        """Plan of the last run with a planner, or None"""
+        return self._plan
 
     def _add_streams(self, streams):
+        if isinstance(streams, dict):
+            streams = streams['results']
 
-        # pprint.pprint(streams)
-        logger.debug('Adding {} streams'.format(streams['count']))
-        self._stream_slugs += [s['slug'] for s in streams['results']]
-        self._streams += streams['results']
+        logger.debug('Adding {} streams'.format(len(streams)))
+        for stream in streams:
+            if stream['slug'] not in self._stream_index:
+                self._stream_index[stream['slug']] = stream
+        # Kept for compatibility with code using the lists directly
+        self._stream_slugs = list(self._stream_index.keys())
+        self._streams = list(self._stream_index.values())
+
+    def _resolver(self):
+        return self._source_resolver
+
+    def _get_all_streams(self, **filters):
+        return self._resolver().all_streams(**filters)
+
+    def _get_streams_from_project_slug(self, slug):
+        return self._resolver().project_streams(slug)
+
+    def _get_streams_from_device_slug(self, slug):
+        return self._resolver().device_streams(slug)
+
+    def _get_stream_from_slug(self, slug):
+        return self._resolver().stream(slug)
 
     def _fetch_streams_from_project_slug(self, slug):
-        project_slug = IOTileProjectSlug(slug)
         try:
-            streams = self._api.stream().get(project=str(project_slug))
-            self._add_streams(streams)
+            self._add_streams(self._get_streams_from_project_slug(slug))
         except HttpClientError as e:
             logger.warning(e)
 
     def _fetch_streams_from_device_slug(self, slug):
-        device_slug = IOTileDeviceSlug(slug)
-
         try:
-            streams = self._api.stream().get(device=str(device_slug))
-            self._add_streams(streams)
+            self._add_streams(self._get_streams_from_device_slug(slug))
         except HttpClientError as e:
             logger.warning(e)
 
     def _fetch_stream_from_slug(self, slug):
-        stream_slug = IOTileStreamSlug(slug)
-
         try:
-            stream = self._api.stream(str(stream_slug)).get()
-            self._stream_slugs.append(stream['slug'])
-            self._streams += [stream,]
+            self._add_streams(self._get_stream_from_slug(slug))
         except HttpClientError as e:
             logger.warning(e)
 
+    def _resolve_sources(self, sources):
+        # Streams are added in source order, so the stream order does not depend on which request finished first
+        self._add_streams(self._resolver().resolve(sources))
+
+    def _fetch_range(self, slug, field, start, end):
+        total = EMPTY_PARTIAL
+        stream_data = StreamData(slug, self._api)
+        for page in stream_data.iter_pages(fields=[field], start=_epoch_to_str(start), end=_epoch_to_str(end)):
+            total = merge_partials(total, partial_from_values([item[field] for item in page]))
+        return total
+
+    def _fetch_buckets(self, slug, field, start, end):
+        size = self.bucket_seconds
+        partials = {}
+        stream_data = StreamData(slug, self._api)
+        for page in stream_data.iter_pages(fields=['timestamp', field], start=_epoch_to_str(start),
+                                           end=_epoch_to_str(end)):
+            # Every page is folded into the partials, so memory only grows with the number of buckets
+            values = {}
+            for item in page:
+                bucket = _to_epoch(parse_timestamp(item['timestamp'])) // size * size
+                values.setdefault(bucket, []).append(item[field])
+            for bucket, bucket_values in values.items():
+                partials[bucket] = merge_partials(partials.get(bucket, EMPTY_PARTIAL),
+                                                  partial_from_values(bucket_values))
+
+        # Empty buckets are stored too, so they are not downloaded again
+        return OrderedDict((bucket, partials.get(bucket, EMPTY_PARTIAL)) for bucket in range(start, end, size))
+
+    def _aggregate_stream(self, slug, start, end, field='output_value'):
+        """
+        Compute the (count, sum, min, max) of a stream field between two datetimes,
+        reusing and filling self.partials if set
+        """
+        start = _to_epoch(start)
+        end = _to_epoch(end)
+        if self.partials is None:
+            return self._fetch_range(slug, field, start, end)
+
+        size = self.bucket_seconds
+        first = -(-start // size) * size
+        closed_end = (int(self._clock()) // size - (self.open_buckets - 1)) * size
+        last = min(end // size * size, closed_end)
+        if first >= last:
+            return self._fetch_range(slug, field, start, end)
+
+        stored = self.partials.get(slug, field, size, first, last)
+        total = EMPTY_PARTIAL
+        if start < first:
+            total = merge_partials(total, self._fetch_range(slug, field, start, first))
+
+        missing = [bucket for bucket in range(first, last, size) if bucket not in stored]
+        logger.debug('{0}: {1} stored buckets, {2} to download'.format(slug, len(stored), len(missing)))
+        for partial in stored.values():
+            total = merge_partials(total, partial)
+
+        # Download contiguous runs of missing buckets with one query each
+        runs = []
+        for bucket in missing:
+            if runs and runs[-1][1] == bucket:
+                runs[-1][1] = bucket + size
+            else:
+                runs.append([bucket, bucket + size])
+        for run_start, run_end in runs:
+            fetched = self._fetch_buckets(slug, field, run_start, run_end)
+            self.partials.put(slug, field, size, fetched)
+            for partial in fetched.values():
+                total = merge_partials(total, partial)
+
+        if last < end:
+            total = merge_partials(total, self._fetch_range(slug, field, last, end))
+        return total
+
     def _process_data(self, start, end=None):
         logger.error('_process_data must be implemented')
         return {}
 
-    def compute_sum(self, sources, start, end=None):
-        factory = {
-            'p--': self._fetch_streams_from_project_slug,
-            'd--': self._fetch_streams_from_device_slug,
-            's--': self._fetch_stream_from_slug,
-        }
+    def __getstate__(self):
+        # Sent to process pool workers: without the Api (see _attach()) or the streams
+        state = self.__dict__.copy()
+        state['_api'] = None
+        state['_stream_index'] = OrderedDict()
+        state['_stream_slugs'] = []
+        state['_streams'] = []
+        state['cache'] = None
+        state['planner'] = None
+        state['_schedule'] = None
+        state['_source_resolver'] = None
+        if self.partials is not None:
+            state['partials'] = self.partials.path
+        return state
+
+    def _attach(self, api):
+        self._api = api
+        self._source_resolver = SourceResolver(api, workers=self.workers, membership=TTLCache(DEFAULT_MEMBERSHIP_TTL))
+        if isinstance(self.partials, str):
+            self.partials = PartialAggregateStore(self.partials)
+
+    def _call_stream(self, func, stream, args):
+        try:
+            return func(stream, *args), None
+        except (RestBaseException, requests.exceptions.RequestException) as e:
+            logger.error('{0}: {1}'.format(stream['slug'], e))
+            return None, str(e)
+
+    def _map_streams_in_processes(self, method_name, streams, args):
+        # A few shards per worker, so workers that get slow streams do not hold everything up. Streams are
+        # dealt to the shards in turn, so with a schedule every shard gets a mix of large and small streams
+        count = min(len(streams), self.workers * 4)
+        shards = [streams[i::count] for i in range(count)]
+        logger.debug('Processing {0} streams in {1} shards'.format(len(streams), len(shards)))
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(_api_config(self._api),)) as executor:
+            futures = [executor.submit(_run_shard, self, method_name, shard, args) for shard in shards]
+            results = [result for future in futures for result in future.result()]
+        # Back in stream order
+        order = [i for shard in range(count) for i in range(shard, len(streams), count)]
+        ordered = [None] * len(streams)
+        for i, result in zip(order, results):
+            ordered[i] = result
+        return ordered
+
+    def _map_streams(self, func, *args):
+        """
+        Call func(stream, *args) for every stream concurrently
+
+        Args:
+            func: Method of this generator. With the process backend, it runs on a copy of the
+                  generator in a worker process, and its result must be picklable
+
+        Returns:
+            list of (stream, result, error) tuples in stream order, where error is the error
+            message if the stream could not be downloaded (and result is then None)
+        """
+        # Streams are started in schedule order (largest first, with a planner)
+        streams = self._schedule or self._streams
+        if self.backend == 'process':
+            results = self._map_streams_in_processes(func.__name__, streams, args)
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(lambda stream: self._call_stream(func, stream, args), streams))
+
+        # Results are in stream order, so reports do not depend on the schedule, or on which stream finished first
+        by_slug = dict(zip((stream['slug'] for stream in streams), results))
+        return [(stream,) + tuple(by_slug[stream['slug']]) for stream in self._streams]
+
+    def cache_params(self):
+        """
+        Returns:
+            dict of the parameters that change the report (used in ReportCache keys)
+        """
+        return {name: value for name, value in vars(self).items()
+                if not name.startswith('_') and name not in _UNCACHED_PARAMS}
+
+    def compute(self, sources, start, end=None):
+        """
+        Compute the report over the streams of the given sources
+
+        Args:
+            sources: list of project, device or stream slugs
+            start: Start datetime
+            end: End datetime. Defaults to now
+
+        Returns:
+            Report dict
+        """
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(self, sources, start, end)
+            stats = self.cache.get(key)
+            if stats is not None:
+                logger.info('Report found in cache')
+                return stats
+
+        stats = self._compute(sources, start, end)
+
+        # Reports with errors are computed again next time
+        if key is not None and 'error' not in stats and not stats.get('errors'):
+            self.cache.put(key, stats, sources=sources, streams=self._stream_slugs, end=end)
+        return stats
+
+    def plan(self, sources, start, end=None):
+        """
+        Estimate the cost of a report over the streams of the given sources, without computing it
+
+        Uses the planner of this generator, or a ReportPlanner with default settings (and no budget).
 
-        # Given the list of source slugs (project or device), get a unified list of devices
+        Args:
+            sources: list of project, device, stream, fleet or org slugs
+            start: Start datetime
+            end: End datetime. Defaults to now
+
+        Returns:
+            Plan dict (see ReportPlanner.plan())
+        """
         self._clean()
-        for src in sources:
-            prefix = src[0:3]
-            if prefix in factory:
-                factory[prefix](src)
-            else:
-                logger.error('Illegal source slug: {}'.format(src))
+        self._resolve_sources(sources)
+        planner = self.planner or ReportPlanner(self._api, workers=self.workers)
+        return planner.plan(self._streams, start, end, workers=self.workers)
+
+    def _compute(self, sources, start, end):
+        # Given the list of source slugs (project, device or stream), get a unified list of streams
+        self._clean()
+        self._resolve_sources(sources)
 
         if len(self._streams):
+            if self.planner is not None:
+                # Raises PlanBudgetExceeded before downloading any data
+                self._plan = self.planner.plan(self._streams, start, end, workers=self.workers)
+                self.planner.check(self._plan)
+                self._schedule = self.planner.schedule(self._streams, self._plan)
             logger.info('Processing {} streams'.format(len(self._streams)))
             stats = self._process_data(start, end)
         else:
@@ -87,48 +410,279 @@ class BaseReportGenerator(object):
 
         return stats
 
+    def compute_sum(self, sources, start, end=None):
+        return self.compute(sources, start, end)
+
 
 class AccumulationReportGenerator(BaseReportGenerator):
     """
     For every stream, compute the total sum of its data
     Compute grand total across all streams
+
+    Streams are downloaded concurrently, and summed one page at a time as pages arrive
+    (see accumulation_pipeline()). Results do not depend on the number of workers.
+
+    Args:
+        api: Api object
+        workers: Number of streams to download concurrently
+        kwargs: backend, cache, membership, planner, partials, bucket_seconds and open_buckets. See BaseReportGenerator
     """
 
-    def __init__(self, api):
-        super(AccumulationReportGenerator, self).__init__(api)
+    def __init__(self, api, workers=8, **kwargs):
+        super(AccumulationReportGenerator, self).__init__(api, workers=workers, **kwargs)
+
+    def _sum_stream(self, stream, start, end):
+        return self._aggregate_stream(stream['slug'], start, end, field='output_value')[1]
 
     def _process_data(self, start, end=None):
         logger.debug('Processing Data from {0} to {1}'.format(start, end))
 
-        if end:
-            end = datetime_to_str(end)
-        else:
-            end = datetime_to_str(datetime.utcnow())
+        if not end:
+            end = datetime.utcnow()
+        logger.debug('--> start={0}, end={1}'.format(datetime_to_str(start), datetime_to_str(end)))
 
-        start = datetime_to_str(start)
-        logger.debug('--> start={0}, end={1}'.format(start, end))
+        if self.partials is None and self.backend == 'thread':
+            pipeline = accumulation_pipeline(self._api, workers=self.workers)
+            result = pipeline.run_streams(self._streams, start, end, schedule=self._schedule)
+            stream_stats = result['aggregates']['sum']
+            stream_stats['errors'] = result['errors']
+            return stream_stats
 
         stream_stats = {
             'streams': {},
-            'total': 0
+            'total': 0,
+            'errors': {},
         }
-        # pprint(self._streams)
-        for stream in self._streams:
-            stream_data = StreamData(stream['slug'], self._api)
-            try:
-                stream_data.initialize_from_server(start=start, end=end)
-            except HttpNotFoundError as e:
-                logger.error(e)
-
-            sum = 0
-            for item in stream_data.data:
-                sum += item['output_value']
-
-            if sum:
+
+        for stream, total, error in self._map_streams(self._sum_stream, start, end):
+            if error is not None:
+                stream_stats['errors'][stream['slug']] = error
+            elif total:
                 stream_stats['streams'][stream['slug']] = {
-                    'sum': sum,
-                    'units': stream['output_unit']['unit_short']
+                    'sum': total,
+                    'units': stream_units(stream)
                 }
-                stream_stats['total'] += sum
+                stream_stats['total'] += total
 
         return stream_stats
+
+
+class StatsReportGenerator(BaseReportGenerator):
+    """
+    For every stream, compute the count, sum, min, max, mean and standard deviation of its data
+    Compute the same statistics across all streams
+
+    Statistics are updated one page at a time (see RunningStats), so streams are never held in memory.
+
+    Args:
+        api: Api object
+        workers: Number of streams to download concurrently
+        field: Data field to compute statistics of
+        backend: 'thread' or 'process'. See BaseReportGenerator
+        cache: Optional ReportCache. See BaseReportGenerator
+        membership: Optional TTLCache of fleet and org membership. See BaseReportGenerator
+        planner: Optional ReportPlanner. See BaseReportGenerator
+    """
+
+    def __init__(self, api, workers=8, field='output_value', backend='thread', cache=None, membership=None,
+                 planner=None):
+        super(StatsReportGenerator, self).__init__(api, workers=workers, backend=backend, cache=cache,
+                                                   membership=membership, planner=planner)
+        self.field = field
+
+    def _stream_stats(self, stream, start, end):
+        stats = RunningStats()
+        stream_data = StreamData(stream['slug'], self._api)
+        for page in stream_data.iter_pages(fields=[self.field], start=datetime_to_str(start), end=datetime_to_str(end)):
+            stats.add([item[0] for item in page])
+        return stats
+
+    def _process_data(self, start, end=None):
+        if not end:
+            end = datetime.utcnow()
+
+        report = {
+            'streams': {},
+            'aggregate': None,
+            'errors': {},
+        }
+
+        aggregate = RunningStats()
+        for stream, stats, error in self._map_streams(self._stream_stats, start, end):
+            if error is not None:
+                report['errors'][stream['slug']] = error
+            elif stats.count:
+                report['streams'][stream['slug']] = dict(stats.to_dict(), units=stream_units(stream))
+                aggregate.merge(stats)
+
+        report['aggregate'] = aggregate.to_dict()
+        return report
+
+    def compute_stats(self, sources, start, end=None):
+        return self.compute(sources, start, end)
+
+
+class RollupReportGenerator(BaseReportGenerator):
+    """
+    For every stream, compute hourly or daily totals (count, sum, min, max, mean, first and last per bucket)
+    and overall statistics. Compute the same totals and statistics across all streams
+
+    Everything is computed in one pass over the pages of every stream. Requires numpy.
+
+    Args:
+        api: Api object
+        interval: Bucket interval: 'hour', 'day', 'week', 'month' or seconds. See BucketAggregator
+        tz: Timezone for calendar buckets (e.g. 'America/Los_Angeles'). Defaults to UTC
+        workers: Number of streams to download concurrently
+        field: Data field to aggregate
+        backend: 'thread' or 'process'. See BaseReportGenerator
+        cache: Optional ReportCache. See BaseReportGenerator
+        membership: Optional TTLCache of fleet and org membership. See BaseReportGenerator
+        planner: Optional ReportPlanner. See BaseReportGenerator
+    """
+
+    def __init__(self, api, interval='day', tz=None, workers=8, field='output_value', backend='thread', cache=None,
+                 membership=None, planner=None):
+        super(RollupReportGenerator, self).__init__(api, workers=workers, backend=backend, cache=cache,
+                                                    membership=membership, planner=planner)
+        # Fail early if the configuration is not valid (or numpy is missing)
+        BucketAggregator(interval, tz=tz)
+        self.interval = interval
+        self.tz = tz
+        self.field = field
+
+    def _stream_rollup(self, stream, start, end):
+        stats = RunningStats()
+        buckets = BucketAggregator(self.interval, tz=self.tz)
+        stream_data = StreamData(stream['slug'], self._api)
+        for page in stream_data.iter_pages(fields=['timestamp', self.field], start=datetime_to_str(start),
+                                           end=datetime_to_str(end)):
+            page = [item for item in page if item[1] is not None]
+            stats.add([item[1] for item in page])
+            buckets.add_page(page, value_field=self.field)
+        return stats, buckets
+
+    @staticmethod
+    def _buckets_to_list(buckets):
+        result = buckets.result()
+        rows = []
+        for i, bucket in enumerate(result['bucket']):
+            row = OrderedDict([('bucket', '{0}Z'.format(str(bucket)))])
+            for name in ('count', 'sum', 'min', 'max', 'mean', 'first', 'last'):
+                row[name] = result[name][i].item()
+            rows.append(row)
+        return rows
+
+    def _process_data(self, start, end=None):
+        if not end:
+            end = datetime.utcnow()
+
+        report = {
+            'streams': {},
+            'aggregate': None,
+            'totals': [],
+            'errors': {},
+        }
+
+        aggregate = RunningStats()
+        totals = BucketAggregator(self.interval, tz=self.tz)
+        for stream, result, error in self._map_streams(self._stream_rollup, start, end):
+            if error is not None:
+                report['errors'][stream['slug']] = error
+                continue
+            stats, buckets = result
+            if stats.count:
+                report['streams'][stream['slug']] = {
+                    'stats': stats.to_dict(),
+                    'totals': self._buckets_to_list(buckets),
+                    'units': stream_units(stream),
+                }
+                aggregate.merge(stats)
+                totals.merge(buckets)
+
+        report['aggregate'] = aggregate.to_dict()
+        report['totals'] = self._buckets_to_list(totals)
+        return report
+
+    def compute_totals(self, sources, start, end=None):
+        return self.compute(sources, start, end)
+
+
+class PercentileReportGenerator(BaseReportGenerator):
+    """
+    For every stream, compute percentiles of its data (e.g. p50, p95, p99)
+    Compute the same percentiles across all streams
+
+    Every stream is summarized in a TDigest, one page at a time, and digests are merged for the aggregate,
+    so memory does not grow with the number of values. Requires numpy.
+
+    Args:
+        api: Api object
+        percentiles: list of percentiles to compute, between 0 and 100
+        compression: TDigest accuracy parameter
+        workers: Number of streams to download concurrently
+        field: Data field to compute percentiles of
+        keep_digests: If True, include the serialized digests (TDigest.to_dict()) in the report, so
+                      they can be cached and merged with other reports later
+        backend: 'thread' or 'process'. See BaseReportGenerator
+        cache: Optional ReportCache. See BaseReportGenerator
+        membership: Optional TTLCache of fleet and org membership. See BaseReportGenerator
+        planner: Optional ReportPlanner. See BaseReportGenerator
+    """
+
+    def __init__(self, api, percentiles=(50, 95, 99), compression=100, workers=8, field='output_value',
+                 keep_digests=False, backend='thread', cache=None, membership=None, planner=None):
+        super(PercentileReportGenerator, self).__init__(api, workers=workers, backend=backend, cache=cache,
+                                                        membership=membership, planner=planner)
+        # Fail early if the configuration is not valid (or numpy is missing)
+        TDigest(compression)
+        for percentile in percentiles:
+            if not 0 <= percentile <= 100:
+                raise ValueError('Percentiles must be between 0 and 100: {0}'.format(percentile))
+        self.percentiles = list(percentiles)
+        self.compression = compression
+        self.field = field
+        self.keep_digests = keep_digests
+
+    def _stream_digest(self, stream, start, end):
+        digest = TDigest(self.compression)
+        stream_data = StreamData(stream['slug'], self._api)
+        for page in stream_data.iter_pages(fields=[self.field], start=datetime_to_str(start), end=datetime_to_str(end)):
+            digest.add([item[0] for item in page])
+        return digest
+
+    def _digest_report(self, digest):
+        values = digest.percentiles(self.percentiles)
+        report = {
+            'count': digest.count,
+            'min': digest.min,
+            'max': digest.max,
+            'percentiles': OrderedDict(('p{0:g}'.format(p), value) for p, value in zip(self.percentiles, values)),
+        }
+        if self.keep_digests:
+            report['digest'] = digest.to_dict()
+        return report
+
+    def _process_data(self, start, end=None):
+        if not end:
+            end = datetime.utcnow()
+
+        report = {
+            'streams': {},
+            'aggregate': None,
+            'errors': {},
+        }
+
+        aggregate = TDigest(self.compression)
+        for stream, digest, error in self._map_streams(self._stream_digest, start, end):
+            if error is not None:
+                report['errors'][stream['slug']] = error
+            elif digest.count:
+                report['streams'][stream['slug']] = dict(self._digest_report(digest), units=stream_units(stream))
+                aggregate.merge(digest)
+
+        report['aggregate'] = self._digest_report(aggregate)
+        return report
+
+    def compute_percentiles(self, sources, start, end=None):
+        return self.compute(sources, start, end)
@@ -0,0 +1,209 @@
+"""Cache of report results, keyed by generator, parameters, sources and time window.
+
+Dashboards compute the same reports again and again. With a ReportCache, a
+report generator only computes a report the first time it is asked for:
+
+ - the key is built from the generator class and its parameters, the
+   normalized sources (e.g. 'p--0001' and 'p--0000-0001' are the same) and the
+   start and end of the window (in UTC)
+ - closed windows, which ended more than closed_after seconds ago, are cached
+   until invalidated. Windows touching "now" (including end=None) are cached
+   for ttl seconds only, as new data keeps arriving
+ - reports are kept in memory and, with a folder, on disk (see BlobCache), so
+   they survive restarts and are shared by processes using the same folder
+ - reports with errors are not cached
+
+When data is modified in the past, invalidate() drops the cached reports of the
+affected sources or streams.
+
+Example:
+
+    cache = ReportCache('/var/cache/iotile/reports', ttl=300)
+    gen = AccumulationReportGenerator(api, cache=cache)
+    stats = gen.compute_sum(sources, start=t0, end=t1)
+    ...
+    cache.invalidate(['d--1111'])
+"""
+import calendar
+import copy
+import hashlib
+import json
+import logging
+import time
+
+from ..utils.cache import DEFAULT_BLOB_CACHE_SIZE, DEFAULT_TTL_CACHE_SIZE, BlobCache, TTLCache
+from ..utils.gid import IOTileDeviceSlug, IOTileFleetSlug, IOTileProjectSlug, IOTileStreamSlug
+from ..utils.timestamp import UTC
+
+logger = logging.getLogger(__name__)
+
+_SLUG_CLASSES = {
+    'p--': IOTileProjectSlug,
+    'd--': IOTileDeviceSlug,
+    's--': IOTileStreamSlug,
+    'g--': IOTileFleetSlug,
+}
+
+
+def normalize_source(source):
+    """
+    Args:
+        source: Project, device, stream or fleet slug, in any accepted form (e.g. 'd--1111')
+
+    Returns:
+        Full slug (e.g. 'd--0000-0000-0000-1111'), or source itself if it is not a valid slug
+    """
+    source = str(source)
+    slug_class = _SLUG_CLASSES.get(source[0:3])
+    if slug_class is None:
+        return source
+    try:
+        return str(slug_class(source))
+    except ValueError:
+        return source
+
+
+def _stream_devices(streams):
+    devices = set()
+    for slug in streams:
+        try:
+            devices.add(str(IOTileStreamSlug(str(slug)).get_parts()['device']))
+        except (ValueError, KeyError):
+            pass
+    return sorted(devices)
+
+
+def _utc_timestamp(dt):
+    # Naive datetimes are in UTC
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+    return (dt - dt.utcoffset()).replace(tzinfo=None).isoformat()
+
+
+class ReportCache(object):
+    """
+    In-memory (and optionally on-disk) cache of report results
+
+    Args:
+        folder: Optional directory to also cache reports on disk
+        ttl: Time to live (in seconds) of reports over windows touching now
+        closed_after: Windows that ended more than closed_after seconds ago are closed, and their
+                      reports are cached until invalidated
+        maxsize: Maximum number of reports kept in memory
+        max_bytes: Maximum total size of the reports kept on disk
+        clock: Function returning the current time in seconds since the epoch (for testing)
+    """
+
+    def __init__(self, folder=None, ttl=300, closed_after=3600, maxsize=DEFAULT_TTL_CACHE_SIZE,
+                 max_bytes=DEFAULT_BLOB_CACHE_SIZE, clock=time.time):
+        self.ttl = ttl
+        self.closed_after = closed_after
+        self._clock = clock
+        self._memory = TTLCache(ttl, maxsize=maxsize, clock=clock)
+        self._disk = BlobCache(folder, max_bytes=max_bytes) if folder else None
+
+    def key(self, generator, sources, start, end=None):
+        """
+        Args:
+            generator: Report generator (see BaseReportGenerator.cache_params())
+            sources: list of project, device or stream slugs
+            start: Start datetime
+            end: End datetime, or None for now
+
+        Returns:
+            Cache key (str)
+        """
+        description = {
+            'generator': '{0}.{1}'.format(type(generator).__module__, type(generator).__name__),
+            'params': generator.cache_params(),
+            'sources': sorted(set(normalize_source(source) for source in sources)),
+            'start': _utc_timestamp(start),
+            'end': _utc_timestamp(end) if end is not None else None,
+        }
+        data = json.dumps(description, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def is_closed(self, end):
+        """
+        Returns:
+            True if a window ending at end (a datetime, or None for now) will not get new data
+        """
+        if end is None:
+            return False
+        # Naive datetimes are in UTC: utctimetuple() leaves them as they are
+        return calendar.timegm(end.utctimetuple()) <= self._clock() - self.closed_after
+
+    def get(self, key):
+        """
+        Args:
+            key: Cache key (see key())
+
+        Returns:
+            Cached report, or None
+        """
+        entry = self._memory.get(key)
+        if entry is None and self._disk is not None:
+            entry = self._disk.get(key)
+            if entry is not None:
+                if entry['expires'] is not None and entry['expires'] <= self._clock():
+                    self._disk.delete(key)
+                    return None
+                ttl = float('inf') if entry['expires'] is None else entry['expires'] - self._clock()
+                self._memory.put(key, entry, ttl=ttl)
+        if entry is None:
+            return None
+        return copy.deepcopy(entry['report'])
+
+    def put(self, key, report, sources, streams=(), end=None):
+        """
+        Args:
+            key: Cache key (see key())
+            report: JSON serializable report
+            sources: Sources of the report
+            streams: Slugs of the streams the report was computed from
+            end: End of the window (datetime), or None for now
+        """
+        closed = self.is_closed(end)
+        entry = {
+            'expires': None if closed else self._clock() + self.ttl,
+            'sources': sorted(set(normalize_source(source) for source in sources)),
+            'streams': [str(slug) for slug in streams],
+            'devices': _stream_devices(streams),
+            'report': copy.deepcopy(report),
+        }
+        self._memory.put(key, entry, ttl=float('inf') if closed else self.ttl)
+        if self._disk is not None:
+            self._disk.put(key, entry)
+
+    def _matches(self, entry, slugs):
+        return any(slugs.intersection(entry[name]) for name in ('sources', 'streams', 'devices'))
+
+    def invalidate(self, sources=None):
+        """
+        Drop cached reports
+
+        Args:
+            sources: list of project, device or stream slugs. Reports with any of them as a source,
+                     or computed from streams of any of them (for device and stream slugs), are dropped.
+                     Drops all reports if None
+        """
+        if sources is None:
+            self._memory.invalidate()
+            if self._disk is not None:
+                self._disk.clear()
+            return
+
+        slugs = set(normalize_source(source) for source in sources)
+        dropped = 0
+        for key in self._memory.keys():
+            entry = self._memory.get(key)
+            if entry is not None and self._matches(entry, slugs):
+                self._memory.invalidate(key)
+                dropped += 1
+        if self._disk is not None:
+            for key in self._disk.keys():
+                entry = self._disk.get(key)
+                if entry is not None and self._matches(entry, slugs):
+                    self._disk.delete(key)
+                    dropped += 1
+        logger.debug('Dropped {0} cached reports'.format(dropped))
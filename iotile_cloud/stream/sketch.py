@@ -0,0 +1,195 @@
+"""Mergeable, streaming quantile sketch of stream values.
+
+TDigest (Dunning's merging t-digest) summarizes any number of values in tens to
+hundreds of centroids (mean, weight), which are small near the tails and larger in
+the middle of the distribution. Quantiles near 0 and 1 (e.g. p99) are then
+estimated with high accuracy, and quantiles in the middle with a small relative
+error, whatever the number of values.
+
+Values are buffered and merged into the centroids in batches, with numpy.
+Digests filled separately (per page, per stream, per thread or per process) can
+be merged, and serialized with to_dict() (a few KB) to cache partial results.
+
+Example:
+
+    digest = TDigest()
+    for page in stream_data.iter_pages(fields=['output_value']):
+        digest.add([item.output_value for item in page])
+    digest.percentiles([50, 95, 99])
+
+Requires numpy.
+"""
+import math
+
+HAS_NUMPY = True
+try:
+    import numpy as np
+except ImportError:
+    HAS_NUMPY = False
+
+
+class TDigest(object):
+    """
+    Merging t-digest
+
+    Args:
+        compression: Accuracy parameter. The digest keeps at most about compression / 2 centroids
+        buffer_size: Number of values to buffer before merging them into the centroids.
+                     Defaults to 10 * compression
+    """
+
+    def __init__(self, compression=100, buffer_size=None):
+        if not HAS_NUMPY:
+            raise RuntimeError('You must have numpy installed to use TDigest')
+        if compression < 10:
+            raise ValueError('compression must be at least 10')
+        self.compression = compression
+        self.buffer_size = buffer_size or 10 * compression
+        self.min = None
+        self.max = None
+        self._means = np.array([], dtype='float64')
+        self._weights = np.array([], dtype='float64')
+        self._buffer_means = []
+        self._buffer_weights = []
+        self._buffered = 0
+        self._buffered_weight = 0.0
+
+    @property
+    def count(self):
+        return int(self._weights.sum() + self._buffered_weight)
+
+    def __len__(self):
+        """Number of centroids (after merging the buffered values)"""
+        self._compress()
+        return len(self._means)
+
+    def _update_range(self, minimum, maximum):
+        self.min = minimum if self.min is None else min(self.min, minimum)
+        self.max = maximum if self.max is None else max(self.max, maximum)
+
+    def _push(self, means, weights):
+        self._buffer_means.append(means)
+        self._buffer_weights.append(weights)
+        self._buffered += len(means)
+        self._buffered_weight += float(weights.sum())
+        if self._buffered >= self.buffer_size:
+            self._compress()
+
+    def add(self, values):
+        """
+        Add a batch of values. None and NaN values are ignored
+        """
+        values = np.array([value for value in values if value is not None], dtype='float64')
+        values = values[~np.isnan(values)]
+        if len(values):
+            self._update_range(float(values.min()), float(values.max()))
+            self._push(values, np.ones(len(values)))
+        return self
+
+    def merge(self, other):
+        """
+        Merge another digest (e.g. for another stream, or filled in another process) into this one
+        """
+        other._compress()
+        if len(other._means):
+            self._update_range(other.min, other.max)
+            self._push(other._means, other._weights)
+        return self
+
+    def _k(self, q):
+        # k1 scale function: centroids are smaller near q=0 and q=1
+        return self.compression / (2 * math.pi) * np.arcsin(2 * q - 1)
+
+    def _compress(self):
+        if not self._buffered:
+            return
+        means = np.concatenate([self._means] + self._buffer_means)
+        weights = np.concatenate([self._weights] + self._buffer_weights)
+        self._buffer_means = []
+        self._buffer_weights = []
+        self._buffered = 0
+        self._buffered_weight = 0.0
+
+        order = np.argsort(means, kind='mergesort')
+        means = means[order]
+        weights = weights[order]
+
+        # Points with the same integer part of k(q) make one centroid, so every centroid
+        # spans at most one unit of k: the size limit of the t-digest
+        cumulative = np.cumsum(weights)
+        total = cumulative[-1]
+        q = np.clip((cumulative - weights / 2) / total, 0, 1)
+        groups = np.floor(self._k(q))
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+
+        self._weights = np.add.reduceat(weights, starts)
+        self._means = np.add.reduceat(means * weights, starts) / self._weights
+
+    def quantile(self, q):
+        """
+        Args:
+            q: Quantile, between 0 and 1
+
+        Returns:
+            Estimated value at quantile q, or None if the digest is empty
+        """
+        if not 0 <= q <= 1:
+            raise ValueError('Quantile must be between 0 and 1: {0}'.format(q))
+        self._compress()
+        if not len(self._means):
+            return None
+        if len(self._means) == 1:
+            return float(self._means[0])
+
+        means = self._means
+        weights = self._weights
+        total = weights.sum()
+        target = q * total
+
+        # Interpolate between centroid centers, and between the extreme centroids and min/max
+        centers = np.cumsum(weights) - weights / 2
+        if target <= centers[0]:
+            return float(self.min + (means[0] - self.min) * target / centers[0])
+        if target >= centers[-1]:
+            tail = total - centers[-1]
+            return float(means[-1] + (self.max - means[-1]) * (target - centers[-1]) / tail)
+
+        i = int(np.searchsorted(centers, target, side='right')) - 1
+        fraction = (target - centers[i]) / (centers[i + 1] - centers[i])
+        return float(means[i] + (means[i + 1] - means[i]) * fraction)
+
+    def percentiles(self, percentiles):
+        """
+        Args:
+            percentiles: list of percentiles, between 0 and 100 (e.g. [50, 95, 99])
+
+        Returns:
+            list of estimated values, one per percentile
+        """
+        return [self.quantile(p / 100.0) for p in percentiles]
+
+    def to_dict(self):
+        """
+        Returns:
+            JSON serializable dict with the centroids. See from_dict()
+        """
+        self._compress()
+        return {
+            'compression': self.compression,
+            'min': self.min,
+            'max': self.max,
+            'means': self._means.tolist(),
+            'weights': self._weights.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuild a digest from to_dict() output
+        """
+        digest = cls(data['compression'])
+        digest.min = data['min']
+        digest.max = data['max']
+        digest._means = np.array(data['means'], dtype='float64')
+        digest._weights = np.array(data['weights'], dtype='float64')
+        return digest
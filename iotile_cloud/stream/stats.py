@@ -0,0 +1,118 @@
+"""Mergeable running statistics of stream values.
+
+RunningStats keeps the count, sum, min, max, mean and sum of squared
+differences from the mean (M2) of the values added to it, one batch (e.g. one
+page of data) at a time. Every batch is reduced with numpy when available,
+with a two pass mean/M2 that is numerically stable, and batches are combined
+with Chan's parallel update. Statistics computed separately (per page, per
+stream, per thread or per process) can be merged without loss.
+
+Example:
+
+    stats = RunningStats()
+    for page in stream_data.iter_pages(fields=['output_value']):
+        stats.add([item.output_value for item in page])
+    stats.to_dict()  # {'count': ..., 'mean': ..., 'stddev': ..., ...}
+"""
+import math
+
+HAS_NUMPY = True
+try:
+    import numpy as np
+except ImportError:
+    HAS_NUMPY = False
+
+
+def _batch_stats(values):
+    if HAS_NUMPY:
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return None
+        mean = values.mean()
+        return len(values), float(values.sum()), float(values.min()), float(values.max()), float(mean), \
+            float(np.sum((values - mean) ** 2))
+
+    values = [float(value) for value in values if value == value]
+    if not values:
+        return None
+    mean = math.fsum(values) / len(values)
+    return len(values), math.fsum(values), min(values), max(values), mean, math.fsum((v - mean) ** 2 for v in values)
+
+
+class RunningStats(object):
+    """
+    Count, sum, min, max, mean and standard deviation of a set of values, updated in batches
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def _combine(self, count, total, minimum, maximum, mean, m2):
+        if not count:
+            return
+        if not self.count:
+            self.count, self.sum, self.min, self.max, self.mean, self.m2 = count, total, minimum, maximum, mean, m2
+            return
+
+        new_count = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / new_count
+        self.m2 += m2 + delta * delta * self.count * count / new_count
+        self.count = new_count
+        self.sum += total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def add(self, values):
+        """
+        Add a batch of values. None and NaN values are ignored
+        """
+        values = [value for value in values if value is not None]
+        batch = _batch_stats(values) if values else None
+        if batch is not None:
+            self._combine(*batch)
+        return self
+
+    def merge(self, other):
+        """
+        Merge the statistics of another RunningStats into this one
+        """
+        self._combine(other.count, other.sum, other.min, other.max, other.mean, other.m2)
+        return self
+
+    @property
+    def variance(self):
+        """Population variance, or None if there are no values"""
+        return self.m2 / self.count if self.count else None
+
+    @property
+    def stddev(self):
+        """Population standard deviation, or None if there are no values"""
+        return math.sqrt(self.variance) if self.count else None
+
+    def to_dict(self):
+        """
+        Returns:
+            dict with count, sum, min, max, mean, stddev (population) and m2 (to rebuild it with from_dict())
+        """
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean if self.count else None,
+            'stddev': self.stddev,
+            'm2': self.m2,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats._combine(data['count'], data['sum'], data['min'], data['max'], data['mean'] or 0.0, data['m2'])
+        return stats
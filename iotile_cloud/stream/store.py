@@ -0,0 +1,336 @@
+"""Memory mapped, columnar on-disk store of stream data.
+
+Every stream is stored in its own directory (named after the stream slug) as
+fixed width column files, sorted by timestamp:
+
+    timestamp.i8    int64 nanoseconds since the epoch (UTC)
+    value.f8        float64 values
+    id.i8           int64 data point IDs
+
+Columns are read with np.memmap, so reads are zero copy and the files can be
+shared by any number of reader processes through the OS page cache. Time range
+queries are a binary search over the timestamp column.
+
+New data is appended to the end of the files. Data older than the last stored
+timestamp is merged in by writing all the stream columns to a new generation
+directory, then switching the CURRENT file of the stream (which names the live
+generation) to it with one atomic rename. Readers only open the generation
+CURRENT names, so they never see columns from different generations. Streams
+stored before generations were used (columns directly in the stream directory)
+are still read, and moved to a generation by their first merge.
+
+    s--0000-0001--0000-0000-0000-1111--5001/CURRENT     'g000002'
+    s--0000-0001--0000-0000-0000-1111--5001/g000002/    timestamp.i8, value.f8, id.i8
+
+Example:
+
+    store = ColumnStore('/data/streams')
+    store.ingest(StreamData(stream_slug, api), start=t0)
+    columns = store.read(stream_slug, start='2019-01-01T00:00:00Z', end='2019-02-01T00:00:00Z')
+    # columns['timestamp'] (datetime64[ns]), columns['value'], columns['id']
+
+Requires numpy.
+"""
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from ..utils.timestamp import UTC, parse_timestamp, parse_timestamps
+
+HAS_NUMPY = True
+try:
+    import numpy as np
+except ImportError:
+    HAS_NUMPY = False
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    ('timestamp', 'int64', 'timestamp.i8'),
+    ('value', 'float64', 'value.f8'),
+    ('id', 'int64', 'id.i8'),
+)
+ITEM_SIZE = 8
+
+# File naming the live generation directory of a stream
+CURRENT = 'CURRENT'
+
+
+def _to_ns(timestamp):
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, str):
+        timestamp = parse_timestamp(timestamp).replace(tzinfo=None)
+    elif getattr(timestamp, 'tzinfo', None) is not None:
+        timestamp = timestamp.astimezone(UTC).replace(tzinfo=None)
+    return np.datetime64(timestamp, 'ns').astype('int64')
+
+
+class ColumnStore(object):
+    """
+    On-disk store of stream data columns, keyed by stream slug
+
+    A store can be written by one process at a time, and read by any number of processes.
+
+    Args:
+        folder: Store directory (created if needed)
+    """
+
+    def __init__(self, folder):
+        if not HAS_NUMPY:
+            raise RuntimeError('You must have numpy installed to use ColumnStore')
+
+        self.folder = folder
+        self._lock = threading.Lock()
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def _stream_folder(self, slug):
+        slug = str(slug)
+        if not slug or os.sep in slug or slug.startswith('.'):
+            raise ValueError('Illegal stream slug: {0}'.format(slug))
+        return os.path.join(self.folder, slug)
+
+    def _generation(self, slug):
+        # Name of the live generation directory, or '' for columns stored directly in the stream directory
+        try:
+            with open(os.path.join(self._stream_folder(slug), CURRENT)) as fp:
+                return fp.read().strip()
+        except (IOError, OSError):
+            return ''
+
+    def _generation_folder(self, slug, generation=None):
+        if generation is None:
+            generation = self._generation(slug)
+        return os.path.join(self._stream_folder(slug), generation)
+
+    def _column_path(self, slug, filename, generation=None):
+        return os.path.join(self._generation_folder(slug, generation), filename)
+
+    def streams(self):
+        """
+        Returns:
+            Sorted list of the stream slugs in the store
+        """
+        return sorted(name for name in os.listdir(self.folder)
+                      if not name.startswith('.') and os.path.isdir(os.path.join(self.folder, name)) and name in self)
+
+    def __contains__(self, slug):
+        return os.path.isfile(self._column_path(slug, COLUMNS[0][2]))
+
+    def _count(self, folder):
+        try:
+            # A write interrupted between columns can leave some longer than others
+            return min(os.path.getsize(os.path.join(folder, filename)) for _name, _dtype, filename in COLUMNS) // ITEM_SIZE
+        except (IOError, OSError):
+            return 0
+
+    def count(self, slug):
+        """
+        Returns:
+            Number of readings stored for the stream (0 if unknown)
+        """
+        return self._count(self._generation_folder(slug))
+
+    def _open_generation(self, folder):
+        count = self._count(folder)
+        columns = OrderedDict()
+        for name, dtype, filename in COLUMNS:
+            if count:
+                columns[name] = np.memmap(os.path.join(folder, filename), dtype=dtype, mode='r', shape=(count,))
+            else:
+                columns[name] = np.array([], dtype=dtype)
+        return columns
+
+    def _open_columns(self, slug):
+        try:
+            return self._open_generation(self._generation_folder(slug))
+        except (IOError, OSError):
+            # The generation was replaced (and removed) by a merge after CURRENT was read
+            return self._open_generation(self._generation_folder(slug))
+
+    def last_timestamp(self, slug):
+        """
+        Returns:
+            Last stored timestamp of the stream (datetime64[ns]), or None
+        """
+        count = self.count(slug)
+        if not count:
+            return None
+        return self._open_columns(slug)['timestamp'][count - 1].astype('datetime64[ns]')
+
+    def read(self, slug, start=None, end=None):
+        """
+        Read the readings of a stream in a time range, without copying
+
+        Args:
+            slug: Stream slug
+            start: Optional start time (inclusive): timestamp string, datetime or datetime64
+            end: Optional end time (exclusive)
+
+        Returns:
+            OrderedDict of read-only memory mapped arrays: 'timestamp' (datetime64[ns], UTC), 'value' and 'id'
+        """
+        columns = self._open_columns(slug)
+        timestamps = columns['timestamp']
+
+        first = 0 if start is None else int(np.searchsorted(timestamps, _to_ns(start), side='left'))
+        last = len(timestamps) if end is None else int(np.searchsorted(timestamps, _to_ns(end), side='left'))
+
+        result = OrderedDict()
+        for name, values in columns.items():
+            result[name] = values[first:max(first, last)]
+        result['timestamp'] = result['timestamp'].view('datetime64[ns]')
+        return result
+
+    def append(self, slug, timestamps, values, ids):
+        """
+        Add readings to a stream. Readings with an ID already stored at the last timestamp are skipped,
+        so downloads can overlap.
+
+        Args:
+            slug: Stream slug
+            timestamps: datetime64 array (or int64 nanoseconds since the epoch)
+            values: float values
+            ids: int data point IDs
+
+        Returns:
+            Number of readings added
+        """
+        timestamps = np.asarray(timestamps)
+        if np.issubdtype(timestamps.dtype, np.datetime64):
+            timestamps = timestamps.astype('datetime64[ns]')
+        timestamps = timestamps.astype('int64')
+        values = np.asarray(values, dtype='float64')
+        ids = np.asarray(ids, dtype='int64')
+        if not len(timestamps):
+            return 0
+
+        order = np.argsort(timestamps, kind='mergesort')
+        new = OrderedDict([('timestamp', timestamps[order]), ('value', values[order]), ('id', ids[order])])
+
+        with self._lock:
+            if not os.path.isdir(self._stream_folder(slug)):
+                self._create(slug)
+
+            current = self._open_columns(slug)
+            count = len(current['timestamp'])
+            if count:
+                last = current['timestamp'][count - 1]
+                if new['timestamp'][0] < last:
+                    return self._merge(slug, current, new)
+
+                # Skip readings already stored at the boundary
+                tail = current['id'][np.searchsorted(current['timestamp'], last, side='left'):]
+                keep = ~((new['timestamp'] == last) & np.isin(new['id'], tail))
+                new = OrderedDict((name, column[keep]) for name, column in new.items())
+
+            for name, dtype, filename in COLUMNS:
+                with open(self._column_path(slug, filename), 'r+b' if count else 'wb') as fp:
+                    # Drop any partial write past the last complete reading
+                    fp.truncate(count * ITEM_SIZE)
+                    fp.seek(count * ITEM_SIZE)
+                    fp.write(new[name].astype(dtype).tobytes())
+
+        return len(new['timestamp'])
+
+    def _create(self, slug):
+        os.makedirs(self._generation_folder(slug, 'g000001'))
+        self._set_generation(slug, 'g000001')
+
+    def _set_generation(self, slug, generation):
+        # Atomic: readers see either the old or the new generation
+        path = os.path.join(self._stream_folder(slug), CURRENT)
+        tmp_path = '{0}.tmp'.format(path)
+        with open(tmp_path, 'w') as fp:
+            fp.write(generation)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+
+    def _merge(self, slug, current, new):
+        count = len(current['timestamp'])
+        merged = OrderedDict((name, np.concatenate([np.array(current[name]), new[name]])) for name in new)
+
+        # Keep the first copy of every ID
+        _unique, first = np.unique(merged['id'], return_index=True)
+        keep = np.sort(first)
+        order = keep[np.argsort(merged['timestamp'][keep], kind='mergesort')]
+
+        # All the columns are written to a new generation, which only goes live when complete
+        old = self._generation(slug)
+        generation = 'g{0:06d}'.format(int(old[1:]) + 1 if old else 1)
+        folder = self._generation_folder(slug, generation)
+        if os.path.isdir(folder):
+            # Left over by an interrupted merge
+            shutil.rmtree(folder)
+        os.makedirs(folder)
+        for name, dtype, filename in COLUMNS:
+            with open(os.path.join(folder, filename), 'wb') as fp:
+                fp.write(merged[name][order].astype(dtype).tobytes())
+                fp.flush()
+                os.fsync(fp.fileno())
+        self._set_generation(slug, generation)
+
+        # Readers that already opened the old columns keep their mappings
+        if old:
+            shutil.rmtree(self._generation_folder(slug, old), ignore_errors=True)
+        else:
+            for _name, _dtype, filename in COLUMNS:
+                try:
+                    os.remove(self._column_path(slug, filename, ''))
+                except OSError:
+                    pass
+
+        logger.debug('Merged {0} readings into {1}'.format(len(order) - count, slug))
+        return len(order) - count
+
+    def append_page(self, slug, records, value_field='value'):
+        """
+        Add a page of records (dicts or DataRecords with 'id', 'timestamp' and value_field)
+
+        Returns:
+            Number of readings added
+        """
+        if not records:
+            return 0
+        timestamps = parse_timestamps([item['timestamp'] for item in records], unit='ns')
+        values = np.array([item[value_field] for item in records], dtype='float64')
+        ids = np.array([item['id'] for item in records], dtype='int64')
+        return self.append(slug, timestamps, values, ids)
+
+    def ingest(self, data, value_field='value', incremental=True, **kwargs):
+        """
+        Download a StreamData object into the store, one page at a time
+
+        Args:
+            data: StreamData object
+            value_field: Record field to store as value (e.g. 'value' or 'output_value')
+            incremental: If True and no start is given, only download readings from the last stored timestamp
+            kwargs: Query arguments (e.g. start, end)
+
+        Returns:
+            Number of readings added
+        """
+        slug = data._stream_id
+        if incremental and 'start' not in kwargs:
+            last = self.last_timestamp(slug)
+            if last is not None:
+                kwargs['start'] = '{0}Z'.format(np.datetime_as_string(last, unit='us'))
+
+        added = 0
+        for page in data.iter_pages(fields=['id', 'timestamp', value_field], **kwargs):
+            added += self.append_page(slug, page, value_field=value_field)
+        logger.debug('Stored {0} new readings for {1}'.format(added, slug))
+        return added
+
+    def delete(self, slug):
+        """
+        Delete all stored readings of a stream
+        """
+        with self._lock:
+            folder = self._stream_folder(slug)
+            if os.path.isdir(folder):
+                shutil.rmtree(folder)
@@ -0,0 +1,146 @@
+"""Streaming top-K selection of events.
+
+TopKEvents consumes pages of events as they are downloaded and keeps, for
+every group (e.g. every device), only a min-heap of the K best events so far.
+Memory use is proportional to K (times the number of groups), not to the
+number of events. Once all pages are processed, fetch_details() downloads
+the detailed data (e.g. waveforms) of the selected events only, concurrently.
+
+Example:
+
+    selector = TopKEvents(50, key='peak')
+    for device_slug in fleet_devices:
+        selector.add_data(EventData(device_slug, api), group=device_slug, start=t0, end=t1)
+    details = selector.fetch_details(api, workers=8)
+    # details[device_slug] = [(event, event_data), ...], highest peak first
+"""
+import heapq
+import itertools
+from collections import OrderedDict
+
+from .data import fetch_event_details
+
+
+def extra_data_key(name):
+    """
+    Args:
+        name: Name of an extra_data field (e.g. 'peak')
+
+    Returns:
+        Key function returning event['extra_data'][name], or None if the event does not have it
+    """
+    def _key(event):
+        extra_data = event.get('extra_data') or {}
+        return extra_data.get(name)
+    return _key
+
+
+class TopKEvents(object):
+    """
+    Keep the K events with the largest key value, per group
+
+    Args:
+        k: Number of events to keep per group
+        key: Name of the extra_data field to rank events by (e.g. 'peak'), or a function
+             taking an event and returning its score. Events with a None score are ignored
+        group_by: Optional function taking an event and returning its group.
+                  Defaults to a single group (None), unless a group is given to add_page()/add_data()
+    """
+
+    def __init__(self, k, key='peak', group_by=None):
+        if k < 1:
+            raise ValueError('k must be at least 1')
+        self.k = k
+        self._key = extra_data_key(key) if isinstance(key, str) else key
+        self._group_by = group_by
+        self._heaps = OrderedDict()
+        # Tie breaker, so events themselves are never compared
+        self._counter = itertools.count()
+        self.count = 0
+
+    def add(self, event, group=None):
+        """
+        Consider one event
+
+        Args:
+            event: Event dict (or DataRecord)
+            group: Group of the event. Defaults to group_by(event), or None
+        """
+        score = self._key(event)
+        if score is None:
+            return
+        if group is None and self._group_by is not None:
+            group = self._group_by(event)
+
+        self.count += 1
+        heap = self._heaps.setdefault(group, [])
+        entry = (score, next(self._counter), event)
+        if len(heap) < self.k:
+            heapq.heappush(heap, entry)
+        elif score > heap[0][0]:
+            heapq.heapreplace(heap, entry)
+
+    def add_page(self, events, group=None):
+        """
+        Consider a page of events. See add()
+        """
+        for event in events:
+            self.add(event, group=group)
+
+    def add_data(self, data, group=None, **kwargs):
+        """
+        Download all pages of an EventData object, keeping only the top K events
+
+        Args:
+            data: EventData object
+            group: Group for all these events (e.g. the device slug). Defaults to group_by(event), or None
+            kwargs: Query arguments (e.g. start, end)
+        """
+        for page in data.iter_pages(**kwargs):
+            self.add_page(page, group=group)
+
+    @property
+    def groups(self):
+        return list(self._heaps.keys())
+
+    def top(self, group=None):
+        """
+        Args:
+            group: Group to return
+
+        Returns:
+            List of the top K events of the group, highest score first
+        """
+        heap = self._heaps.get(group, [])
+        return [event for _score, _count, event in sorted(heap, key=lambda entry: (-entry[0], entry[1]))]
+
+    def results(self):
+        """
+        Returns:
+            OrderedDict of group -> list of the top K events, highest score first
+        """
+        return OrderedDict((group, self.top(group)) for group in self._heaps)
+
+    def fetch_details(self, api, workers=8, cache=None):
+        """
+        Download the data of the selected events only, concurrently.
+        Events known to have no data (has_raw_data is False) are not downloaded.
+
+        Args:
+            api: Api object
+            workers: Number of concurrent requests
+            cache: Optional BlobCache for event data
+
+        Returns:
+            OrderedDict of group -> list of (event, event data) tuples, highest score first.
+            Event data is None for events with no data
+        """
+        results = self.results()
+        event_ids = []
+        for events in results.values():
+            event_ids.extend(event['id'] for event in events if event.get('has_raw_data', True) is not False)
+
+        details = fetch_event_details(api, event_ids, workers=workers, cache=cache)
+        return OrderedDict(
+            (group, [(event, details.get(event['id'])) for event in events]) for group, events in results.items()
+        )
@@ -0,0 +1,144 @@
+"""Batch feature extraction for shock event waveforms.
+
+Shock events (e.g. POD-1M stream 5020) have detailed data with the x/y/z
+acceleration waveforms:
+
+    {'acceleration_data': {'x': [...], 'y': [...], 'z': [...]}, ...}
+
+pack_waveforms() packs many of these into one zero padded numpy array, and
+compute_shock_features() computes, for every event at once:
+
+ - peak: maximum of the acceleration magnitude (and peak_x/peak_y/peak_z, maximum absolute value per axis)
+ - rms: root mean square of the magnitude
+ - duration_above: time (in seconds) the magnitude is above a threshold
+ - dominant_frequency: frequency (in Hz) of the largest non DC component of the power spectrum,
+   summed over the three axes
+
+Large sets of events can be split across a process pool with workers=N.
+
+Example:
+
+    details = EventData(shock_stream_slug, api).fetch_details(...)
+    features = compute_shock_features(details, sample_rate=3200, threshold=2.0)
+    # features['id'], features['peak'], features['rms'], ...
+
+Requires numpy.
+"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+HAS_NUMPY = True
+try:
+    import numpy as np
+except ImportError:
+    HAS_NUMPY = False
+
+AXES = ('x', 'y', 'z')
+FEATURE_NAMES = ('peak', 'peak_x', 'peak_y', 'peak_z', 'rms', 'duration_above', 'dominant_frequency')
+
+
+def pack_waveforms(details, axes=AXES):
+    """
+    Pack the acceleration waveforms of many events into one array
+
+    Args:
+        details: dict (or list of pairs) of event ID -> event data with 'acceleration_data'.
+                 Events with no data (None) are skipped
+        axes: Axes to pack
+
+    Returns:
+        (ids, waveforms, lengths) where waveforms is a float64 array of shape
+        (events, axes, longest waveform), zero padded, and lengths has the number of
+        samples of each event
+    """
+    if not HAS_NUMPY:
+        raise RuntimeError('You must have numpy installed to use pack_waveforms()')
+
+    items = list(details.items()) if hasattr(details, 'items') else list(details)
+    items = [(event_id, detail['acceleration_data']) for event_id, detail in items if detail]
+
+    lengths = np.array([min(len(data[axis]) for axis in axes) for _id, data in items], dtype='int64')
+    width = int(lengths.max()) if len(lengths) else 0
+
+    waveforms = np.zeros((len(items), len(axes), width), dtype='float64')
+    for row, (_id, data) in enumerate(items):
+        length = lengths[row]
+        for column, axis in enumerate(axes):
+            waveforms[row, column, :length] = data[axis][:length]
+
+    return [event_id for event_id, _data in items], waveforms, lengths
+
+
+def _dominant_frequency(waveforms, lengths, sample_rate):
+    result = np.full(len(lengths), np.nan)
+    # Group events by length, so each group is one exact batched FFT
+    for length in np.unique(lengths):
+        if length < 2:
+            continue
+        rows = np.flatnonzero(lengths == length)
+        signal = waveforms[rows, :, :length]
+        signal = signal - signal.mean(axis=2, keepdims=True)
+        power = np.sum(np.abs(np.fft.rfft(signal, axis=2)) ** 2, axis=1)
+        power[:, 0] = 0
+        frequencies = np.fft.rfftfreq(length, d=1.0 / sample_rate)
+        result[rows] = frequencies[np.argmax(power, axis=1)]
+    return result
+
+
+def _compute_packed(waveforms, lengths, sample_rate, threshold):
+    valid = np.arange(waveforms.shape[2]) < lengths[:, None]
+    counts = np.maximum(lengths, 1)
+
+    magnitude = np.sqrt(np.sum(waveforms ** 2, axis=1))
+    axis_peaks = np.max(np.abs(waveforms), axis=2) if waveforms.shape[2] else np.zeros(waveforms.shape[:2])
+
+    features = OrderedDict()
+    features['peak'] = magnitude.max(axis=1) if magnitude.shape[1] else np.zeros(len(lengths))
+    for column, axis in enumerate(AXES):
+        features['peak_{0}'.format(axis)] = axis_peaks[:, column]
+    features['rms'] = np.sqrt(np.sum(magnitude ** 2, axis=1) / counts)
+    features['duration_above'] = np.sum((magnitude > threshold) & valid, axis=1) / float(sample_rate)
+    features['dominant_frequency'] = _dominant_frequency(waveforms, lengths, sample_rate)
+    return features
+
+
+def _compute_chunk(items, sample_rate, threshold):
+    ids, waveforms, lengths = pack_waveforms(items)
+    features = _compute_packed(waveforms, lengths, sample_rate, threshold)
+    return ids, features
+
+
+def compute_shock_features(details, sample_rate, threshold, workers=1, chunk_size=1000):
+    """
+    Compute peak, RMS, duration above threshold and dominant frequency for many shock events
+
+    Args:
+        details: dict (or list of pairs) of event ID -> event data with 'acceleration_data'
+                 (e.g. from EventData.fetch_details()). Events with no data are skipped
+        sample_rate: Waveform sample rate (in Hz)
+        threshold: Acceleration magnitude threshold used for duration_above
+        workers: Number of processes to use. With more than one, events are processed in
+                 chunks of chunk_size events on a ProcessPoolExecutor
+        chunk_size: Number of events per chunk
+
+    Returns:
+        OrderedDict of columns: 'id' (list of event IDs) followed by one numpy array per feature
+    """
+    if not HAS_NUMPY:
+        raise RuntimeError('You must have numpy installed to use compute_shock_features()')
+
+    items = list(details.items()) if hasattr(details, 'items') else list(details)
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)] or [[]]
+
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_compute_chunk, chunk, sample_rate, threshold) for chunk in chunks]
+            results = [future.result() for future in futures]
+    else:
+        results = [_compute_chunk(chunk, sample_rate, threshold) for chunk in chunks]
+
+    table = OrderedDict()
+    table['id'] = [event_id for ids, _features in results for event_id in ids]
+    for name in FEATURE_NAMES:
+        table[name] = np.concatenate([features[name] for _ids, features in results])
+    return table
@@ -0,0 +1,219 @@
+"""Local caches for data downloaded from the cloud."""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOB_CACHE_SIZE = 1024 * 1024 * 1024
+DEFAULT_TTL_CACHE_SIZE = 10000
+
+
+class BlobCache(object):
+    """
+    Size bounded on-disk cache of immutable JSON blobs (e.g. event waveforms), keyed by ID
+
+    Each blob is stored in its own file, named after its key. When the total size goes over
+    max_bytes, the least recently used blobs are deleted. The cache can be shared by several
+    threads, and by several processes using the same folder.
+
+    Args:
+        folder: Cache directory (created if needed)
+        max_bytes: Maximum total size of the cached blobs
+    """
+
+    def __init__(self, folder, max_bytes=DEFAULT_BLOB_CACHE_SIZE):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self._size = sum(os.path.getsize(path) for path in self._blob_paths())
+
+    def _blob_paths(self):
+        return [os.path.join(self.folder, name) for name in os.listdir(self.folder) if name.endswith('.json')]
+
+    def _path(self, key):
+        key = str(key)
+        if not key or os.sep in key or key.startswith('.'):
+            raise ValueError('Illegal cache key: {0}'.format(key))
+        return os.path.join(self.folder, '{0}.json'.format(key))
+
+    def __contains__(self, key):
+        return os.path.isfile(self._path(key))
+
+    def get(self, key, default=None):
+        """
+        Args:
+            key: Blob ID
+            default: Value to return if the blob is not cached
+
+        Returns:
+            Cached object, or default
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'r') as fp:
+                value = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return default
+
+        try:
+            # Mark as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        """
+        Args:
+            key: Blob ID
+            value: JSON serializable object
+        """
+        path = self._path(key)
+        tmp_path = '{0}.{1}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as fp:
+            json.dump(value, fp)
+        size = os.path.getsize(tmp_path)
+
+        with self._lock:
+            if os.path.isfile(path):
+                self._size -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = []
+        for path in self._blob_paths():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        self._size = sum(entry[1] for entry in entries)
+        for _mtime, size, path in sorted(entries):
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+        logger.debug('Blob cache reduced to {0} bytes'.format(self._size))
+
+    def keys(self):
+        """
+        Returns:
+            list of the keys of the cached blobs
+        """
+        return [os.path.basename(path)[:-len('.json')] for path in self._blob_paths()]
+
+    def delete(self, key):
+        """
+        Args:
+            key: Blob ID to delete (if cached)
+        """
+        path = self._path(key)
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                return
+            self._size -= size
+
+    def clear(self):
+        """Delete all cached blobs"""
+        with self._lock:
+            for path in self._blob_paths():
+                os.remove(path)
+            self._size = 0
+
+
+class TTLCache(object):
+    """
+    Thread safe in-memory cache where entries expire after a time to live
+
+    When more than maxsize entries are stored, the least recently used ones are dropped.
+
+    Args:
+        ttl: Default time to live, in seconds
+        maxsize: Maximum number of entries
+        clock: Function returning the current time in seconds (for testing)
+    """
+
+    def __init__(self, ttl, maxsize=DEFAULT_TTL_CACHE_SIZE, clock=time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def get(self, key, default=None):
+        """
+        Args:
+            key: Entry key
+            default: Value to return if the key is not cached, or has expired
+
+        Returns:
+            Cached value, or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires <= self._clock():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl=None):
+        """
+        Args:
+            key: Entry key
+            value: Value to cache
+            ttl: Optional time to live for this entry, instead of the default one
+        """
+        expires = self._clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def keys(self):
+        """
+        Returns:
+            list of the keys of the entries (including expired ones not dropped yet)
+        """
+        with self._lock:
+            return list(self._entries.keys())
+
+    def invalidate(self, key=None):
+        """
+        Args:
+            key: Entry to drop. Drops all entries if None
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
@@ -30,6 +30,12 @@ import logging
 import uuid
 import struct
 import iotile_cloud.utils.gid as gid
+from iotile_cloud.utils.timestamp import parse_timestamp
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
 
 HAS_DEPENDENCIES = True
 try:
@@ -114,6 +120,7 @@ class MockIOTileCloud(object):
         self._add_api(r"/api/v1/streamer/", self.list_streamers)
         self._add_api(r"/api/v1/device/", self.list_devices)
         self._add_api(r"/api/v1/fleet/", self.list_fleets)
+        self._add_api(r"/api/v1/project/", self.list_projects)
 
         # APIs for OTA
         # Only a subset of these are implemented currently
@@ -168,6 +175,10 @@ class MockIOTileCloud(object):
 
         self.events = {}
 
+        # Stream data added with quick_add_stream_data(), on top of stream_folder files
+        self.stream_data = {}
+        self.data_id_counter = 1000000
+
         self.stream_folder = None
 
         if self._config_file is not None:
@@ -499,6 +510,17 @@ class MockIOTileCloud(object):
 
         return self._paginate(results, request, 100)
 
+    def list_projects(self, request):
+        """List and possibly filter projects."""
+
+        results = []
+        if 'org' in request.args:
+            results = [x for x in self.projects.values() if x['org'] == request.args['org']]
+        else:
+            results = [x for x in self.projects.values()]
+
+        return self._paginate(results, request, 100)
+
     def list_ota_devices(self, request):
 
         results = [x for x in self.ota_devices.values()]
@@ -592,10 +614,14 @@ class MockIOTileCloud(object):
         slug = gid.IOTileDeviceSlug(device_slug)
         slug_name = slug.formatted_id()
 
-        if self.stream_folder is None:
-            return {}
+        raw_streams = {}
+        if self.stream_folder is not None:
+            raw_streams = {os.path.splitext(x)[0]: len(self._load_stream_data(os.path.join(self.stream_folder, x))) for x in os.listdir(self.stream_folder) if slug_name in x and (x.endswith('.json') or x.endswith('.csv'))}
 
-        raw_streams = {os.path.splitext(x)[0]: len(self._load_stream_data(os.path.join(self.stream_folder, x))) for x in os.listdir(self.stream_folder) if slug_name in x and (x.endswith('.json') or x.endswith('.csv'))}
+        # Data added with quick_add_stream_data()
+        for slug, data in self.stream_data.items():
+            if slug_name in slug:
+                raw_streams[slug] = raw_streams.get(slug, 0) + len(data)
         stream_ids = {x['slug']: x for x in self.streams.values() if x['device'] == device_slug}
 
         out_counts = {}
@@ -650,6 +676,13 @@ class MockIOTileCloud(object):
             elif os.path.isfile(csv_stream_path):
                 results = self._format_stream_data(csv_stream_path)
 
+        for i, line in enumerate(results):
+            line.setdefault('id', i)
+
+        if stream in self.stream_data:
+            results = results + [dict(x) for x in self.stream_data[stream]]
+            results.sort(key=lambda x: (parse_timestamp(x['timestamp']), x['id']))
+
         # If we're called through data or df api, we need to include project, stream and variable info
         # as well as other metadata
         if not stream_arg:
@@ -659,16 +692,26 @@ class MockIOTileCloud(object):
             dev = str(parts['device'])
             var = str(parts['variable'])
 
-            for i, line in enumerate(results):
+            for line in results:
                 line['project'] = proj
                 line['device'] = dev
                 line['stream'] = stream
                 line['variable'] = var
-                line['id'] = i
                 line['streamer_local_id'] = 0
                 line['dirty_ts'] = False,
                 line['status'] = "unk"
 
+        # start is inclusive and end is exclusive
+        if 'start' in request.args:
+            start = parse_timestamp(request.args['start'])
+            results = [x for x in results if parse_timestamp(x['timestamp']) >= start]
+        if 'end' in request.args:
+            end = parse_timestamp(request.args['end'])
+            results = [x for x in results if parse_timestamp(x['timestamp']) < end]
+
+        if 'lastn' in request.args:
+            results = results[-int(request.args['lastn']):]
+
         if not paginate:
             return results
         
@@ -759,11 +802,15 @@ class MockIOTileCloud(object):
 
         filtered = results[(page - 1)*page_size: page*page_size]
 
-        # FIXME: Actually include previous and next links
+        def _page_url(number):
+            args = request.args.to_dict()
+            args['page'] = number
+            return '{}?{}'.format(request.base_url, urlencode(sorted(args.items())))
+
         return {
             u"count": len(results),
-            u"previous": None,
-            u"next": None,
+            u"previous": _page_url(page - 1) if page > 1 else None,
+            u"next": _page_url(page + 1) if page*page_size < len(results) else None,
             u"results": filtered
         }
 
@@ -1026,6 +1073,33 @@ class MockIOTileCloud(object):
 
         self.users[email] = password
 
+    def quick_add_stream_data(self, stream_slug, data):
+        """Quickly add data points to a stream.
+
+        The data points are returned by the stream data APIs together with
+        any data in stream_folder, sorted by timestamp. They are given
+        unique ids.
+
+        Args:
+            stream_slug (str): The stream to add data to
+            data (list): A list of dicts with at least 'timestamp' and 'value'
+
+        Returns:
+            list: The data points that were added, including their id
+        """
+
+        added = []
+        for point in data:
+            point = dict(point)
+            point['id'] = self.data_id_counter
+            point.setdefault('int_value', None)
+            point.setdefault('output_value', point['value'])
+            self.data_id_counter += 1
+            added.append(point)
+
+        self.stream_data.setdefault(str(stream_slug), []).extend(added)
+        return added
+
     def quick_add_device(self, project_id, device_id=None, streamers=None):
         """Quickly add a device to the given project.
 
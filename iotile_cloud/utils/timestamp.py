@@ -0,0 +1,127 @@
+"""Fast parsing of IOTile Cloud timestamps.
+
+The cloud always returns timestamps in the fixed ISO-8601 form
+``YYYY-MM-DDTHH:MM:SS(.ffffff)Z``. Parsing these with dateutil costs
+tens of microseconds per record, which dominates any loop over downloaded
+data. This module provides:
+
+ - parse_timestamp(): a scalar fast path that slices the fixed format directly
+   and only falls back to dateutil for unusual formats
+ - parse_timestamps(): a vectorized path that converts a whole page of timestamp
+   strings into a numpy datetime64 array (requires numpy)
+"""
+from datetime import datetime
+
+import dateutil.parser
+from dateutil.tz import tzutc
+
+HAS_NUMPY = True
+try:
+    import numpy as np
+except ImportError:
+    HAS_NUMPY = False
+
+UTC = tzutc()
+
+# Shortest supported fast form: 'YYYY-MM-DDTHH:MM:SSZ'
+_FAST_FORMAT_LENGTH = 20
+
+
+class TimestampParseError(ValueError):
+    """
+    Raised when a timestamp cannot be parsed by either the fast path or dateutil.
+    """
+
+
+def _parse_fast(timestamp):
+    if (len(timestamp) < _FAST_FORMAT_LENGTH or timestamp[-1] != 'Z' or
+            timestamp[4] != '-' or timestamp[7] != '-' or timestamp[10] != 'T' or
+            timestamp[13] != ':' or timestamp[16] != ':'):
+        raise ValueError('Not in fixed cloud format')
+
+    microsecond = 0
+    if len(timestamp) > _FAST_FORMAT_LENGTH:
+        fraction = timestamp[20:-1]
+        if timestamp[19] != '.' or not fraction.isdigit() or len(fraction) > 6:
+            raise ValueError('Not in fixed cloud format')
+        microsecond = int(fraction.ljust(6, '0'))
+
+    return datetime(int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                    int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19]),
+                    microsecond, tzinfo=UTC)
+
+
+def _parse_slow(timestamp):
+    try:
+        return dateutil.parser.parse(timestamp)
+    except (ValueError, TypeError, OverflowError) as e:
+        raise TimestampParseError('Unable to parse timestamp {0!r}: {1}'.format(timestamp, e))
+
+
+def parse_timestamp(timestamp):
+    """
+    Parse a single cloud timestamp into a datetime
+
+    Timestamps in the fixed cloud format are parsed without dateutil and returned
+    as timezone aware (UTC) datetimes. Anything else is handed to dateutil.
+
+    Args:
+        timestamp: string like '2017-04-11T20:37:29.608972Z'
+
+    Returns:
+        datetime object
+
+    Raises:
+        TimestampParseError: if the timestamp cannot be parsed
+    """
+    try:
+        return _parse_fast(timestamp)
+    except (ValueError, TypeError):
+        pass
+
+    return _parse_slow(timestamp)
+
+
+def _to_datetime64(timestamp, unit):
+    dt = parse_timestamp(timestamp)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(UTC).replace(tzinfo=None)
+    return np.datetime64(dt, unit)
+
+
+def parse_timestamps(timestamps, unit='us'):
+    """
+    Parse a sequence of cloud timestamps into a numpy datetime64 array
+
+    When every timestamp is in the fixed cloud format, the whole sequence is
+    converted by numpy in a single call. Otherwise, each value goes through
+    parse_timestamp() and is converted to UTC.
+
+    Args:
+        timestamps: iterable of timestamp strings (e.g. a page of stream data timestamps)
+        unit: datetime64 unit ('s', 'ms', 'us' or 'ns')
+
+    Returns:
+        numpy array of dtype datetime64[unit] (naive, in UTC)
+
+    Raises:
+        TimestampParseError: if any timestamp cannot be parsed
+    """
+    if not HAS_NUMPY:
+        raise RuntimeError('You must have numpy installed to use parse_timestamps()')
+
+    dtype = 'datetime64[{0}]'.format(unit)
+    timestamps = list(timestamps)
+
+    try:
+        stripped = [ts[:-1] for ts in timestamps if ts[-1] == 'Z' and ts[10] == 'T']
+    except (TypeError, IndexError):
+        stripped = None
+
+    if stripped is not None and len(stripped) == len(timestamps):
+        try:
+            return np.array(stripped, dtype=dtype)
+        except ValueError:
+            pass
+
+    return np.array([_to_datetime64(ts, unit) for ts in timestamps], dtype=dtype)
@@ -0,0 +1,98 @@
+"""Benchmark report generators on synthetic data served by a local MockIOTileCloud
+
+Runs the same report single threaded, on a thread pool and on a process pool, and prints
+the time of every run.
+
+Usage: python benchmark_reports.py [--streams 32] [--points 20000] [--workers 4] [--report percentile]
+
+Requires numpy, pytest_localserver and werkzeug (see requirements-test.txt).
+"""
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from pytest_localserver.http import WSGIServer
+
+from iotile_cloud.api.connection import Api
+from iotile_cloud.stream.report import PercentileReportGenerator, RollupReportGenerator, StatsReportGenerator
+from iotile_cloud.utils.gid import IOTileStreamSlug
+from iotile_cloud.utils.mock_cloud import MockIOTileCloud
+
+REPORTS = {
+    'stats': lambda api, **kwargs: StatsReportGenerator(api, **kwargs),
+    'rollup': lambda api, **kwargs: RollupReportGenerator(api, interval='hour', **kwargs),
+    'percentile': lambda api, **kwargs: PercentileReportGenerator(api, percentiles=[50, 95, 99], **kwargs),
+}
+
+
+def populate(cloud, streams, points, start):
+    """
+    Add a project with one device per stream, and random readings every minute
+    """
+    cloud.quick_add_user()
+    project_id, project_slug = cloud.quick_add_project()
+    rng = np.random.RandomState(0)
+    timestamps = [(start + timedelta(minutes=i)).strftime('%Y-%m-%dT%H:%M:%SZ') for i in range(points)]
+
+    for i in range(streams):
+        device_slug = cloud.quick_add_device(project_id)
+        stream_slug = IOTileStreamSlug()
+        stream_slug.from_parts(project_slug, device_slug, '5001')
+        slug = str(stream_slug)
+        cloud.streams[slug] = {
+            'slug': slug,
+            'project': project_slug,
+            'project_id': project_id,
+            'device': device_slug,
+            'block': None,
+            'output_unit': {'unit_short': 'G'},
+        }
+        values = rng.lognormal(mean=i % 5, size=points)
+        cloud.quick_add_stream_data(slug, [{'timestamp': ts, 'value': float(value)}
+                                           for ts, value in zip(timestamps, values)])
+    return project_slug
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, default=32, help='Number of streams')
+    parser.add_argument('--points', type=int, default=20000, help='Number of readings per stream')
+    parser.add_argument('--workers', type=int, default=4, help='Number of threads or processes')
+    parser.add_argument('--report', choices=sorted(REPORTS.keys()), default='percentile', help='Report to run')
+    args = parser.parse_args()
+
+    # Do not log every request of the mock cloud
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    start = datetime(2019, 1, 1)
+    cloud = MockIOTileCloud()
+    print('Generating {0} streams x {1} readings...'.format(args.streams, args.points))
+    project_slug = populate(cloud, args.streams, args.points, start)
+
+    server = WSGIServer(application=cloud, threaded=True)
+    server.start()
+    try:
+        api = Api(domain=server.url)
+        api.login(email='test@arch-iot.com', password='test')
+        end = start + timedelta(minutes=args.points)
+
+        runs = [
+            ('single thread', dict(workers=1)),
+            ('thread pool', dict(workers=args.workers)),
+            ('process pool', dict(workers=args.workers, backend='process')),
+        ]
+        for name, kwargs in runs:
+            generator = REPORTS[args.report](api, **kwargs)
+            t0 = time.time()
+            report = generator.compute(sources=[project_slug], start=start, end=end)
+            elapsed = time.time() - t0
+            print('{0:>14}: {1:.2f}s ({2} streams, {3} errors)'.format(
+                name, elapsed, len(report['streams']), len(report['errors'])))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
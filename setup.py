@@ -22,6 +22,10 @@ setup(name='iotile_cloud',
         'requests>=2.21.0',
         'python-dateutil'
     ],
+    extras_require={
+        'numpy': ['numpy'],
+        'arrow': ['numpy', 'pyarrow'],
+    },
     keywords=["iotile", "arch", "iot", "automation"],
     classifiers=[
         "Programming Language :: Python",
@@ -0,0 +1,84 @@
+import pickle
+import unittest2 as unittest
+import numpy as np
+
+from iotile_cloud.stream.aggregate import BucketAggregator
+
+
+def _records(items):
+    return [{'timestamp': ts, 'value': value} for ts, value in items]
+
+
+class BucketAggregatorTestCase(unittest.TestCase):
+    records = _records([
+        ('2019-03-01T10:05:00Z', 1.0),
+        ('2019-03-01T10:55:00Z', 3.0),
+        ('2019-03-01T10:30:00Z', 2.0),
+        ('2019-03-01T11:00:00Z', 10.0),
+        ('2019-03-02T07:59:59Z', 5.0),
+        ('2019-03-02T08:00:00Z', 7.0),
+    ])
+
+    def test_hourly(self):
+        aggregator = BucketAggregator('hour')
+        aggregator.add_page(self.records[:2])
+        aggregator.add_page(self.records[2:])
+        aggregator.add_page([])
+
+        result = aggregator.result()
+        self.assertEqual(len(aggregator), 4)
+        self.assertEqual(result['bucket'][0], np.datetime64('2019-03-01T10:00:00'))
+        np.testing.assert_array_equal(result['count'], [3, 1, 1, 1])
+        np.testing.assert_array_equal(result['sum'], [6.0, 10.0, 5.0, 7.0])
+        np.testing.assert_array_equal(result['min'], [1.0, 10.0, 5.0, 7.0])
+        np.testing.assert_array_equal(result['max'], [3.0, 10.0, 5.0, 7.0])
+        np.testing.assert_array_equal(result['mean'], [2.0, 10.0, 5.0, 7.0])
+        # First and last are by timestamp, not arrival order
+        self.assertEqual(result['first'][0], 1.0)
+        self.assertEqual(result['last'][0], 3.0)
+
+    def test_daily_in_timezone(self):
+        aggregator = BucketAggregator('day', tz='America/Los_Angeles')
+        aggregator.add_page(self.records)
+
+        result = aggregator.result()
+        # Local midnight is 08:00 UTC in March (before DST starts)
+        np.testing.assert_array_equal(result['bucket'], np.array(['2019-03-01T08:00:00', '2019-03-02T08:00:00'],
+                                                                 dtype='datetime64[us]'))
+        np.testing.assert_array_equal(result['count'], [5, 1])
+
+        # A day with a DST change is 23 hours long
+        aggregator = BucketAggregator('day', tz='America/Los_Angeles')
+        aggregator.add_page(_records([('2019-03-10T08:00:00Z', 1.0), ('2019-03-11T06:59:00Z', 1.0),
+                                      ('2019-03-11T07:00:00Z', 1.0)]))
+        np.testing.assert_array_equal(aggregator.result()['count'], [2, 1])
+
+        self.assertRaises(ValueError, BucketAggregator, 'day', tz='Not/A_Zone')
+        self.assertRaises(ValueError, BucketAggregator, 'fortnight')
+
+    def test_fixed_interval_and_nan(self):
+        aggregator = BucketAggregator(interval=900)
+        timestamps = np.array(['2019-01-01T00:00:00', '2019-01-01T00:14:59', '2019-01-01T00:15:00',
+                               '2019-01-01T00:20:00'], dtype='datetime64[us]')
+        aggregator.add(timestamps, [1.0, 2.0, np.nan, 4.0])
+        result = aggregator.result()
+        np.testing.assert_array_equal(result['count'], [2, 1])
+        np.testing.assert_array_equal(result['sum'], [3.0, 4.0])
+
+    def test_merge_and_serialize(self):
+        full = BucketAggregator('hour')
+        full.add_page(self.records)
+
+        first = BucketAggregator('hour')
+        first.add_page(self.records[::2])
+        second = BucketAggregator('hour')
+        second.add_page(self.records[1::2])
+
+        # Partial results can travel between processes as pickles or JSON dicts
+        second = pickle.loads(pickle.dumps(second))
+        merged = BucketAggregator.from_dict(first.to_dict()).merge(second)
+        for name, values in full.result().items():
+            np.testing.assert_array_equal(merged.result()[name], values)
+
+        self.assertRaises(ValueError, first.merge, BucketAggregator('day'))
+        self.assertRaises(ValueError, first.merge, BucketAggregator('hour', tz='Europe/Paris'))
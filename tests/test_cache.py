@@ -0,0 +1,70 @@
+import unittest2 as unittest
+import os
+import shutil
+import tempfile
+
+from iotile_cloud.utils.cache import BlobCache, TTLCache
+
+
+class TTLCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.cache = TTLCache(10, maxsize=3, clock=lambda: self.now)
+
+    def test_expiry(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', None, ttl=30)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIn('b', self.cache)
+
+        self.now += 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('a', 'missing'), 'missing')
+        self.assertIn('b', self.cache)
+
+        self.cache.invalidate('b')
+        self.assertNotIn('b', self.cache)
+
+    def test_maxsize(self):
+        for key in 'abc':
+            self.cache.put(key, key)
+        # 'a' becomes the most recently used
+        self.cache.get('a')
+        self.cache.put('d', 'd')
+        self.assertEqual(len(self.cache), 3)
+        self.assertNotIn('b', self.cache)
+        self.assertIn('a', self.cache)
+
+        self.assertEqual(sorted(self.cache.keys()), ['a', 'c', 'd'])
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
+
+
+class BlobCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_eviction(self):
+        cache = BlobCache(os.path.join(self.folder, 'blobs'), max_bytes=250)
+        for i in range(5):
+            cache.put(i, {'data': 'x' * 80})
+            os.utime(os.path.join(cache.folder, '{}.json'.format(i)), (i, i))
+
+        # Stays within its size
+        self.assertEqual([i for i in range(5) if i in cache], [3, 4])
+        self.assertEqual(cache.get(4), {'data': 'x' * 80})
+        self.assertIsNone(cache.get(0))
+        self.assertLessEqual(BlobCache(cache.folder)._size, 250)
+
+        self.assertRaises(ValueError, cache.put, '../escape', {})
+        self.assertEqual(sorted(cache.keys()), ['3', '4'])
+        cache.delete(3)
+        cache.delete(3)
+        self.assertEqual(cache.keys(), ['4'])
+        cache.clear()
+        self.assertNotIn(4, cache)
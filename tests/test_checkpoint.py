@@ -0,0 +1,149 @@
+import os
+import json
+import shutil
+import tempfile
+import requests_mock
+import unittest2 as unittest
+
+from iotile_cloud.api.connection import Api
+from iotile_cloud.api.exceptions import HttpServerError
+from iotile_cloud.stream.data import StreamData
+from iotile_cloud.stream.checkpoint import DownloadCheckpoint, JsonLinesSink
+from iotile_cloud.stream.paging import PageSizeController
+
+
+class CheckpointTestCase(unittest.TestCase):
+    total = 2500
+
+    def setUp(self):
+        self.api = Api(domain='http://iotile.test')
+        self.folder = tempfile.mkdtemp()
+        self.sink_path = os.path.join(self.folder, 'data.jsonl')
+        self.checkpoint_path = os.path.join(self.folder, 'data.checkpoint')
+        self.fail_on = None
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _callback(self, request, context):
+        page = int(request.qs['page'][0])
+        page_size = int(request.qs['page_size'][0])
+        if (page, page_size) == self.fail_on:
+            context.status_code = 500
+            return 'Error'
+
+        first = (page - 1) * page_size
+        last = min(page * page_size, self.total)
+        payload = {
+            'next': 'more' if last < self.total else None,
+            'count': self.total,
+            'results': [{'id': i, 'timestamp': '2019-01-01T00:00:00Z', 'value': i} for i in range(first, last)]
+        }
+        context.status_code = 200
+        return json.dumps(payload)
+
+    def _stream_data(self):
+        stream_data = StreamData('s--0001', self.api)
+        stream_data.page_size_controller = PageSizeController(initial=250, minimum=100, maximum=1000,
+                                                              target_latency=100)
+        return stream_data
+
+    @requests_mock.Mocker()
+    def test_resume_download(self, m):
+        m.get('http://iotile.test/api/v1/stream/s--0001/data/', text=self._callback)
+
+        # Pages of 250, 250, 500, 1000 (fails)
+        self.fail_on = (2, 1000)
+        stream_data = self._stream_data()
+        with JsonLinesSink(self.sink_path) as sink:
+            with self.assertRaises(HttpServerError):
+                stream_data.initialize_from_server(fields=['id', 'value'], start='2019-01-01T00:00:00Z',
+                                                   sink=sink, checkpoint=DownloadCheckpoint(self.checkpoint_path))
+        self.assertEqual(len(stream_data.data), 0)
+
+        state = DownloadCheckpoint(self.checkpoint_path).load()
+        self.assertEqual(state['records'], 1000)
+        self.assertEqual(state['pages'], 3)
+        self.assertEqual(state['next_page'], 3)
+        self.assertEqual(state['page_size'], 500)
+        self.assertEqual(state['query']['stream'], 's--0001')
+
+        # Simulate a partially written page after the last checkpoint
+        with open(self.sink_path, 'a') as fp:
+            fp.write('{"id": 1000, "value": 1000}\n{"id": 10')
+
+        # A different query cannot use the same checkpoint
+        with JsonLinesSink(self.sink_path) as sink:
+            self.assertRaises(ValueError, self._stream_data().initialize_from_server, start='2019-02-01T00:00:00Z',
+                              sink=sink, checkpoint=DownloadCheckpoint(self.checkpoint_path))
+
+        self.fail_on = None
+        m.reset_mock()
+        with JsonLinesSink(self.sink_path) as sink:
+            self._stream_data().initialize_from_server(fields=['id', 'value'], start='2019-01-01T00:00:00Z',
+                                                       sink=sink, checkpoint=DownloadCheckpoint(self.checkpoint_path))
+            ids = [item['id'] for item in sink.read()]
+
+        self.assertEqual(ids, list(range(self.total)))
+        # Resumed at record 1000, with a new controller starting at 250 records per page
+        self.assertEqual(m.request_history[0].qs['page'], ['5'])
+        self.assertEqual(m.request_history[0].qs['page_size'], ['250'])
+        self.assertEqual(DownloadCheckpoint(self.checkpoint_path).load()['next_page'], 0)
+
+        # Running again on a completed checkpoint does not download anything
+        m.reset_mock()
+        with JsonLinesSink(self.sink_path) as sink:
+            self._stream_data().initialize_from_server(fields=['id', 'value'], start='2019-01-01T00:00:00Z',
+                                                       sink=sink, checkpoint=DownloadCheckpoint(self.checkpoint_path))
+            self.assertEqual(len(list(sink.read())), self.total)
+        self.assertEqual(m.call_count, 0)
+
+    @requests_mock.Mocker()
+    def test_sink_without_checkpoint(self, m):
+        m.get('http://iotile.test/api/v1/stream/s--0001/data/', text=self._callback)
+
+        stream_data = self._stream_data()
+        self.assertRaises(ValueError, stream_data.initialize_from_server,
+                          checkpoint=DownloadCheckpoint(self.checkpoint_path))
+
+        with JsonLinesSink(self.sink_path) as sink:
+            stream_data.initialize_from_server(sink=sink)
+            records = list(sink.read())
+        self.assertEqual(len(stream_data.data), 0)
+        self.assertEqual(len(records), self.total)
+        self.assertEqual(records[0], {'id': 0, 'timestamp': '2019-01-01T00:00:00Z', 'value': 0})
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    @requests_mock.Mocker()
+    def test_resume_keyset_download(self, m):
+        records = [{'id': i, 'timestamp': '2019-01-01T00:{0:02d}:00Z'.format(i // 2), 'value': i} for i in range(20)]
+
+        def _callback(request, context):
+            start = request.qs.get('start', [''])[0]
+            if start == '2019-01-01t00:05:00z' and self.fail_on:
+                context.status_code = 500
+                return 'Error'
+            results = [item for item in records if item['timestamp'].lower() >= start]
+            page_size = int(request.qs['page_size'][0])
+            payload = {'next': 'more' if len(results) > page_size else None, 'count': len(results),
+                       'results': results[:page_size]}
+            return json.dumps(payload)
+
+        m.get('http://iotile.test/api/v1/stream/s--0001/data/', text=_callback)
+
+        self.fail_on = True
+        with JsonLinesSink(self.sink_path) as sink:
+            with self.assertRaises(HttpServerError):
+                StreamData('s--0001', self.api).initialize_from_server(
+                    page_size=3, keyset=True, sink=sink, checkpoint=DownloadCheckpoint(self.checkpoint_path))
+
+        state = DownloadCheckpoint(self.checkpoint_path).load()
+        self.assertEqual(state['records'], 11)
+        self.assertEqual(state['next_page'], {'timestamp': '2019-01-01T00:05:00Z', 'ids': [10]})
+
+        self.fail_on = None
+        with JsonLinesSink(self.sink_path) as sink:
+            StreamData('s--0001', self.api).initialize_from_server(
+                page_size=3, keyset=True, sink=sink, checkpoint=DownloadCheckpoint(self.checkpoint_path))
+            ids = [item['id'] for item in sink.read()]
+        self.assertEqual(ids, list(range(20)))
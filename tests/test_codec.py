@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest2 as unittest
+import numpy as np
+
+from iotile_cloud.stream.codec import (decode, decode_varints, encode, encode_records, encode_varints,
+                                       read_segment, write_segment, SegmentFormatError)
+
+
+class CodecTestCase(unittest.TestCase):
+
+    def test_varints(self):
+        values = np.array([0, 1, 127, 128, 300, 2 ** 35, 2 ** 64 - 1], dtype='uint64')
+        data = encode_varints(values)
+        self.assertEqual(list(data[:5]), [0, 1, 127, 0x80, 1])
+        self.assertEqual(len(data), 1 + 1 + 1 + 2 + 2 + 6 + 10)
+        np.testing.assert_array_equal(decode_varints(data), values)
+        self.assertRaises(SegmentFormatError, decode_varints, np.array([0x80], dtype='uint8'))
+
+    def test_round_trip(self):
+        rng = np.random.RandomState(42)
+        timestamps = np.datetime64('2019-01-01T00:00:00', 'us') + np.cumsum(rng.randint(0, 10 ** 9, 500))
+        values = np.r_[rng.normal(size=497), np.nan, np.inf, -0.0]
+
+        out_timestamps, out_values = decode(encode(timestamps, values))
+        np.testing.assert_array_equal(out_timestamps, timestamps)
+        # Bit exact, including NaN and negative zero
+        np.testing.assert_array_equal(out_values.view('uint64'), values.view('uint64'))
+
+        for size in (0, 1, 2):
+            out_timestamps, out_values = decode(encode(timestamps[:size], values[:size]))
+            np.testing.assert_array_equal(out_timestamps, timestamps[:size])
+            np.testing.assert_array_equal(out_values, values[:size])
+
+    def test_compression(self):
+        timestamps = np.datetime64('2019-01-01T00:00:00', 'us') + np.arange(10000) * np.timedelta64(10, 'm')
+        values = np.repeat(np.arange(100, dtype='float64') * 0.5, 100)
+        data = encode(timestamps, values)
+        # About two bytes per reading, instead of ~200 as JSON
+        self.assertLess(len(data), 10000 * 2 + 1000)
+
+        records = [{'timestamp': str(ts) + 'Z', 'value': value} for ts, value in zip(timestamps[:10], values[:10])]
+        self.assertEqual(encode_records(list(reversed(records))), encode(timestamps[:10], values[:10]))
+
+    def test_segment_files(self):
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, 'segment.bin')
+            write_segment(path, np.array([1, 2, 4], dtype='int64'), [1.0, 1.0, 2.0])
+            timestamps, values = read_segment(path)
+            np.testing.assert_array_equal(timestamps.astype('int64'), [1, 2, 4])
+            np.testing.assert_array_equal(values, [1.0, 1.0, 2.0])
+        finally:
+            shutil.rmtree(folder)
+
+        self.assertRaises(SegmentFormatError, decode, b'JUNK')
+        self.assertRaises(SegmentFormatError, decode, encode([1, 2], [1.0, 2.0])[:-1])
@@ -0,0 +1,81 @@
+"""Tests for streaming Parquet/Arrow export."""
+import pytest
+from dateutil.parser import parse as dt_parse
+
+from iotile_cloud.api.connection import Api
+from iotile_cloud.stream.data import StreamData, RawData
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.parquet as pq
+from iotile_cloud.stream.export import ParquetExporter, ArrowIPCExporter, EXPORT_FIELDS, EXPORT_SCHEMA
+from iotile_cloud.stream.pipeline import ExporterSink, Pipeline
+
+STREAM1 = 's--0000-0077--0000-0000-0000-00d2--5001'
+STREAM2 = 's--0000-0077--0000-0000-0000-00d2--5002'
+
+
+def test_parquet_export(water_meter, tmpdir):
+    domain, _cloud = water_meter
+    api = Api(domain=domain, verify=False)
+    api.login('test', 'test@arch-iot.com')
+
+    path = str(tmpdir.join('data.parquet'))
+    with ParquetExporter(path, pages_per_row_group=2) as exporter:
+        for slug in [STREAM1, STREAM2]:
+            exporter.write_data(StreamData(slug, api))
+        # RawData records include their own slugs
+        exporter.write_data(RawData(api), filter=STREAM1)
+        assert exporter.records == 11 + 3 + 11
+
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.num_row_groups == 2
+    assert parquet_file.schema_arrow.equals(EXPORT_SCHEMA)
+
+    table = parquet_file.read()
+    assert table.num_rows == 25
+    first = table.slice(0, 1).to_pylist()[0]
+    assert first['value'] == 37854.1
+    assert first['int_value'] == 100
+    assert first['timestamp'].isoformat() == '2017-04-11T20:37:29.608972+00:00'
+    assert first['stream'] == STREAM1
+    assert first['device'] == 'd--0000-0000-0000-00d2'
+    assert first['variable'] == 'v--0000-0077--5001'
+
+    streams = table.column('stream').to_pylist()
+    assert streams.count(STREAM1) == 22
+    assert streams.count(STREAM2) == 3
+
+
+def test_arrow_ipc_export(water_meter, tmpdir):
+    domain, _cloud = water_meter
+    api = Api(domain=domain, verify=False)
+    api.login('test', 'test@arch-iot.com')
+
+    path = str(tmpdir.join('data.arrow'))
+    with ArrowIPCExporter(path) as exporter:
+        for slug in [STREAM1, STREAM2]:
+            exporter.write_data(StreamData(slug, api))
+        exporter.write_page([])
+
+    reader = pa.ipc.open_file(path)
+    assert reader.num_record_batches == 2
+    table = reader.read_all()
+    assert table.num_rows == 14
+    assert table.column('stream').type == pa.dictionary(pa.int32(), pa.string())
+    assert table.column('stream').to_pylist()[-1] == STREAM2
+    assert table.column('int_value').to_pylist()[-3:] == [100, 99, 0]
+
+
+def test_pipeline_exporter_sink(water_meter, tmpdir):
+    domain, _cloud = water_meter
+    api = Api(domain=domain, verify=False)
+    api.login('test', 'test@arch-iot.com')
+
+    path = str(tmpdir.join('pipeline.parquet'))
+    pipeline = Pipeline(api, fields=EXPORT_FIELDS, sinks=[ExporterSink(ParquetExporter(path))])
+    result = pipeline.run([STREAM1, STREAM2], start=dt_parse('2017-01-01T00:00:00Z'), end=dt_parse('2018-01-01T00:00:00Z'))
+    assert result['errors'] == {}
+
+    table = pq.read_table(path)
+    assert table.num_rows == 14
+    assert sorted(set(table.column('stream').to_pylist())) == [STREAM1, STREAM2]
@@ -0,0 +1,91 @@
+import os
+import json
+import shutil
+import tempfile
+import requests_mock
+import unittest2 as unittest
+
+from iotile_cloud.api.connection import Api
+from iotile_cloud.stream.follow import StreamFollower
+
+
+class StreamFollowerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.api = Api(domain='http://iotile.test')
+        self.folder = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.folder, 'follow.json')
+        self.now = 0.0
+        self.sleeps = []
+        self.data = {'s--0001': [], 's--0002': []}
+        self.failing = False
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _add(self, slug, point_id, second):
+        self.data[slug].append({'id': point_id, 'timestamp': '2019-01-01T00:00:{0:02d}Z'.format(second),
+                                'value': float(point_id)})
+
+    def _callback(self, request, context):
+        if self.failing:
+            context.status_code = 500
+            return 'Error'
+        results = self.data[request.path.split('/')[4]]
+        if 'start' in request.qs:
+            results = [item for item in results if item['timestamp'].lower() >= request.qs['start'][0]]
+        if 'lastn' in request.qs:
+            results = results[-int(request.qs['lastn'][0]):]
+        return json.dumps({'next': None, 'count': len(results), 'results': results})
+
+    def _sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def _follower(self, **kwargs):
+        return StreamFollower(self.api, ['s--0001', 's--0002'], state_path=self.state_path, min_interval=1,
+                              max_interval=8, sleep=self._sleep, clock=lambda: self.now, **kwargs)
+
+    @requests_mock.Mocker()
+    def test_follow(self, m):
+        m.get(requests_mock.ANY, text=self._callback)
+        self._add('s--0001', 1, 0)
+        self._add('s--0001', 2, 1)
+
+        follower = self._follower()
+        # First polls only set the watermarks
+        self.assertEqual(list(follower.follow(max_polls=2)), [])
+        self.assertEqual(follower.watermarks, {'s--0001': {'timestamp': '2019-01-01T00:00:01Z', 'ids': [2]},
+                                               's--0002': {'timestamp': None, 'ids': []}})
+
+        # New point with the same timestamp as the watermark
+        self._add('s--0001', 3, 1)
+        self._add('s--0001', 4, 5)
+        self._add('s--0002', 5, 7)
+        points = list(follower.follow(max_polls=2))
+        self.assertEqual([(slug, point['id']) for slug, point in points], [('s--0001', 3), ('s--0001', 4),
+                                                                          ('s--0002', 5)])
+
+        # Restart from the saved watermarks: nothing is emitted again
+        follower = self._follower()
+        self.assertEqual(list(follower.follow(max_polls=4)), [])
+        self._add('s--0002', 6, 9)
+        self.assertEqual([point['id'] for _slug, point in follower.follow(max_polls=2)], [6])
+
+    @requests_mock.Mocker()
+    def test_adaptive_intervals(self, m):
+        m.get(requests_mock.ANY, text=self._callback)
+        follower = self._follower(from_start=True)
+        follower.stream_slugs = ['s--0001']
+
+        self.failing = True
+        self.assertEqual(list(follower.follow(max_polls=5)), [])
+        # Quiet (or failing) streams back off up to max_interval
+        self.assertEqual(self.sleeps, [2, 4, 8, 8])
+
+        self.failing = False
+        self._add('s--0001', 1, 0)
+        follower.intervals['s--0001'] = 8
+        self.assertEqual(len(list(follower.follow(max_polls=2))), 1)
+        self.assertEqual(follower.intervals['s--0001'], 8)
+        self.assertEqual(self.sleeps[-1], 4)
@@ -0,0 +1,73 @@
+import datetime
+import unittest2 as unittest
+import numpy as np
+
+from iotile_cloud.stream.data import get_record_class
+from iotile_cloud.stream.join import asof_join, iter_asof_join
+
+
+def _records(items):
+    return [{'timestamp': ts, 'value': value} for ts, value in items]
+
+
+class AsofJoinTestCase(unittest.TestCase):
+    pressure = _records([
+        ('2019-01-01T00:00:00Z', 1.0),
+        ('2019-01-01T00:15:00Z', 2.0),
+        ('2019-01-01T00:30:00Z', 3.0),
+    ])
+    humidity = _records([
+        ('2019-01-01T00:01:00Z', 10.0),
+        ('2019-01-01T00:15:00Z', 20.0),
+    ])
+
+    def test_union_timeline(self):
+        columns = asof_join([('pressure', self.pressure), ('humidity', self.humidity)],
+                            tolerance=datetime.timedelta(minutes=10))
+        self.assertEqual(list(columns.keys()), ['timestamp', 'pressure', 'humidity'])
+        self.assertEqual(len(columns['timestamp']), 4)
+        self.assertEqual(columns['timestamp'][1], np.datetime64('2019-01-01T00:01:00'))
+        np.testing.assert_array_equal(columns['pressure'], [1.0, 1.0, 2.0, 3.0])
+        # Humidity is too old at 00:30
+        np.testing.assert_array_equal(columns['humidity'], [np.nan, 10.0, 20.0, np.nan])
+
+    def test_on_timeline(self):
+        record_class = get_record_class(['timestamp', 'value'])
+        temperature = [record_class(item['timestamp'], item['value'] * 2) for item in reversed(self.pressure)]
+
+        columns = asof_join({'pressure': self.pressure, 'temperature': temperature,
+                             'empty': []}, on='pressure', tolerance=60)
+        np.testing.assert_array_equal(columns['temperature'], [2.0, 4.0, 6.0])
+        self.assertTrue(np.all(np.isnan(columns['empty'])))
+
+        timestamps = np.array(['2018-12-31T23:00:00', '2019-01-01T00:20:00'], dtype='datetime64[us]')
+        columns = asof_join({'pressure': (timestamps, [5, 6])}, on=['2019-01-01T00:00:00', '2019-01-01T01:00:00'])
+        np.testing.assert_array_equal(columns['pressure'], [5.0, 6.0])
+
+    def test_streaming_join(self):
+        rows = list(iter_asof_join([('pressure', iter(self.pressure)), ('humidity', iter(self.humidity))],
+                                   tolerance=600))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0][0].minute, 0)
+        self.assertEqual([row[1] for row in rows], [[1.0, None], [1.0, 10.0], [2.0, 20.0], [3.0, None]])
+
+        # Same values as the vectorized version
+        columns = asof_join([('pressure', self.pressure), ('humidity', self.humidity)], tolerance=600)
+        vectorized = np.array([row[1] for row in rows], dtype='float64')
+        np.testing.assert_array_equal(vectorized[:, 1], columns['humidity'])
+
+    def test_streaming_join_equal_timestamps(self):
+        # Values are never compared, even when a stream repeats a timestamp
+        pressure = _records([
+            ('2019-01-01T00:00:00Z', None),
+            ('2019-01-01T00:00:00Z', 1.0),
+            ('2019-01-01T00:15:00Z', 2.0),
+            ('2019-01-01T00:15:00Z', None),
+        ])
+        humidity = _records([
+            ('2019-01-01T00:00:00Z', None),
+            ('2019-01-01T00:15:00Z', {'raw': 20}),
+        ])
+        rows = list(iter_asof_join([('pressure', iter(pressure)), ('humidity', iter(humidity))]))
+        # The last value of each stream at a timestamp wins
+        self.assertEqual([row[1] for row in rows], [[1.0, None], [None, {'raw': 20}]])
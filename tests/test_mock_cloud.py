@@ -4,10 +4,20 @@ from __future__ import (absolute_import, division,
 
 import os.path
 from io import BytesIO
+import mock
 import requests
 import pytest
+from dateutil.parser import parse as dt_parse
 from iotile_cloud.api.connection import Api
 from iotile_cloud.api.exceptions import HttpNotFoundError
+from iotile_cloud.stream.pipeline import SourceResolver
+from iotile_cloud.stream.planner import PlanBudgetExceeded, ReportPlanner
+from iotile_cloud.stream.report import AccumulationReportGenerator, StatsReportGenerator
+from iotile_cloud.stream.latest import LatestValues, get_latest_values
+from iotile_cloud.stream.topk import TopKEvents
+from iotile_cloud.stream.data import EventData, StreamData, fetch_event_details
+from iotile_cloud.utils.cache import BlobCache, TTLCache
+from iotile_cloud.utils.gid import IOTileStreamSlug
 
 
 def test_mock_cloud_login(water_meter):
@@ -272,6 +282,56 @@ def test_quick_add_fleet(mock_cloud_private_nossl):
     assert len(res['results']) == 3
 
 
+def test_fleet_and_org_sources(mock_cloud_private_nossl):
+    """Make sure fleets and orgs are resolved to the streams of their devices, with cached membership."""
+
+    domain, cloud = mock_cloud_private_nossl
+    api = Api(domain=domain)
+    cloud.quick_add_user('test@arch-iot.com', 'test')
+    api.login('test', 'test@arch-iot.com')
+
+    cloud.quick_add_org('Other Org', slug='other-org')
+    proj1, proj1_slug = cloud.quick_add_project()
+    proj2, proj2_slug = cloud.quick_add_project()
+    proj3, proj3_slug = cloud.quick_add_project(org_slug='other-org')
+
+    slugs = []
+    for proj, proj_slug in [(proj1, proj1_slug), (proj2, proj2_slug), (proj3, proj3_slug)]:
+        for _i in range(2):
+            device_slug = cloud.quick_add_device(proj)
+            stream_slug = IOTileStreamSlug()
+            stream_slug.from_parts(proj_slug, device_slug, '5001')
+            slug = str(stream_slug)
+            cloud.streams[slug] = {'slug': slug, 'project': proj_slug, 'project_id': proj,
+                                   'device': device_slug, 'block': None}
+            slugs.append(slug)
+
+    devices = [cloud.streams[slug]['device'] for slug in slugs]
+    fleet = cloud.quick_add_fleet([devices[1], devices[4]])
+
+    membership = TTLCache(300)
+    resolver = SourceResolver(api, workers=2, membership=membership)
+    streams = resolver.resolve([fleet])
+    assert [x['slug'] for x in streams] == [slugs[1], slugs[4]]
+
+    streams = resolver.resolve(['org--quick-test-org', 'org--other-org', 'org--unknown'])
+    assert sorted(x['slug'] for x in streams) == sorted(slugs)
+
+    # Membership is cached, until invalidated
+    cloud.fleet_members[fleet] = {devices[0]: (devices[0], False, False)}
+    assert [x['slug'] for x in resolver.resolve([fleet])] == [slugs[1], slugs[4]]
+    assert [x['slug'] for x in SourceResolver(api, membership=membership).resolve([fleet])] == [slugs[1], slugs[4]]
+
+    membership.invalidate()
+    assert [x['slug'] for x in resolver.resolve([fleet])] == [slugs[0]]
+
+    # Report generators accept fleet sources too
+    cloud.quick_add_stream_data(slugs[0], [{'timestamp': '2017-04-12T00:00:00Z', 'value': 2.0}])
+    stats = StatsReportGenerator(api, workers=2).compute_stats([fleet], start=dt_parse('2017-01-01T00:00:00Z'))
+    assert list(stats['streams'].keys()) == [slugs[0]]
+    assert stats['aggregate']['sum'] == 2.0
+
+
 def test_upload_report(mock_cloud_private_nossl):
     """Make sure we can upload data."""
 
@@ -345,4 +405,197 @@ def test_get_sg_dt(mock_cloud_private_nossl):
     dt_slug = cloud.quick_add_dt(slug="test-dt", os_tag=1027)
 
     assert api.sg(sg_slug).get()['slug'] == "test-sg"
-    assert api.dt(dt_slug).get()['slug'] == "test-dt"
\ No newline at end of file
+    assert api.dt(dt_slug).get()['slug'] == "test-dt"
+
+
+def test_event_data(water_meter, tmpdir):
+    """Make sure we can download events and their data, using a cache."""
+
+    domain, cloud = water_meter
+    api = Api(domain=domain, verify=False)
+    api.login('test', 'test@arch-iot.com')
+
+    cache = BlobCache(str(tmpdir.join('events')))
+    events = EventData('s--0000-0077--0000-0000-0000-00d2--5001', api, cache=cache)
+    events.initialize_from_server(start='2016-06-23T00:00:00Z')
+    assert [x['id'] for x in events.data] == [1, 2, 3]
+
+    details = events.fetch_details(workers=2)
+    assert details == {1: {"test": 1, "hello": 2}, 2: {"test": 1, "goodbye": 15}}
+    assert 1 in cache and 3 not in cache
+
+    # A second analysis only hits the cache
+    count = cloud.request_count
+    details = EventData('s--0000-0077--0000-0000-0000-00d2--5001', api, cache=cache).fetch_details(events.data)
+    assert details[2] == {"test": 1, "goodbye": 15}
+    assert cloud.request_count == count
+
+    # Missing event data is reported as None
+    assert fetch_event_details(api, [1, 5]) == {1: {"test": 1, "hello": 2}, 5: None}
+
+
+def test_top_k_events(water_meter):
+    """Make sure only the data of the top K events is downloaded."""
+
+    domain, cloud = water_meter
+    api = Api(domain=domain, verify=False)
+    api.login('test', 'test@arch-iot.com')
+
+    slug = 's--0000-0077--0000-0000-0000-00d2--5001'
+    for event_id, peak in [(1, 2.5), (2, 1.0), (3, 7.0)]:
+        cloud.events[event_id]['extra_data']['peak'] = peak
+
+    selector = TopKEvents(2, key='peak')
+    selector.add_data(EventData(slug, api), group=slug)
+    assert [x['id'] for x in selector.top(slug)] == [3, 1]
+
+    details = selector.fetch_details(api, workers=2)
+    assert list(details.keys()) == [slug]
+    # Event 3 has no data, event 2 is not in the top 2
+    assert [(event['id'], data) for event, data in details[slug]] == [(3, None), (1, {"test": 1, "hello": 2})]
+
+
+def test_latest_values(water_meter):
+    """Make sure we can get the latest value of many streams, skipping empty ones."""
+
+    domain, cloud = water_meter
+    api = Api(domain=domain, verify=False)
+    api.login('test', 'test@arch-iot.com')
+
+    slugs = ['s--0000-0077--0000-0000-0000-00d2--5001', 's--0000-0077--0000-0000-0000-00d2--5002',
+             's--0000-0077--0000-0000-0000-00d2--100b']
+
+    latest = LatestValues(api, ttl=60, workers=4)
+    count = cloud.request_count
+    values = latest.get(slugs)
+    values_all = dict(values)
+    assert list(values.keys()) == slugs
+    assert values[slugs[0]]['timestamp'] == '2017-04-11T22:17:25.972121Z'
+    assert values[slugs[1]] is not None
+    assert values[slugs[2]] is None
+    # One stream counts request, and no data request for the empty stream
+    assert cloud.request_count == count + 3
+
+    # Cached
+    assert latest.get(slugs[:1]) == {slugs[0]: values[slugs[0]]}
+    assert cloud.request_count == count + 3
+
+    latest.invalidate(slugs[0])
+    latest.get(slugs[:1])
+    assert cloud.request_count == count + 4
+
+    assert get_latest_values(api, slugs, skip_empty=False)[slugs[2]] is None
+
+    # Failures are reported per stream, and not cached
+    count = cloud.request_count
+    values = latest.get(slugs[:1] + ['x--0000-0001'])
+    assert values == {slugs[0]: values[slugs[0]], 'x--0000-0001': None}
+    assert list(latest.errors.keys()) == ['x--0000-0001']
+    assert cloud.request_count == count + 1
+    latest.get(['x--0000-0001'])
+    assert list(latest.errors.keys()) == ['x--0000-0001']
+    assert cloud.request_count == count + 2
+
+    # Without stream counts, every stream is queried
+    latest = LatestValues(api, ttl=60, workers=4)
+    with mock.patch.object(api, 'device', side_effect=requests.exceptions.ConnectionError('down')):
+        assert latest.get(slugs) == values_all
+    assert latest.errors == {}
+
+
+def test_keyset_paging(water_meter):
+    """Make sure keyset paging neither skips nor duplicates data added during a download."""
+
+    domain, cloud = water_meter
+    api = Api(domain=domain, verify=False)
+    api.login('test', 'test@arch-iot.com')
+
+    slug = 's--0000-0077--0000-0000-0000-00d2--5001'
+    original = [x['id'] for x in StreamData(slug, api).iter_records(fields=['id'])]
+    assert len(original) == 11
+
+    def _download(**kwargs):
+        ids = []
+        for i, page in enumerate(StreamData(slug, api).iter_pages(fields=['id', 'value'], page_size=4, **kwargs)):
+            ids.extend(x['id'] for x in page)
+            if i == 0:
+                # New data before and after the first page
+                cloud.quick_add_stream_data(slug, [
+                    {'timestamp': '2017-04-11T20:30:00Z', 'value': 1.0},
+                    {'timestamp': '2017-04-12T00:00:00Z', 'value': 2.0},
+                ])
+        return ids
+
+    try:
+        # Offset paging sees the same record twice
+        ids = _download()
+        assert len(ids) == 13 and len(set(ids)) == 12
+
+        cloud.stream_data.clear()
+        ids = _download(keyset=True)
+        assert len(ids) == len(set(ids))
+        # The new data after the first page is included
+        assert ids == original + [cloud.data_id_counter - 1]
+
+        # More records at the same timestamp than fit in a page
+        cloud.stream_data.clear()
+        cloud.quick_add_stream_data(slug, [{'timestamp': '2017-04-12T00:00:00Z', 'value': float(i)} for i in range(7)])
+        records = list(StreamData(slug, api).iter_records(page_size=2, keyset=True, start='2017-04-11T22:00:00Z'))
+        assert [x['value'] for x in records[-7:]] == [float(i) for i in range(7)]
+        assert len(records) == len(set(x['id'] for x in records)) == 9
+    finally:
+        cloud.stream_data.clear()
+
+
+def test_process_backend(water_meter):
+    """Make sure reports sharded across worker processes match the thread backend."""
+
+    domain, cloud = water_meter
+    api = Api(domain=domain, verify=False)
+    api.login('test', 'test@arch-iot.com')
+
+    start = dt_parse('2017-01-01T00:00:00Z')
+    end = dt_parse('2018-01-01T00:00:00Z')
+    expected = StatsReportGenerator(api, workers=2).compute_stats(['p--0000-0077'], start=start, end=end)
+    assert expected['aggregate']['count'] > 0
+
+    stats = StatsReportGenerator(api, workers=2, backend='process').compute_stats(['p--0000-0077'], start=start, end=end)
+    assert stats == expected
+
+    with pytest.raises(ValueError):
+        StatsReportGenerator(api, backend='fork')
+
+
+@pytest.mark.parametrize('method', ['probe', 'device'])
+def test_report_planner(water_meter, method):
+    """Make sure planned reports run largest first, match unplanned reports and respect their budget."""
+
+    domain, cloud = water_meter
+    api = Api(domain=domain, verify=False)
+    api.login('test', 'test@arch-iot.com')
+
+    start = dt_parse('2017-01-01T00:00:00Z')
+    end = dt_parse('2018-01-01T00:00:00Z')
+    sources = ['p--0000-0077']
+    expected = StatsReportGenerator(api, workers=2).compute_stats(sources, start=start, end=end)
+
+    gen = StatsReportGenerator(api, workers=2, planner=ReportPlanner(api, method=method))
+    plan = gen.plan(sources, start=start, end=end)
+    records = [row['records'] for row in plan['streams']]
+    assert records == sorted(records, reverse=True)
+    assert plan['records'] == expected['aggregate']['count'] > 0
+
+    assert gen.compute_stats(sources, start=start, end=end) == expected
+    assert gen.last_plan == plan
+    stats = StatsReportGenerator(api, workers=2, backend='process',
+                                 planner=ReportPlanner(api, method=method)).compute_stats(sources, start=start, end=end)
+    assert stats == expected
+
+    expected = AccumulationReportGenerator(api, workers=2).compute_sum(sources, start=start, end=end)
+    gen = AccumulationReportGenerator(api, workers=2, planner=ReportPlanner(api, method=method))
+    assert gen.compute_sum(sources, start=start, end=end) == expected
+
+    gen = StatsReportGenerator(api, planner=ReportPlanner(api, method=method, max_records=plan['records'] - 1))
+    with pytest.raises(PlanBudgetExceeded) as e:
+        gen.compute_stats(sources, start=start, end=end)
+    assert e.value.plan['over_budget'] == ['records']
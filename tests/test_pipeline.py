@@ -0,0 +1,139 @@
+import unittest2 as unittest
+import csv
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import requests_mock
+from dateutil.parser import parse as dt_parse
+
+from iotile_cloud.api.connection import Api
+from iotile_cloud.stream.pipeline import *
+from iotile_cloud.utils.mdo import MdoHelper
+
+START = dt_parse('2019-01-01T00:00:00Z')
+END = dt_parse('2019-02-01T00:00:00Z')
+
+
+class PipelineTestCase(unittest.TestCase):
+    slugs = ['s--0000-0001--0000-0000-0000-0002--5001', 's--0000-0001--0000-0000-0000-0002--5002',
+             's--0000-0001--0000-0000-0000-0003--5001']
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.api = Api(domain='http://iotile.test')
+        self.pages = 3
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _mock(self, m):
+        streams = [{'slug': slug, 'output_unit': {'unit_short': 'G', 'm': 10, 'd': 1}} for slug in self.slugs]
+        m.get('http://iotile.test/api/v1/stream/?project=p--0000-0001',
+              text=json.dumps({'count': 3, 'next': None, 'results': streams}))
+        m.get('http://iotile.test/api/v1/stream/?device=d--0000-0000-0000-0002',
+              text=json.dumps({'count': 2, 'next': None, 'results': streams[:2]}))
+        m.get('http://iotile.test/api/v1/stream/{}/'.format(self.slugs[0]), text=json.dumps(streams[0]))
+
+        def _callback(request, context):
+            if '0003' in request.path:
+                context.status_code = 500
+                return 'Error'
+            # One record per page, unless a larger page size is asked for
+            page = int(request.qs['page'][0])
+            page_size = int(request.qs.get('page_size', [1])[0])
+            numbers = range((page - 1) * page_size + 1, min(page * page_size, self.pages) + 1)
+            return json.dumps({
+                'count': self.pages,
+                'next': 'more' if page * page_size < self.pages else None,
+                'results': [{'timestamp': '2019-01-01T00:00:{:02d}Z'.format(i), 'value': float(i)} for i in numbers]
+            })
+
+        m.get(re.compile('http://iotile.test/api/v1/stream/s--.*/data/'), text=_callback)
+
+    @requests_mock.Mocker()
+    def test_resolver(self, m):
+        self._mock(m)
+        resolver = SourceResolver(self.api, workers=2)
+        streams = resolver.resolve([self.slugs[0], 'p--0001', 'd--0002', 'x--0001'])
+        self.assertEqual([stream['slug'] for stream in streams], self.slugs)
+
+    @requests_mock.Mocker()
+    def test_pipeline(self, m):
+        self._mock(m)
+        path = os.path.join(self.folder, 'data.csv')
+        records = DictSink()
+        pipeline = Pipeline(self.api, fields=['timestamp', 'value'], workers=2,
+                            transforms=[MdoTransform('value'), lambda stream, item: item if item.value < 30 else None],
+                            aggregators={'sum': SumAggregator('value'), 'stats': StatsAggregator('value')},
+                            sinks=[records, CsvSink(path, ['timestamp', 'value'])])
+        result = pipeline.run(['p--0001'], start=START, end=END)
+
+        self.assertEqual(result['streams'], self.slugs)
+        self.assertEqual(list(result['errors'].keys()), self.slugs[2:])
+        self.assertEqual(result['aggregates']['sum'], {
+            'streams': {
+                self.slugs[0]: {'sum': 30.0, 'units': 'G'},
+                self.slugs[1]: {'sum': 30.0, 'units': 'G'},
+            },
+            'total': 60.0,
+        })
+        stats = result['aggregates']['stats']
+        self.assertEqual(stats['aggregate']['count'], 4)
+        self.assertEqual(stats['aggregate']['max'], 20.0)
+        self.assertEqual([item.value for item in records.records[self.slugs[0]]], [10.0, 20.0])
+
+        with open(path) as fp:
+            rows = list(csv.reader(fp))
+        self.assertEqual(rows[0], ['stream', 'timestamp', 'value'])
+        self.assertEqual(sorted(rows[1:])[0], [self.slugs[0], '2019-01-01T00:00:01Z', '10.0'])
+        self.assertEqual(len(rows), 5)
+
+    def test_mdo_transform(self):
+        stream = {'slug': self.slugs[0], 'output_unit': {'m': 3, 'd': 2, 'o': 1.0}}
+        transform = MdoTransform('value')
+        self.assertEqual(transform(stream, {'value': 2.0}), {'value': 4.0})
+        self.assertEqual(transform(stream, {'value': None}), {'value': None})
+        self.assertEqual(transform({'slug': self.slugs[1]}, {'value': 2.0}), {'value': 2.0})
+        self.assertEqual(MdoTransform('value', mdo=MdoHelper(10, 1))(stream, {'value': 2.0}), {'value': 20.0})
+
+    @requests_mock.Mocker()
+    def test_backpressure(self, m):
+        self._mock(m)
+        self.pages = 50
+
+        class SlowSink(object):
+            def __init__(self):
+                self.calls = []
+
+            def write(self, stream, records):
+                if not self.calls:
+                    time.sleep(0.3)
+                    # The fetch worker waited for room in the queue
+                    self.calls.append(m.call_count)
+
+            def close(self):
+                pass
+
+        sink = SlowSink()
+        pipeline = Pipeline(self.api, fields=['value'], workers=1, queue_size=2,
+                            aggregators={'sum': SumAggregator('value')}, sinks=[sink])
+        result = pipeline.run_streams([{'slug': self.slugs[0], 'output_unit': {'unit_short': 'G'}}], START, END)
+        self.assertLessEqual(sink.calls[0], 5)
+        self.assertEqual(result['aggregates']['sum']['total'], sum(range(1, 51)))
+
+    @requests_mock.Mocker()
+    def test_transform_error(self, m):
+        self._mock(m)
+        self.pages = 50
+
+        def _fail(stream, item):
+            raise ValueError('Bad record')
+
+        pipeline = Pipeline(self.api, fields=['value'], workers=2, queue_size=1, transforms=[_fail])
+        with self.assertRaises(ValueError):
+            pipeline.run(['d--0002'], start=START, end=END)
+        # The fetch workers stopped
+        self.assertLess(m.call_count, 10)
@@ -0,0 +1,100 @@
+import unittest2 as unittest
+import json
+import re
+import requests_mock
+from dateutil.parser import parse as dt_parse
+
+from iotile_cloud.api.connection import Api
+from iotile_cloud.stream.planner import *
+
+START = dt_parse('2019-01-01T00:00:00Z')
+END = dt_parse('2019-02-01T00:00:00Z')
+
+
+class PlannerTestCase(unittest.TestCase):
+    slugs = ['s--0000-0001--0000-0000-0000-0002--5001', 's--0000-0001--0000-0000-0000-0002--5002',
+             's--0000-0001--0000-0000-0000-0003--5001', 's--0000-0001--0000-0000-0000-0003--5002']
+    counts = [1500, 0, 5200, 2100]
+
+    def setUp(self):
+        self.api = Api(domain='http://iotile.test')
+        # Without 'device', the device comes from the stream slug
+        self.streams = [{'slug': slug} for slug in self.slugs]
+        self.streams[0]['device'] = 'd--0000-0000-0000-0002'
+
+    def _mock(self, m):
+        def _callback(request, context):
+            slug = request.path.split('/')[4]
+            if slug == self.slugs[3]:
+                context.status_code = 404
+                return 'Not found'
+            self.assertEqual(request.qs['page_size'], ['1'])
+            self.assertEqual(request.qs['start'], ['2019-01-01t00:00:00z'])
+            return json.dumps({'count': self.counts[self.slugs.index(slug)], 'next': None, 'results': []})
+
+        m.get(re.compile('http://iotile.test/api/v1/stream/s--.*/data/'), text=_callback)
+        m.get('http://iotile.test/api/v1/device/d--0000-0000-0000-0002/extra/', text=json.dumps({
+            'slug': 'd--0000-0000-0000-0002',
+            'stream_counts': {self.slugs[0]: {'data_cnt': 1500, 'has_streamid': True}},
+        }))
+        m.get('http://iotile.test/api/v1/device/d--0000-0000-0000-0003/extra/', text=json.dumps({
+            'slug': 'd--0000-0000-0000-0003',
+            'stream_counts': {self.slugs[2]: {'data_cnt': 5200, 'has_streamid': True},
+                              self.slugs[3]: {'data_cnt': 2100, 'has_streamid': True}},
+        }))
+
+    @requests_mock.Mocker()
+    def test_probe_estimate(self, m):
+        self._mock(m)
+        planner = ReportPlanner(self.api, workers=2)
+        estimates = planner.estimate(self.streams, START, END)
+        self.assertEqual(list(estimates.keys()), self.slugs)
+        self.assertEqual(list(estimates.values()), [1500, 0, 5200, None])
+
+    @requests_mock.Mocker()
+    def test_device_estimate(self, m):
+        self._mock(m)
+        planner = ReportPlanner(self.api, method='device', workers=2)
+        estimates = planner.estimate(self.streams, START, END)
+        self.assertEqual(list(estimates.values()), [1500, 0, 5200, 2100])
+        # One request per device
+        self.assertEqual(m.call_count, 2)
+
+        with self.assertRaises(ValueError):
+            ReportPlanner(self.api, method='guess')
+
+    @requests_mock.Mocker()
+    def test_plan(self, m):
+        self._mock(m)
+        planner = ReportPlanner(self.api, method='device', page_size=1000, seconds_per_page=1.0)
+        plan = planner.plan(self.streams, START, END, workers=2)
+
+        # Largest first
+        self.assertEqual([row['slug'] for row in plan['streams']],
+                         [self.slugs[2], self.slugs[3], self.slugs[0], self.slugs[1]])
+        self.assertEqual([row['pages'] for row in plan['streams']], [6, 3, 2, 1])
+        self.assertEqual(plan['records'], 8800)
+        self.assertEqual(plan['pages'], 12)
+        # Worker 1: 6 pages. Worker 2: 3 + 2 + 1 pages
+        self.assertEqual(plan['seconds'], 6.0)
+        self.assertEqual(plan['workers'], 2)
+        self.assertEqual(plan['over_budget'], [])
+        planner.check(plan)
+
+        self.assertEqual([stream['slug'] for stream in planner.schedule(self.streams, plan)],
+                         [row['slug'] for row in plan['streams']])
+
+        plan = planner.plan(self.streams, START, END, workers=1)
+        self.assertEqual(plan['seconds'], 12.0)
+
+    @requests_mock.Mocker()
+    def test_budget(self, m):
+        self._mock(m)
+        planner = ReportPlanner(self.api, method='device', max_records=10000, max_pages=10, max_seconds=2.0)
+        plan = planner.plan(self.streams, START, END, workers=4)
+        self.assertEqual(plan['over_budget'], ['pages', 'seconds'])
+
+        with self.assertRaises(PlanBudgetExceeded) as context:
+            planner.check(plan)
+        self.assertIs(context.exception.plan, plan)
+        self.assertIn('estimated 12 pages > 10', str(context.exception))
@@ -0,0 +1,128 @@
+import unittest2 as unittest
+import json
+import re
+import shutil
+import tempfile
+import requests_mock
+from dateutil.parser import parse as dt_parse
+
+from iotile_cloud.api.connection import Api
+from iotile_cloud.stream.report import AccumulationReportGenerator, StatsReportGenerator
+from iotile_cloud.stream.report_cache import ReportCache, normalize_source
+
+START = dt_parse('2019-01-01T00:00:00Z')
+END = dt_parse('2019-02-01T00:00:00Z')
+
+
+class ReportCacheTestCase(unittest.TestCase):
+    slugs = ['s--0000-0001--0000-0000-0000-0002--5001', 's--0000-0001--0000-0000-0000-0003--5001']
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.now = (END - dt_parse('1970-01-01T00:00:00Z')).total_seconds() + 86400
+        self.api = Api(domain='http://iotile.test')
+        self.fail_stream = None
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _cache(self, **kwargs):
+        return ReportCache(self.folder, ttl=60, clock=lambda: self.now, **kwargs)
+
+    def _mock(self, m):
+        streams = {
+            'count': 2,
+            'next': None,
+            'results': [{'slug': slug, 'output_unit': {'unit_short': 'G'}} for slug in self.slugs]
+        }
+        m.get('http://iotile.test/api/v1/stream/?project=p--0000-0001', text=json.dumps(streams))
+
+        def _callback(request, context):
+            if self.fail_stream and self.fail_stream in request.path:
+                context.status_code = 500
+                return 'Error'
+            return json.dumps({'count': 2, 'next': None, 'results': [{'output_value': 1.0}, {'output_value': 2.0}]})
+
+        m.get(re.compile('http://iotile.test/api/v1/stream/s--.*/data/'), text=_callback)
+
+    def test_normalize_source(self):
+        self.assertEqual(normalize_source('p--0001'), 'p--0000-0001')
+        self.assertEqual(normalize_source('d--0002'), 'd--0000-0000-0000-0002')
+        self.assertEqual(normalize_source('x--0001'), 'x--0001')
+
+    @requests_mock.Mocker()
+    def test_closed_window(self, m):
+        self._mock(m)
+        cache = self._cache()
+        gen = AccumulationReportGenerator(self.api, cache=cache)
+        stats = gen.compute_sum(['p--0001'], start=START, end=END)
+        self.assertEqual(stats['total'], 6.0)
+        calls = m.call_count
+
+        # Same report, with the same sources written differently
+        self.assertEqual(gen.compute_sum(['p--0000-0001', 'p--0001'], start=START, end=END), stats)
+        self.assertEqual(m.call_count, calls)
+
+        # Closed windows do not expire, and are found on disk by other processes
+        self.now += 365 * 86400
+        other = AccumulationReportGenerator(self.api, cache=self._cache())
+        self.assertEqual(other.compute_sum(['p--0001'], start=START, end=END), stats)
+        self.assertEqual(m.call_count, calls)
+
+        # Other parameters, generators or windows are different reports
+        StatsReportGenerator(self.api, cache=cache).compute_stats(['p--0001'], start=START, end=END)
+        self.assertGreater(m.call_count, calls)
+        calls = m.call_count
+        StatsReportGenerator(self.api, field='value', cache=cache).compute_stats(['p--0001'], start=START, end=END)
+        self.assertGreater(m.call_count, calls)
+
+        # Modified device data
+        calls = m.call_count
+        cache.invalidate(['d--0003'])
+        gen.compute_sum(['p--0001'], start=START, end=END)
+        self.assertGreater(m.call_count, calls)
+
+        calls = m.call_count
+        cache.invalidate()
+        gen.compute_sum(['p--0001'], start=START, end=END)
+        self.assertGreater(m.call_count, calls)
+
+    @requests_mock.Mocker()
+    def test_open_window(self, m):
+        self._mock(m)
+        cache = self._cache()
+        gen = AccumulationReportGenerator(self.api, cache=cache)
+
+        # The window ends less than closed_after seconds ago
+        self.now = (END - dt_parse('1970-01-01T00:00:00Z')).total_seconds() + 60
+        gen.compute_sum(['p--0001'], start=START, end=END)
+        calls = m.call_count
+        self.now += 30
+        gen.compute_sum(['p--0001'], start=START, end=END)
+        self.assertEqual(m.call_count, calls)
+
+        self.now += 30
+        gen.compute_sum(['p--0001'], start=START, end=END)
+        self.assertGreater(m.call_count, calls)
+
+        # Also on disk
+        calls = m.call_count
+        self.now += 30
+        AccumulationReportGenerator(self.api, cache=self._cache()).compute_sum(['p--0001'], start=START, end=END)
+        self.assertEqual(m.call_count, calls)
+        self.now += 60
+        AccumulationReportGenerator(self.api, cache=self._cache()).compute_sum(['p--0001'], start=START, end=END)
+        self.assertGreater(m.call_count, calls)
+
+    @requests_mock.Mocker()
+    def test_errors_not_cached(self, m):
+        self._mock(m)
+        self.fail_stream = '0003'
+        gen = AccumulationReportGenerator(self.api, cache=self._cache())
+        stats = gen.compute_sum(['p--0001'], start=START, end=END)
+        self.assertEqual(len(stats['errors']), 1)
+
+        self.fail_stream = None
+        stats = gen.compute_sum(['p--0001'], start=START, end=END)
+        self.assertEqual(stats['errors'], {})
+        self.assertEqual(stats['total'], 6.0)
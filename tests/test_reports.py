@@ -1,13 +1,22 @@
 import unittest2 as unittest
+import calendar
 import json
+import math
+import os
 import re
+import shutil
+import tempfile
+from datetime import timedelta
 import mock
 import requests
 import requests_mock
 from dateutil.parser import parse as dt_parse
 
 from iotile_cloud.utils.gid import *
+from iotile_cloud.stream import report
 from iotile_cloud.stream.report import *
+from iotile_cloud.stream.partials import PartialAggregateStore
+from iotile_cloud.stream.sketch import TDigest
 
 
 class ReportGenerationTestCase(unittest.TestCase):
@@ -19,6 +28,25 @@ class ReportGenerationTestCase(unittest.TestCase):
         ]
     }
 
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_worker_api_config(self):
+        api = Api(domain='http://iotile.test', token_type='jwt', verify=False, timeout=5.0, retries=3)
+        api.set_token('big-token')
+        report._init_worker(report._api_config(api))
+        worker_api = report._worker_api
+        self.assertEqual(worker_api.domain, 'http://iotile.test')
+        self.assertEqual(worker_api.token, 'big-token')
+        self.assertEqual(worker_api.token_type, 'jwt')
+        self.assertFalse(worker_api.session.verify)
+        adapter = worker_api.session.get_adapter('http://iotile.test')
+        self.assertEqual(adapter.timeout, 5.0)
+        self.assertEqual(adapter.max_retries.total, 3)
+
     @requests_mock.Mocker()
     def test_source_factories_project(self, m):
         api = Api(domain='http://iotile.test')
@@ -51,3 +79,223 @@ class ReportGenerationTestCase(unittest.TestCase):
         rg._fetch_stream_from_slug('s--0000-0001--0000-0000-0000-0002--5001')
         self.assertEqual(len(rg._streams), 1)
         self.assertEqual(rg._streams[0]['slug'], 's--0000-0001--0000-0000-0000-0002--5001')
+
+    @requests_mock.Mocker()
+    def test_accumulation_report(self, m):
+        api = Api(domain='http://iotile.test')
+        slugs = ['s--0000-0001--0000-0000-0000-0002--500{}'.format(i) for i in range(1, 5)]
+        streams = {
+            'count': 4,
+            'next': None,
+            'results': [{'slug': slug, 'output_unit': {'unit_short': 'G'}} for slug in slugs]
+        }
+        # Streams without an output unit have no units
+        streams['results'][1]['output_unit'] = None
+        m.get('http://iotile.test/api/v1/stream/?project=p--0000-0001', text=json.dumps(streams))
+
+        def _data(values, page, pages):
+            return json.dumps({
+                'count': len(values) * pages,
+                'next': 'more' if page < pages else None,
+                'results': [{'output_value': value} for value in values]
+            })
+
+        def _callback(request, context):
+            page = int(request.qs['page'][0])
+            if '5001' in request.path:
+                return _data([1.5, 2.5, None], page, 3)
+            if '5002' in request.path:
+                return _data([10.0], page, 1)
+            context.status_code = 404 if '5003' in request.path else 500
+            return 'Error'
+
+        m.get(re.compile('http://iotile.test/api/v1/stream/s--.*/data/'), text=_callback)
+
+        rg = AccumulationReportGenerator(api, workers=3)
+        stats = rg.compute_sum(['p--0001'], start=dt_parse('2019-01-01T00:00:00Z'), end=dt_parse('2019-02-01T00:00:00Z'))
+        self.assertEqual(list(stats['streams'].keys()), slugs[:2])
+        self.assertEqual(stats['streams'][slugs[0]], {'sum': 12.0, 'units': 'G'})
+        self.assertEqual(stats['streams'][slugs[1]], {'sum': 10.0, 'units': None})
+        self.assertEqual(stats['total'], 22.0)
+        self.assertEqual(sorted(stats['errors'].keys()), slugs[2:])
+        self.assertIn('404', stats['errors'][slugs[2]])
+        self.assertEqual(stats, AccumulationReportGenerator(api, workers=1).compute_sum(
+            ['p--0001'], start=dt_parse('2019-01-01T00:00:00Z'), end=dt_parse('2019-02-01T00:00:00Z')))
+
+    def _mock_stats_data(self, m):
+        slugs = ['s--0000-0001--0000-0000-0000-0002--500{}'.format(i) for i in range(1, 4)]
+        streams = {
+            'count': 3,
+            'next': None,
+            'results': [{'slug': slug, 'output_unit': {'unit_short': 'G'}} for slug in slugs]
+        }
+        m.get('http://iotile.test/api/v1/stream/?project=p--0000-0001', text=json.dumps(streams))
+
+        data = {
+            '5001': [('2019-01-01T10:00:00Z', 2.0), ('2019-01-01T20:00:00Z', 4.0), ('2019-01-02T01:00:00Z', None),
+                     ('2019-01-02T05:00:00Z', 6.0)],
+            '5002': [('2019-01-02T10:00:00Z', 10.0), ('2019-01-02T11:00:00Z', 18.0)],
+        }
+
+        def _callback(request, context):
+            page = int(request.qs['page'][0])
+            page_size = int(request.qs.get('page_size', [1])[0])
+            for key, items in data.items():
+                if key in request.path:
+                    results = items[(page - 1) * page_size:page * page_size]
+                    return json.dumps({
+                        'count': len(items),
+                        'next': 'more' if page * page_size < len(items) else None,
+                        'results': [{'timestamp': ts, 'output_value': value} for ts, value in results]
+                    })
+            context.status_code = 500
+            return 'Error'
+
+        m.get(re.compile('http://iotile.test/api/v1/stream/s--.*/data/'), text=_callback)
+        return slugs
+
+    @requests_mock.Mocker()
+    def test_stats_report(self, m):
+        api = Api(domain='http://iotile.test')
+        slugs = self._mock_stats_data(m)
+
+        rg = StatsReportGenerator(api, workers=2)
+        stats = rg.compute_stats(['p--0001'], start=dt_parse('2019-01-01T00:00:00Z'), end=dt_parse('2019-02-01T00:00:00Z'))
+        self.assertEqual(list(stats['streams'].keys()), slugs[:2])
+        first = stats['streams'][slugs[0]]
+        self.assertEqual(first['count'], 3)
+        self.assertEqual(first['mean'], 4.0)
+        self.assertAlmostEqual(first['stddev'], math.sqrt(8.0 / 3))
+        self.assertEqual(first['units'], 'G')
+        self.assertEqual(stats['aggregate']['count'], 5)
+        self.assertEqual(stats['aggregate']['sum'], 40.0)
+        self.assertEqual(stats['aggregate']['min'], 2.0)
+        self.assertEqual(stats['aggregate']['max'], 18.0)
+        self.assertAlmostEqual(stats['aggregate']['stddev'], math.sqrt(32.0))
+        self.assertEqual(list(stats['errors'].keys()), slugs[2:])
+
+    @requests_mock.Mocker()
+    def test_rollup_report(self, m):
+        api = Api(domain='http://iotile.test')
+        slugs = self._mock_stats_data(m)
+
+        rg = RollupReportGenerator(api, interval='day')
+        report = rg.compute_totals(['p--0001'], start=dt_parse('2019-01-01T00:00:00Z'), end=dt_parse('2019-02-01T00:00:00Z'))
+        totals = report['streams'][slugs[0]]['totals']
+        self.assertEqual([row['bucket'] for row in totals], ['2019-01-01T00:00:00.000000Z', '2019-01-02T00:00:00.000000Z'])
+        self.assertEqual(totals[0]['sum'], 6.0)
+        self.assertEqual(totals[0]['first'], 2.0)
+        self.assertEqual(totals[0]['last'], 4.0)
+        self.assertEqual(totals[1]['count'], 1)
+        self.assertEqual(report['streams'][slugs[0]]['stats']['count'], 3)
+
+        self.assertEqual([(row['count'], row['sum'], row['min'], row['max']) for row in report['totals']],
+                         [(2, 6.0, 2.0, 4.0), (3, 34.0, 6.0, 18.0)])
+        self.assertEqual(report['aggregate']['sum'], 40.0)
+        self.assertEqual(list(report['errors'].keys()), slugs[2:])
+
+        # Calendar days in the given timezone
+        report = RollupReportGenerator(api, interval='day', tz='America/Los_Angeles').compute_totals(
+            ['p--0001'], start=dt_parse('2019-01-01T00:00:00Z'), end=dt_parse('2019-02-01T00:00:00Z'))
+        self.assertEqual([row['sum'] for row in report['totals']], [12.0, 28.0])
+
+        with self.assertRaises(ValueError):
+            RollupReportGenerator(api, interval='fortnight')
+
+    @requests_mock.Mocker()
+    def test_percentile_report(self, m):
+        api = Api(domain='http://iotile.test')
+        slugs = self._mock_stats_data(m)
+
+        rg = PercentileReportGenerator(api, percentiles=[0, 50, 100], keep_digests=True)
+        report = rg.compute_percentiles(['p--0001'], start=dt_parse('2019-01-01T00:00:00Z'),
+                                        end=dt_parse('2019-02-01T00:00:00Z'))
+        first = report['streams'][slugs[0]]
+        self.assertEqual(first['count'], 3)
+        self.assertEqual(list(first['percentiles'].items()), [('p0', 2.0), ('p50', 4.0), ('p100', 6.0)])
+        self.assertEqual(first['units'], 'G')
+        self.assertEqual(report['aggregate']['count'], 5)
+        self.assertEqual(report['aggregate']['percentiles']['p50'], 6.0)
+        self.assertEqual(report['aggregate']['percentiles']['p100'], 18.0)
+        self.assertEqual(list(report['errors'].keys()), slugs[2:])
+
+        # Digests can be merged later
+        digest = TDigest.from_dict(report['streams'][slugs[0]]['digest'])
+        digest.merge(TDigest.from_dict(report['streams'][slugs[1]]['digest']))
+        self.assertEqual(digest.to_dict(), report['aggregate']['digest'])
+
+        with self.assertRaises(ValueError):
+            PercentileReportGenerator(api, percentiles=[50, 101])
+
+    @requests_mock.Mocker()
+    def test_resolve_sources(self, m):
+        api = Api(domain='http://iotile.test')
+        slugs = ['s--0000-0001--0000-0000-0000-0002--500{}'.format(i) for i in range(1, 6)]
+
+        def _project(request, context):
+            page = int(request.qs['page'][0])
+            results = [{'slug': slug} for slug in slugs[(page - 1) * 2:page * 2]]
+            return json.dumps({'count': 5, 'next': 'more' if page < 3 else None, 'results': results})
+
+        m.get('http://iotile.test/api/v1/stream/?project=p--0000-0001', text=_project)
+        m.get('http://iotile.test/api/v1/stream/?device=d--0000-0000-0000-0002', text=json.dumps(self._payload1))
+        m.get('http://iotile.test/api/v1/stream/?device=d--0000-0000-0000-0003', status_code=404)
+        m.get('http://iotile.test/api/v1/stream/{}/'.format(slugs[4]), text=json.dumps({'slug': slugs[4]}))
+
+        rg = BaseReportGenerator(api, workers=4)
+        rg._resolve_sources(['d--0002', 'p--0001', slugs[4], 'd--0003', 'x--0001'])
+        # All pages, each stream once, in source order
+        self.assertEqual(rg._stream_slugs, slugs)
+        self.assertEqual(list(rg._stream_index.keys()), slugs)
+        self.assertEqual(rg._streams[0], {'slug': slugs[0]})
+
+    @requests_mock.Mocker()
+    def test_incremental_accumulation_report(self, m):
+        api = Api(domain='http://iotile.test')
+        slug = 's--0000-0001--0000-0000-0000-0002--5001'
+        m.get('http://iotile.test/api/v1/stream/{}/'.format(slug),
+              text=json.dumps({'slug': slug, 'output_unit': {'unit_short': 'L'}}))
+
+        # One reading of 1.0 every 10 minutes
+        start = dt_parse('2019-01-01T00:00:00Z')
+        readings = [(start + timedelta(minutes=10 * i)).strftime('%Y-%m-%dT%H:%M:%SZ') for i in range(6 * 48)]
+        ranges = []
+
+        def _callback(request, context):
+            query_start = request.qs['start'][0].upper()
+            query_end = request.qs['end'][0].upper()
+            ranges.append((query_start, query_end))
+            results = [{'timestamp': ts, 'output_value': 1.0} for ts in readings if query_start <= ts < query_end]
+            return json.dumps({'count': len(results), 'next': None, 'results': results})
+
+        m.get('http://iotile.test/api/v1/stream/{}/data/'.format(slug), text=_callback)
+
+        partials = PartialAggregateStore(os.path.join(self.folder, 'partials.sqlite'))
+        rg = AccumulationReportGenerator(api, partials=partials, bucket_seconds=3600)
+        rg._clock = lambda: calendar.timegm((2019, 1, 2, 12, 30, 0))
+        stats = rg.compute_sum([slug], start=start, end=dt_parse('2019-01-02T12:30:00Z'))
+        self.assertEqual(stats['total'], 6 * 36 + 3)
+        # Closed buckets in one query, then the open bucket
+        self.assertEqual(ranges, [('2019-01-01T00:00:00Z', '2019-01-02T12:00:00Z'),
+                                  ('2019-01-02T12:00:00Z', '2019-01-02T12:30:00Z')])
+
+        # An hour later, only the last hour is downloaded, even with a new store object
+        del ranges[:]
+        rg = AccumulationReportGenerator(api, partials=PartialAggregateStore(partials.path), bucket_seconds=3600)
+        rg._clock = lambda: calendar.timegm((2019, 1, 2, 13, 30, 0))
+        stats = rg.compute_sum([slug], start=start, end=dt_parse('2019-01-02T13:30:00Z'))
+        self.assertEqual(stats['total'], 6 * 37 + 3)
+        self.assertEqual(ranges, [('2019-01-02T12:00:00Z', '2019-01-02T13:00:00Z'),
+                                  ('2019-01-02T13:00:00Z', '2019-01-02T13:30:00Z')])
+
+        # Windows not aligned on buckets download their partial buckets
+        del ranges[:]
+        stats = rg.compute_sum([slug], start=dt_parse('2019-01-01T00:30:00Z'), end=dt_parse('2019-01-01T02:15:00Z'))
+        self.assertEqual(stats['total'], 3 + 6 + 2)
+        self.assertEqual(ranges, [('2019-01-01T00:30:00Z', '2019-01-01T01:00:00Z'),
+                                  ('2019-01-01T02:00:00Z', '2019-01-01T02:15:00Z')])
+        self.assertEqual(stats['streams'][slug]['units'], 'L')
+
+        m.get('http://iotile.test/api/v1/stream/{}/'.format(slug), text=json.dumps({'slug': slug, 'output_unit': None}))
+        stats = rg.compute_sum([slug], start=start, end=dt_parse('2019-01-02T13:30:00Z'))
+        self.assertEqual(stats['streams'][slug], {'sum': 6 * 37 + 3, 'units': None})
@@ -0,0 +1,71 @@
+import json
+import unittest2 as unittest
+import numpy as np
+
+from iotile_cloud.stream.sketch import TDigest
+
+
+def _rank_error(values, estimate, q):
+    return abs(np.mean(values < estimate) - q)
+
+
+class TDigestTestCase(unittest.TestCase):
+
+    def test_empty(self):
+        digest = TDigest()
+        self.assertEqual(digest.count, 0)
+        self.assertIsNone(digest.quantile(0.5))
+        self.assertEqual(len(digest), 0)
+        digest.add([None, float('nan')])
+        self.assertEqual(digest.count, 0)
+        with self.assertRaises(ValueError):
+            digest.quantile(1.5)
+        with self.assertRaises(ValueError):
+            TDigest(compression=1)
+
+    def test_small(self):
+        digest = TDigest().add([5.0])
+        self.assertEqual(digest.percentiles([0, 50, 100]), [5.0, 5.0, 5.0])
+
+        digest = TDigest().add([1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(digest.quantile(0), 1.0)
+        self.assertEqual(digest.quantile(1), 4.0)
+        self.assertEqual(digest.quantile(0.5), 2.5)
+
+    def test_accuracy(self):
+        rng = np.random.RandomState(42)
+        for values in [rng.normal(size=100000), rng.exponential(size=100000)]:
+            digest = TDigest()
+            for page in np.array_split(values, 100):
+                digest.add(page)
+            self.assertEqual(digest.count, len(values))
+            self.assertLessEqual(len(digest), 60)
+            self.assertEqual(digest.min, values.min())
+            self.assertEqual(digest.quantile(1), values.max())
+            for q in [0.01, 0.5, 0.95, 0.99, 0.999]:
+                self.assertLess(_rank_error(values, digest.quantile(q), q), 0.002)
+
+    def test_merge_and_serialize(self):
+        rng = np.random.RandomState(7)
+        values = rng.lognormal(size=50000)
+        merged = TDigest()
+        for part in np.array_split(values, 20):
+            # As if computed in another process, and cached as JSON
+            data = json.loads(json.dumps(TDigest().add(part).to_dict()))
+            merged.merge(TDigest.from_dict(data))
+        merged.merge(TDigest())
+
+        self.assertEqual(merged.count, len(values))
+        self.assertEqual(merged.max, values.max())
+        for q, estimate in zip([0.5, 0.95, 0.99], merged.percentiles([50, 95, 99])):
+            self.assertLess(_rank_error(values, estimate, q), 0.003)
+
+    def test_count_after_merge(self):
+        big = TDigest().add(np.arange(5000, dtype='float64'))
+        self.assertLess(len(big), 5000)
+        digest = TDigest().add([1.0])
+        # Buffered centroids count with their weights, before and after compressing
+        digest.merge(big)
+        self.assertEqual(digest.count, 5001)
+        self.assertEqual(len(digest), len(digest._means))
+        self.assertEqual(digest.count, 5001)
@@ -0,0 +1,54 @@
+import unittest2 as unittest
+import numpy as np
+
+from iotile_cloud.stream import stats as stats_module
+from iotile_cloud.stream.stats import RunningStats
+
+
+class RunningStatsTestCase(unittest.TestCase):
+    values = [2.0, 4.0, 4.0, 4.0, 5.0, 5.0, 7.0, 9.0]
+
+    def test_add(self):
+        stats = RunningStats()
+        self.assertEqual(stats.count, 0)
+        self.assertIsNone(stats.stddev)
+        self.assertIsNone(stats.to_dict()['mean'])
+
+        stats.add(self.values[:3]).add([None, float('nan')]).add(self.values[3:])
+        self.assertEqual(stats.count, 8)
+        self.assertEqual(stats.sum, 40.0)
+        self.assertEqual(stats.min, 2.0)
+        self.assertEqual(stats.max, 9.0)
+        self.assertEqual(stats.mean, 5.0)
+        self.assertAlmostEqual(stats.stddev, 2.0)
+
+    def test_merge(self):
+        first = RunningStats().add(self.values[:5])
+        second = RunningStats().add(self.values[5:])
+        merged = RunningStats().merge(first).merge(RunningStats()).merge(second)
+        self.assertEqual(merged.count, 8)
+        self.assertAlmostEqual(merged.mean, 5.0)
+        self.assertAlmostEqual(merged.variance, 4.0)
+
+        copy = RunningStats.from_dict(merged.to_dict())
+        self.assertEqual(copy.to_dict(), merged.to_dict())
+        self.assertEqual(RunningStats.from_dict(RunningStats().to_dict()).count, 0)
+
+    def test_numerical_stability(self):
+        # Large offset, small variance: a naive sum of squares loses all precision
+        values = np.array([4.0, 7.0, 13.0, 16.0]) + 1e9
+        stats = RunningStats()
+        for _ in range(1000):
+            stats.add(values)
+        self.assertAlmostEqual(stats.mean, 1e9 + 10.0, places=4)
+        self.assertAlmostEqual(stats.variance, 22.5, places=4)
+
+    def test_pure_python(self):
+        expected = RunningStats().add(self.values).to_dict()
+        stats_module.HAS_NUMPY = False
+        try:
+            stats = RunningStats().add(self.values[:4] + [None]).add(self.values[4:])
+        finally:
+            stats_module.HAS_NUMPY = True
+        for name, value in expected.items():
+            self.assertAlmostEqual(stats.to_dict()[name], value)
@@ -0,0 +1,101 @@
+import json
+import mock
+import os
+import shutil
+import tempfile
+import requests_mock
+import unittest2 as unittest
+import numpy as np
+
+from iotile_cloud.api.connection import Api
+from iotile_cloud.stream.data import StreamData
+from iotile_cloud.stream.store import ColumnStore
+
+
+class ColumnStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = ColumnStore(self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_append_and_read(self):
+        timestamps = np.array(['2019-01-01T00:00', '2019-01-01T01:00', '2019-01-01T02:00'], dtype='datetime64[ns]')
+        self.assertEqual(self.store.append('s--0001', timestamps, [1.0, 2.0, 3.0], [1, 2, 3]), 3)
+        # Overlapping download: ID 3 is already stored
+        later = np.array(['2019-01-01T02:00', '2019-01-01T02:00', '2019-01-01T03:00'], dtype='datetime64[ns]')
+        self.assertEqual(self.store.append('s--0001', later, [3.0, 3.5, 4.0], [3, 4, 5]), 2)
+
+        self.assertEqual(self.store.streams(), ['s--0001'])
+        self.assertEqual(self.store.count('s--0001'), 5)
+        self.assertEqual(self.store.count('s--0002'), 0)
+
+        columns = self.store.read('s--0001', start='2019-01-01T01:00:00Z', end='2019-01-01T03:00:00Z')
+        self.assertIsInstance(columns['value'], np.memmap)
+        np.testing.assert_array_equal(columns['id'], [2, 3, 4])
+        np.testing.assert_array_equal(columns['value'], [2.0, 3.0, 3.5])
+        self.assertEqual(columns['timestamp'][0], np.datetime64('2019-01-01T01:00', 'ns'))
+        self.assertFalse(columns['value'].flags.writeable)
+
+        self.assertEqual(len(self.store.read('s--0001', start='2020-01-01T00:00:00Z')['id']), 0)
+        self.assertEqual(len(self.store.read('s--0002')['id']), 0)
+
+    def test_merge_older_data(self):
+        self.store.append('s--0001', np.array([20, 30], dtype='int64'), [2.0, 3.0], [2, 3])
+        self.assertEqual(self.store.append('s--0001', np.array([30, 10], dtype='int64'), [3.0, 1.0], [3, 1]), 1)
+        columns = self.store.read('s--0001')
+        np.testing.assert_array_equal(columns['timestamp'].astype('int64'), [10, 20, 30])
+        np.testing.assert_array_equal(columns['id'], [1, 2, 3])
+
+        self.store.delete('s--0001')
+        self.assertNotIn('s--0001', self.store)
+        self.assertRaises(ValueError, self.store.count, '../s--0001')
+
+    def test_interrupted_merge(self):
+        self.store.append('s--0001', np.array([20, 30], dtype='int64'), [2.0, 3.0], [2, 3])
+
+        # Fails after writing two of the three columns of the new generation
+        with mock.patch('iotile_cloud.stream.store.os.fsync', side_effect=[None, None, OSError('disk full')]):
+            self.assertRaises(OSError, self.store.append, 's--0001', np.array([10], dtype='int64'), [1.0], [1])
+        columns = self.store.read('s--0001')
+        np.testing.assert_array_equal(columns['timestamp'].astype('int64'), [20, 30])
+        np.testing.assert_array_equal(columns['value'], [2.0, 3.0])
+        np.testing.assert_array_equal(columns['id'], [2, 3])
+
+        self.assertEqual(self.store.append('s--0001', np.array([10], dtype='int64'), [1.0], [1]), 1)
+        np.testing.assert_array_equal(self.store.read('s--0001')['id'], [1, 2, 3])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.folder, 's--0001'))), ['CURRENT', 'g000002'])
+
+    def test_columns_without_generation(self):
+        # Columns stored directly in the stream directory are read, and moved to a generation by a merge
+        folder = os.path.join(self.folder, 's--0001')
+        os.makedirs(folder)
+        for filename, column in [('timestamp.i8', [20, 30]), ('value.f8', [2.0, 3.0]), ('id.i8', [2, 3])]:
+            np.array(column, dtype=filename[-2] + '8').tofile(os.path.join(folder, filename))
+        self.assertEqual(self.store.streams(), ['s--0001'])
+        np.testing.assert_array_equal(self.store.read('s--0001')['value'], [2.0, 3.0])
+
+        self.assertEqual(self.store.append('s--0001', np.array([10], dtype='int64'), [1.0], [1]), 1)
+        np.testing.assert_array_equal(self.store.read('s--0001')['value'], [1.0, 2.0, 3.0])
+        self.assertEqual(sorted(os.listdir(folder)), ['CURRENT', 'g000001'])
+
+    @requests_mock.Mocker()
+    def test_ingest(self, m):
+        def _callback(request, context):
+            start = request.qs.get('start', [''])[0]
+            results = [{'id': i, 'timestamp': '2019-01-01T00:00:0{0}Z'.format(i), 'value': i * 1.5} for i in range(6)]
+            results = [item for item in results if item['timestamp'].lower() >= start]
+            return json.dumps({'next': None, 'count': len(results), 'results': results})
+
+        m.get('http://iotile.test/api/v1/stream/s--0001/data/', text=_callback)
+        api = Api(domain='http://iotile.test')
+
+        self.assertEqual(self.store.ingest(StreamData('s--0001', api)), 6)
+        # Incremental: starts from the last stored timestamp, and skips the ID already stored
+        self.assertEqual(self.store.ingest(StreamData('s--0001', api)), 0)
+        self.assertEqual(m.last_request.qs['start'], ['2019-01-01t00:00:05.000000z'])
+
+        other = ColumnStore(self.folder)
+        np.testing.assert_array_equal(other.read('s--0001')['value'], [i * 1.5 for i in range(6)])
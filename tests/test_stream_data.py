@@ -1,5 +1,6 @@
 import sys
 import json
+import pickle
 import mock
 import requests
 import requests_mock
@@ -7,6 +8,8 @@ import unittest2 as unittest
 
 from iotile_cloud.api.connection import Api
 from iotile_cloud.stream.data import StreamData
+from iotile_cloud.stream.paging import PageSizeController
+from iotile_cloud.utils.timestamp import parse_timestamp
 
 
 class StreamDataTestCase(unittest.TestCase):
@@ -65,6 +68,186 @@ class StreamDataTestCase(unittest.TestCase):
         self.stream_data.initialize_from_server(lastn=6)
         self.assertEqual(len(self.stream_data.data), 6)
 
+    @requests_mock.Mocker()
+    def test_fields_projection(self, m):
+        m.get('http://iotile.test/api/v1/stream/s--0001/data/', text=self._multi_page_callback)
+
+        self.stream_data.initialize_from_server(fields=['timestamp', 'value'], lastn=6)
+        self.assertEqual(len(self.stream_data.data), 6)
+        self.assertEqual(m.request_history[0].qs['fields'], ['timestamp,value'])
+
+        item = self.stream_data.data[0]
+        self.assertFalse(isinstance(item, dict))
+        self.assertEqual(item.timestamp, '20170109T10:00:00')
+        self.assertEqual(item['value'], 10)
+        self.assertEqual(item.get('output_value'), None)
+        self.assertRaises(KeyError, lambda: item['output_value'])
+        self.assertEqual(tuple(item), ('20170109T10:00:00', 10))
+
+        # Records are compact tuples and can be pickled
+        self.assertFalse(hasattr(item, '__dict__'))
+        self.assertEqual(pickle.loads(pickle.dumps(item)), item)
+
+    @requests_mock.Mocker()
+    def test_iterators(self, m):
+        m.get('http://iotile.test/api/v1/stream/s--0001/data/', text=self._multi_page_callback)
+
+        pages = list(self.stream_data.iter_pages(lastn=6))
+        self.assertEqual([len(page) for page in pages], [3, 3])
+        self.assertTrue(isinstance(pages[0][0], dict))
+
+        values = [item.value for item in self.stream_data.iter_records(fields=['value', 'missing'], lastn=6)]
+        self.assertEqual(values, [10, 20, 30, 10, 20, 30])
+        # Iterators do not keep data
+        self.assertEqual(len(self.stream_data.data), 0)
+
+    def _offset_page_callback(self, request, context):
+        page = int(request.qs['page'][0])
+        page_size = int(request.qs['page_size'][0])
+        total = 10000
+        first = (page - 1) * page_size
+        last = min(page * page_size, total)
+        payload = {
+            'next': 'more' if last < total else None,
+            'count': total,
+            'results': [{'id': i, 'value': i} for i in range(first, last)]
+        }
+        context.status_code = 200
+        return json.dumps(payload)
+
+    @requests_mock.Mocker()
+    def test_adaptive_page_size(self, m):
+        m.get('http://iotile.test/api/v1/stream/s--0001/data/', text=self._offset_page_callback)
+
+        self.stream_data.page_size_controller = PageSizeController(initial=500, minimum=100, maximum=4000,
+                                                                   target_latency=100)
+        self.stream_data.initialize_from_server(fields=['id'])
+        self.assertEqual([item.id for item in self.stream_data.data], list(range(10000)))
+
+        sizes = [int(r.qs['page_size'][0]) for r in m.request_history]
+        pages = [int(r.qs['page'][0]) for r in m.request_history]
+        self.assertEqual(sizes, [500, 500, 1000, 2000, 4000, 4000])
+        self.assertEqual(pages, [1, 2, 2, 2, 2, 3])
+
+    def _capped_page_callback(self, request, context, cap=1000):
+        # Like DRF with max_page_size=1000: larger page sizes are reduced to 1000, pages included
+        page = int(request.qs['page'][0])
+        page_size = min(int(request.qs['page_size'][0]), cap)
+        total = 6000
+        first = (page - 1) * page_size
+        last = min(page * page_size, total)
+        payload = {
+            'next': 'more' if last < total else None,
+            'count': total,
+            'results': [{'id': i, 'value': i} for i in range(first, last)]
+        }
+        context.status_code = 200
+        return json.dumps(payload)
+
+    @requests_mock.Mocker()
+    def test_capped_page_size(self, m):
+        m.get('http://iotile.test/api/v1/stream/s--0001/data/', text=self._capped_page_callback)
+
+        # Grows above the cap after a few pages
+        self.stream_data.page_size_controller = PageSizeController(initial=500, minimum=100, maximum=8000,
+                                                                   target_latency=100)
+        self.stream_data.initialize_from_server(fields=['id'])
+        self.assertEqual([item.id for item in self.stream_data.data], list(range(6000)))
+        self.assertEqual(self.stream_data.page_size_controller.page_size, 1000)
+
+        # Capped from the first page
+        m.reset_mock()
+        self.stream_data.page_size_controller = PageSizeController(initial=4000, target_latency=100)
+        self.stream_data.initialize_from_server(fields=['id'])
+        self.assertEqual([item.id for item in self.stream_data.data], list(range(6000)))
+        sizes = [int(r.qs['page_size'][0]) for r in m.request_history]
+        self.assertEqual(sizes, [4000] + [1000] * 5)
+
+        # Capped at a size the records downloaded so far are not a multiple of
+        m.reset_mock()
+        self.stream_data.page_size_controller = PageSizeController(initial=600, minimum=600, maximum=1200,
+                                                                   target_latency=100)
+        self.stream_data.initialize_from_server(fields=['id'])
+        self.assertEqual([item.id for item in self.stream_data.data], list(range(6000)))
+
+        # Capped at a size that does not divide the records downloaded so far: one page of the capped
+        # size, without the records already downloaded, then whole pages
+        m.reset_mock()
+        m.get('http://iotile.test/api/v1/stream/s--0001/data/',
+              text=lambda request, context: self._capped_page_callback(request, context, cap=1999))
+        self.stream_data.page_size_controller = PageSizeController(initial=1000, target_latency=100)
+        self.stream_data.initialize_from_server(fields=['id'])
+        self.assertEqual([item.id for item in self.stream_data.data], list(range(6000)))
+        queries = [(int(r.qs['page'][0]), int(r.qs['page_size'][0])) for r in m.request_history]
+        self.assertEqual(queries, [(1, 1000), (2, 1000), (2, 2000), (2, 1999), (3, 1999), (4, 1999)])
+
+    def _capped_keyset_callback(self, request, context):
+        # Server capped at 100 records per page, with 250 records at the same timestamp
+        records = [{'id': i, 'timestamp': '2019-01-01T00:00:00Z', 'value': i} for i in range(5)]
+        records += [{'id': i, 'timestamp': '2019-01-01T00:00:01.500000Z', 'value': i} for i in range(5, 255)]
+        records += [{'id': i, 'timestamp': '2019-01-01T00:00:02Z', 'value': i} for i in range(255, 260)]
+        if 'start' in request.qs:
+            start = parse_timestamp(request.qs['start'][0].upper())
+            records = [x for x in records if parse_timestamp(x['timestamp']) >= start]
+        if 'end' in request.qs:
+            end = parse_timestamp(request.qs['end'][0].upper())
+            records = [x for x in records if parse_timestamp(x['timestamp']) < end]
+        page = int(request.qs['page'][0])
+        page_size = min(int(request.qs['page_size'][0]), 100)
+        last = min(page * page_size, len(records))
+        return json.dumps({
+            'next': 'more' if last < len(records) else None,
+            'count': len(records),
+            'results': records[(page - 1) * page_size:last]
+        })
+
+    @requests_mock.Mocker()
+    def test_capped_keyset_paging(self, m):
+        m.get('http://iotile.test/api/v1/stream/s--0001/data/', text=self._capped_keyset_callback)
+
+        records = list(self.stream_data.iter_records(fields=['id'], keyset=True, page_size=50))
+        self.assertEqual([item.id for item in records], list(range(260)))
+        self.assertLess(len(m.request_history), 20)
+
+        m.reset_mock()
+        records = list(self.stream_data.iter_records(fields=['id'], keyset=True))
+        self.assertEqual([item.id for item in records], list(range(260)))
+
+    @requests_mock.Mocker()
+    def test_fixed_page_size(self, m):
+        m.get('http://iotile.test/api/v1/stream/s--0001/data/', text=self._offset_page_callback)
+
+        self.stream_data.initialize_from_server(page_size=3000)
+        self.assertEqual(len(self.stream_data.data), 10000)
+        self.assertEqual([r.qs['page_size'] for r in m.request_history], [['3000']] * 4)
+
+    def test_page_size_controller(self):
+        controller = PageSizeController(initial=1000, minimum=125, maximum=8000, target_latency=1.0)
+        self.assertEqual(controller.page_size, 1000)
+
+        # Fast full pages grow the page size up to the maximum
+        for i in range(5):
+            controller.record(controller.page_size, 0.01, controller.page_size, 1000)
+        self.assertEqual(controller.page_size, 8000)
+
+        # Short pages do not grow it
+        controller = PageSizeController(initial=1000, target_latency=1.0)
+        controller.record(1000, 0.01, 10)
+        self.assertEqual(controller.page_size, 1000)
 
+        # Slow pages shrink it, one step at a time
+        controller.record(1000, 20.0, 1000)
+        self.assertEqual(controller.page_size, 500)
+        for i in range(10):
+            controller.record(controller.page_size, 20.0, controller.page_size)
+        self.assertEqual(controller.page_size, 125)
+        self.assertEqual(len(controller.history), 12)
 
+        # Large records are bounded by max_bytes
+        controller = PageSizeController(initial=1000, target_latency=10.0, max_bytes=1000000)
+        controller.record(1000, 0.01, 1000, 1000000)
+        self.assertEqual(controller.page_size, 1000)
+        controller.record(1000, 0.01, 1000, 4000000)
+        self.assertEqual(controller.page_size, 500)
 
+        self.assertRaises(ValueError, PageSizeController, initial=100, minimum=200, maximum=100)
@@ -0,0 +1,50 @@
+import datetime
+import unittest2 as unittest
+import numpy as np
+from dateutil.tz import tzutc, tzoffset
+
+from iotile_cloud.api.connection import Api
+from iotile_cloud.stream.data import StreamData
+from iotile_cloud.utils.timestamp import parse_timestamp, parse_timestamps, TimestampParseError
+
+
+class TimestampTestCase(unittest.TestCase):
+
+    def test_parse_fast_format(self):
+        dt = parse_timestamp('2017-04-11T20:37:29.608972Z')
+        self.assertEqual(dt, datetime.datetime(2017, 4, 11, 20, 37, 29, 608972, tzinfo=tzutc()))
+
+        dt = parse_timestamp('2017-04-11T20:37:29Z')
+        self.assertEqual(dt, datetime.datetime(2017, 4, 11, 20, 37, 29, tzinfo=tzutc()))
+
+        dt = parse_timestamp('2017-04-11T20:37:29.5Z')
+        self.assertEqual(dt.microsecond, 500000)
+
+    def test_parse_fallback_format(self):
+        dt = parse_timestamp('2017-04-11T20:37:29+02:00')
+        self.assertEqual(dt, datetime.datetime(2017, 4, 11, 20, 37, 29, tzinfo=tzoffset(None, 7200)))
+
+        dt = parse_timestamp('2017-04-11T20:37:29.123456789Z')
+        self.assertEqual(dt.replace(microsecond=0), datetime.datetime(2017, 4, 11, 20, 37, 29, tzinfo=tzutc()))
+
+    def test_parse_bad_value(self):
+        self.assertRaises(TimestampParseError, parse_timestamp, 'not a date')
+        self.assertRaises(TimestampParseError, parse_timestamp, '2017-13-11T20:37:29Z')
+        self.assertRaises(TimestampParseError, parse_timestamp, None)
+
+        # TimestampParseError is a ValueError
+        self.assertRaises(ValueError, StreamData('s--0001', Api(domain='http://iotile.test'))._date_format, 'bad')
+
+    def test_parse_vectorized(self):
+        result = parse_timestamps(['2017-04-11T20:37:29.608972Z', '2017-04-11T20:37:30Z'])
+        self.assertEqual(result.dtype, np.dtype('datetime64[us]'))
+        self.assertEqual(result[0], np.datetime64('2017-04-11T20:37:29.608972'))
+        self.assertEqual(result[1], np.datetime64('2017-04-11T20:37:30'))
+
+        # Mixed formats are converted to UTC one by one
+        result = parse_timestamps(['2017-04-11T20:37:29Z', '2017-04-11T20:37:29+02:00'], unit='ns')
+        self.assertEqual(result.dtype, np.dtype('datetime64[ns]'))
+        self.assertEqual(result[1], np.datetime64('2017-04-11T18:37:29'))
+
+        self.assertEqual(len(parse_timestamps([])), 0)
+        self.assertRaises(TimestampParseError, parse_timestamps, ['2017-04-11T20:37:29Z', 'garbage'])
@@ -0,0 +1,35 @@
+import unittest2 as unittest
+
+from iotile_cloud.stream.data import get_record_class
+from iotile_cloud.stream.topk import TopKEvents
+
+
+def _events(peaks, device='d--0001'):
+    return [{'id': i, 'device': device, 'extra_data': {'peak': peak}} for i, peak in enumerate(peaks)]
+
+
+class TopKEventsTestCase(unittest.TestCase):
+
+    def test_top_k(self):
+        selector = TopKEvents(3)
+        selector.add_page(_events([5.0, 1.0, 9.0]))
+        selector.add_page(_events([2.0, 7.0, None, 9.0]))
+        selector.add_page([{'id': 99, 'extra_data': {}}])
+        self.assertEqual(selector.count, 6)
+        self.assertEqual(selector.groups, [None])
+        self.assertEqual([e['extra_data']['peak'] for e in selector.top()], [9.0, 9.0, 7.0])
+        # Ties keep the first event seen first
+        self.assertEqual([e['id'] for e in selector.top()], [2, 3, 1])
+
+    def test_groups(self):
+        record_class = get_record_class(['id', 'device', 'extra_data'])
+        selector = TopKEvents(2, key=lambda event: -event['id'], group_by=lambda event: event['device'])
+        for event in _events([1, 2, 3], 'd--0001') + _events([1, 2, 3, 4], 'd--0002'):
+            selector.add(record_class(event['id'], event['device'], event['extra_data']))
+        selector.add_page(_events([1]), group='other')
+
+        results = selector.results()
+        self.assertEqual(list(results.keys()), ['d--0001', 'd--0002', 'other'])
+        self.assertEqual([e['id'] for e in results['d--0002']], [0, 1])
+        self.assertEqual(len(results['other']), 1)
+        self.assertRaises(ValueError, TopKEvents, 0)
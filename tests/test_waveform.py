@@ -0,0 +1,56 @@
+import unittest2 as unittest
+import numpy as np
+
+from iotile_cloud.stream.waveform import pack_waveforms, compute_shock_features
+
+
+def _event(frequency, amplitude, length, sample_rate=1000.0):
+    t = np.arange(length) / sample_rate
+    return {
+        'acceleration_data': {
+            'x': list(amplitude * np.sin(2 * np.pi * frequency * t)),
+            'y': [0.0] * length,
+            'z': [1.0] * length,
+        }
+    }
+
+
+class WaveformTestCase(unittest.TestCase):
+
+    def test_pack_waveforms(self):
+        ids, waveforms, lengths = pack_waveforms([(10, _event(50, 1.0, 100)), (11, None), (12, _event(50, 1.0, 64))])
+        self.assertEqual(ids, [10, 12])
+        self.assertEqual(waveforms.shape, (2, 3, 100))
+        self.assertEqual(list(lengths), [100, 64])
+        self.assertEqual(waveforms[1, 2, 63], 1.0)
+        self.assertEqual(waveforms[1, 2, 64], 0.0)
+
+    def test_features(self):
+        details = {
+            1: _event(50, 3.0, 1000),
+            2: _event(120, 1.0, 500),
+            3: {'acceleration_data': {'x': [0.0, 4.0, 0.0], 'y': [0.0, 3.0, 0.0], 'z': [0.0, 0.0, 0.0]}},
+        }
+        features = compute_shock_features(details, sample_rate=1000.0, threshold=2.0)
+        self.assertEqual(features['id'], [1, 2, 3])
+
+        self.assertAlmostEqual(features['dominant_frequency'][0], 50.0)
+        self.assertAlmostEqual(features['dominant_frequency'][1], 120.0)
+        self.assertAlmostEqual(features['peak_x'][0], 3.0, places=2)
+        self.assertAlmostEqual(features['peak_z'][1], 1.0)
+        self.assertAlmostEqual(features['peak'][2], 5.0)
+        self.assertAlmostEqual(features['rms'][2], np.sqrt(25.0 / 3))
+        # sqrt(9 sin^2 + 1) > 2 for |sin| > 0.577: 7 of every 10 samples at 18 degree steps
+        self.assertAlmostEqual(features['duration_above'][0], 0.7)
+        self.assertAlmostEqual(features['duration_above'][2], 0.001)
+
+    def test_process_pool(self):
+        details = [(i, _event(10 + i, 1.0 + i, 200 + i)) for i in range(30)]
+        serial = compute_shock_features(details, sample_rate=1000.0, threshold=1.5)
+        parallel = compute_shock_features(details, sample_rate=1000.0, threshold=1.5, workers=2, chunk_size=7)
+        self.assertEqual(parallel['id'], list(range(30)))
+        for name, values in serial.items():
+            np.testing.assert_allclose(parallel[name], values)
+
+        empty = compute_shock_features({}, sample_rate=1000.0, threshold=1.0)
+        self.assertEqual(len(empty['peak']), 0)
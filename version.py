@@ -1 +1 @@
-version = '0.9.14'
+version = '0.10.0'